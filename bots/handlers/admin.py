@@ -11,13 +11,18 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from database.models.user import User
-from database.models.duel import Duel, DuelStatus
+from database.models.duel import Duel, DuelStatus, CoinSide
 from database.models.transaction import Transaction, TransactionType, TransactionStatus
-from database.connection import async_session
+from database.models.partition_rollup import PartitionRollup
+from database.connection import read_scope
+from database.replica import replica_router
 from services.game_service import game_service
+from services.username_resolver import username_resolver
+from bots.keyboards.main_menu import get_pagination_rows
 from config.settings import ADMIN_IDS, BOT_WALLET_ADDRESS, MORI_TOKEN_MINT
 from utils.logger import setup_logger
-from sqlalchemy import text
+from utils.pagination import parse_page_data
+from sqlalchemy import text, select, func
 from typing import Optional
 
 router = Router()
@@ -176,9 +181,9 @@ async def admin_house_duels(callback: CallbackQuery):
     duels_text = "🏠 Активные House дуэли:\n\n"
     keyboard_rows = []
 
+    player_names = await username_resolver.display_names((duel.player1_id for duel in house_duels), fallback="User")
     for duel in house_duels:
-        player = await User.get_by_telegram_id(duel.player1_id)
-        player_name = player.username if player and player.username else f"User {duel.player1_id}"
+        player_name = player_names[duel.player1_id]
 
         duels_text += f"🎮 Дуэль #{duel.id}\n"
         duels_text += f"👤 @{player_name} vs {duel.house_account_name}\n"
@@ -207,7 +212,8 @@ async def admin_house_duels(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("house_win_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("house_win_"), flags={"db_session": False})
 async def admin_house_decision(callback: CallbackQuery):
     """Админ решение для House дуэли"""
     if not is_admin(callback.from_user.id):
@@ -353,33 +359,34 @@ async def admin_detailed_stats(callback: CallbackQuery):
 # РЕАЛЬНЫЕ функции для получения данных из БД
 async def get_admin_stats() -> dict:
     """Получить основную статистику для админки"""
-    async with async_session() as session:
+    async with replica_router.session() as session:
         try:
-            # Общая статистика
+            # Итоги за все время: закрытые месяцы из partition_rollups, живой подсчет - только по свежим партициям
+            duel_totals = await PartitionRollup.get_totals("duels", session=session)
+
+            # Условие на created_at отсекает старые партиции (дуэль длится меньше суток)
             result = await session.execute(text("""
                 SELECT 
                     (SELECT COUNT(*) FROM users) as users_count,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished'::duelstatus) as total_games,
-                    (SELECT COALESCE(SUM(stake * 2), 0) FROM duels WHERE status = 'finished'::duelstatus) as total_volume,
-                    (SELECT COALESCE(SUM(house_commission), 0) FROM duels WHERE status = 'finished'::duelstatus) as total_commission,
                     (SELECT COUNT(*) FROM users WHERE created_at >= NOW() - INTERVAL '24 hours') as new_users_24h,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished'::duelstatus AND finished_at >= NOW() - INTERVAL '24 hours') as games_24h,
-                    (SELECT COALESCE(SUM(stake * 2), 0) FROM duels WHERE status = 'finished'::duelstatus AND finished_at >= NOW() - INTERVAL '24 hours') as volume_24h,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'active'::duelstatus AND is_house_duel = true) as active_house_duels,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished'::duelstatus AND is_house_duel = true) as total_house_games
+                    (SELECT COUNT(*) FROM duels WHERE status = 'FINISHED' AND finished_at >= NOW() - INTERVAL '24 hours'
+                        AND created_at >= NOW() - INTERVAL '48 hours') as games_24h,
+                    (SELECT COALESCE(SUM(stake * 2), 0) FROM duels WHERE status = 'FINISHED' AND finished_at >= NOW() - INTERVAL '24 hours'
+                        AND created_at >= NOW() - INTERVAL '48 hours') as volume_24h,
+                    (SELECT COUNT(*) FROM duels WHERE status = 'ACTIVE' AND is_house_duel = true) as active_house_duels
             """))
 
             stats = result.fetchone()
             return {
                 'users_count': stats.users_count,
-                'total_games': stats.total_games,
-                'total_volume': float(stats.total_volume),
-                'total_commission': float(stats.total_commission),
+                'total_games': int(duel_totals["finished"]),
+                'total_volume': float(duel_totals["stake_sum"] * 2),
+                'total_commission': float(duel_totals["commission_sum"]),
                 'new_users_24h': stats.new_users_24h,
                 'games_24h': stats.games_24h,
                 'volume_24h': float(stats.volume_24h),
                 'active_house_duels': stats.active_house_duels,
-                'total_house_games': stats.total_house_games
+                'total_house_games': int(duel_totals["house_finished"])
             }
         except Exception as e:
             logger.error(f"❌ Error getting admin stats: {e}")
@@ -389,7 +396,7 @@ async def get_admin_stats() -> dict:
 
 async def get_top_users(limit: int = 10) -> list:
     """Получить топ пользователей"""
-    async with async_session() as session:
+    async with replica_router.session() as session:
         try:
             result = await session.execute(text("""
                 SELECT 
@@ -409,7 +416,7 @@ async def get_top_users(limit: int = 10) -> list:
 
 async def get_active_duels() -> list:
     """Получить активные дуэли"""
-    async with async_session() as session:
+    async with read_scope() as session:
         try:
             result = await session.execute(text("""
                 SELECT 
@@ -432,7 +439,7 @@ async def get_active_duels() -> list:
 
 async def get_recent_transactions(limit: int = 10) -> list:
     """Получить последние транзакции"""
-    async with async_session() as session:
+    async with replica_router.session() as session:
         try:
             result = await session.execute(text("""
                 SELECT 
@@ -452,7 +459,7 @@ async def get_recent_transactions(limit: int = 10) -> list:
 
 async def get_pending_transactions_count() -> int:
     """Получить количество ожидающих транзакций"""
-    async with async_session() as session:
+    async with read_scope() as session:
         try:
             result = await session.execute(text("""
                 SELECT COUNT(*) FROM transactions WHERE status = 'pending'::transactionstatus
@@ -465,18 +472,18 @@ async def get_pending_transactions_count() -> int:
 
 async def get_detailed_stats() -> dict:
     """Получить детальную статистику"""
-    async with async_session() as session:
+    async with replica_router.session() as session:
         try:
+            # Дуэли - из помесячных итогов (живой подсчет только по свежим партициям)
+            duel_totals = await PartitionRollup.get_totals("duels", session=session)
+            total_duels = int(duel_totals["finished"])
+            house_duels = int(duel_totals["house_finished"])
+            total_volume = float(duel_totals["stake_sum"] * 2)
+            total_commission = float(duel_totals["commission_sum"])
+
             result = await session.execute(text("""
                 SELECT 
                     (SELECT COALESCE(SUM(balance), 0) FROM users) as total_user_balance,
-                    (SELECT COALESCE(SUM(stake * 2), 0) FROM duels WHERE status = 'finished') as total_volume,
-                    (SELECT COALESCE(SUM(house_commission), 0) FROM duels WHERE status = 'finished') as total_commission,
-                    (SELECT COALESCE(SUM(winner_amount), 0) FROM duels WHERE status = 'finished' AND winner_amount IS NOT NULL) as total_winnings,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished') as total_duels,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished' AND is_house_duel = true) as house_duels,
-                    (SELECT COUNT(*) FROM duels WHERE status = 'finished' AND is_house_duel = false) as real_duels,
-                    (SELECT COALESCE(AVG(stake), 0) FROM duels WHERE status = 'finished') as avg_stake,
                     (SELECT COUNT(*) FROM users) as total_users,
                     (SELECT COUNT(*) FROM users WHERE total_games > 0) as active_users,
                     (SELECT COUNT(*) FROM users WHERE created_at >= NOW() - INTERVAL '7 days') as new_users_week,
@@ -486,21 +493,21 @@ async def get_detailed_stats() -> dict:
             stats = result.fetchone()
 
             # Рассчитываем дополнительные метрики
-            house_percentage = (stats.house_duels / max(stats.total_duels, 1)) * 100
-            games_per_day = stats.total_duels / max(1, 30)  # За последние 30 дней
-            volume_per_day = float(stats.total_volume) / max(1, 30)
-            commission_per_day = float(stats.total_commission) / max(1, 30)
+            house_percentage = (house_duels / max(total_duels, 1)) * 100
+            games_per_day = total_duels / max(1, 30)  # За последние 30 дней
+            volume_per_day = total_volume / max(1, 30)
+            commission_per_day = total_commission / max(1, 30)
 
             return {
                 'total_user_balance': float(stats.total_user_balance),
-                'total_volume': float(stats.total_volume),
-                'total_commission': float(stats.total_commission),
-                'total_winnings': float(stats.total_winnings),
-                'total_duels': stats.total_duels,
-                'house_duels': stats.house_duels,
-                'real_duels': stats.real_duels,
+                'total_volume': total_volume,
+                'total_commission': total_commission,
+                'total_winnings': float(duel_totals["winnings_sum"]),
+                'total_duels': total_duels,
+                'house_duels': house_duels,
+                'real_duels': total_duels - house_duels,
                 'house_percentage': house_percentage,
-                'avg_stake': float(stats.avg_stake),
+                'avg_stake': float(duel_totals["stake_sum"] / total_duels) if total_duels else 0.0,
                 'total_users': stats.total_users,
                 'active_users': stats.active_users,
                 'new_users_week': stats.new_users_week,
@@ -517,6 +524,16 @@ async def get_detailed_stats() -> dict:
                    'games_per_day': 0, 'volume_per_day': 0, 'commission_per_day': 0}
 
 
+def _format_replica_status(stats: dict) -> str:
+    """Статус реплики для экрана настроек"""
+    if not stats["enabled"]:
+        return "⚪ Не настроена"
+    if stats["lag"] is None:
+        return "🔴 Недоступна"
+    emoji = "🟢" if stats["healthy"] else "🟡"
+    return f"{emoji} Отставание {stats['lag']:.1f} с (макс {stats['max_lag']:.0f} с)"
+
+
 @router.callback_query(F.data == "admin_settings")
 async def admin_settings(callback: CallbackQuery):
     """Настройки системы"""
@@ -527,6 +544,18 @@ async def admin_settings(callback: CallbackQuery):
     # Получаем статистику мониторинга
     from services.deposit_monitor import deposit_monitor
     monitor_stats = await deposit_monitor.get_monitoring_stats()
+    from utils.user_locks import user_locks
+    lock_stats = user_locks.get_stats()
+    from services.partition_service import partition_service
+    partition_stats = await partition_service.get_stats()
+    from database.connection import get_db_pool_stats
+    pool_stats = get_db_pool_stats()
+    replica_stats = replica_router.get_stats()
+    from database.models.user import user_cache
+    cache_stats = user_cache.get_stats()
+    names_stats = username_resolver.get_stats()
+    from services.room_registry import room_registry
+    room_stats = room_registry.get_stats()
 
     settings_text = f"""⚙️ Настройки системы
 
@@ -544,6 +573,37 @@ async def admin_settings(callback: CallbackQuery):
 • Сумма: {monitor_stats.get("deposits_total", {}).get("sum", 0):,.0f} MORI
 • Ожидающих: {monitor_stats.get("deposits_total", {}).get("pending", 0)}
 
+🔒 Блокировки баланса:
+• Активных: {lock_stats["active_locks"]}
+• Ожиданий: {lock_stats["contended"]} из {lock_stats["acquired"]}
+• Среднее ожидание: {lock_stats["avg_wait_ms"]:.1f} мс (макс {lock_stats["max_wait_ms"]:.0f} мс)
+• Таймаутов: {lock_stats["timeouts"]}
+
+👤 Кэш пользователей:
+• Записей: {cache_stats["size"]} из {cache_stats["maxsize"]}, TTL {cache_stats["ttl"]:.0f} с
+• Попаданий: {cache_stats["hit_rate"]:.1f}% ({cache_stats["hits"]} / {cache_stats["misses"]} промахов)
+• В пределах апдейта: {cache_stats.get("memo_hits", 0)}, сбросов: {cache_stats["invalidated"]}
+• Кэш имен: {names_stats["size"]} записей, попаданий {names_stats["hit_rate"]:.1f}%, запросов {names_stats.get("queries", 0)}
+
+🏠 Реестр комнат:
+• Таймер: {"🟢 Активен" if room_stats["running"] else "🔴 Остановлен"}
+• Открытых: {room_stats["open_rooms"]}, истекло: {room_stats["expired"]} (пачек: {room_stats["batches"]})
+• Сверок с БД: {room_stats["syncs"]}
+
+🔌 Пул соединений ({pool_stats["pool_class"]}):
+• Занято: {pool_stats.get("checked_out", "-")} из {pool_stats.get("size", "-")} (+{pool_stats.get("overflow", 0)} сверх пула)
+• Выдач: {pool_stats["checkouts"]}, таймаутов: {pool_stats["timeouts"]}
+• Ожидание: {pool_stats["avg_wait_ms"]:.1f} мс (макс {pool_stats["max_wait_ms"]:.0f} мс)
+
+🪞 Реплика для статистики:
+• Статус: {_format_replica_status(replica_stats)}
+• Чтений с реплики: {replica_stats["replica_reads"]}, с основной БД: {replica_stats["fallback_reads"]}
+
+🗄 Партиции истории:
+• Статус: {"🟢 По месяцам" if partition_stats["partitioned"] else "⚪ Без партиций"}
+• Транзакции: {partition_stats["partitions"]["transactions"]}, дуэли: {partition_stats["partitions"]["duels"]}
+• Архивировано: {len(partition_stats["archived"])}
+
 🔧 Версия бота: v1.0.0"""
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -602,7 +662,8 @@ async def admin_force_check(callback: CallbackQuery):
         )
 
 
-@router.callback_query(F.data == "admin_cleanup_rooms")
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data == "admin_cleanup_rooms", flags={"db_session": False})
 async def admin_cleanup_rooms(callback: CallbackQuery):
     """Очистка истекших комнат"""
     if not is_admin(callback.from_user.id):
@@ -611,7 +672,9 @@ async def admin_cleanup_rooms(callback: CallbackQuery):
 
     try:
         from database.models.room import Room
+        from services.room_registry import room_registry
         cleaned_count = await Room.cleanup_expired_rooms()
+        await room_registry.load()  # Синхронизируем реестр лобби с БД
 
         await callback.answer(f"🧹 Очищено комнат: {cleaned_count}", show_alert=True)
 
@@ -767,32 +830,12 @@ async def search_user_by_query(query: str) -> Optional[User]:
 
         # Проверяем, является ли запрос адресом кошелька (32-44 символа)
         if 32 <= len(query) <= 44:
-            async with async_session() as session:
-                result = await session.execute(
-                    text("SELECT * FROM users WHERE wallet_address = :wallet"),
-                    {"wallet": query}
-                )
-                row = result.fetchone()
-                if row:
-                    user = User()
-                    for key, value in row._mapping.items():
-                        setattr(user, key, value)
-                    return user
-
-        # Поиск по username
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM users WHERE LOWER(username) = LOWER(:username)"),
-                {"username": query}
-            )
-            row = result.fetchone()
-            if row:
-                user = User()
-                for key, value in row._mapping.items():
-                    setattr(user, key, value)
+            user = await User.fetch_one(select(User).where(User.wallet_address == query))
+            if user:
                 return user
 
-        return None
+        # Поиск по username
+        return await User.fetch_one(select(User).where(func.lower(User.username) == func.lower(query)))
 
     except Exception as e:
         logger.error(f"❌ Error in search_user_by_query: {e}")
@@ -803,7 +846,7 @@ async def get_detailed_user_info(user: User) -> str:
     """Получить детальную информацию о пользователе"""
     try:
         # Получаем дополнительную статистику
-        async with async_session() as session:
+        async with read_scope() as session:
             # Статистика транзакций
             tx_result = await session.execute(text("""
                 SELECT 
@@ -887,53 +930,56 @@ async def get_detailed_user_info(user: User) -> str:
         return f"❌ Ошибка получения информации о пользователе: {e}"
 
 
+def _parse_user_page_data(data: str) -> int:
+    """ID пользователя из 'admin_user_txs_<id>' или страницы '<префикс>:<id>:<n|p>:<курсор>'"""
+    if ":" in data:
+        return int(data.split(":")[1])
+    return int(data.split("_")[3])
+
+
 @router.callback_query(F.data.startswith("admin_user_txs_"))
+@router.callback_query(F.data.startswith("autx:"))
 async def show_user_transactions(callback: CallbackQuery):
-    """Показать транзакции пользователя"""
+    """Показать транзакции пользователя (страницы по курсору)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа!", show_alert=True)
         return
 
-    user_id = int(callback.data.split("_")[3])
+    user_id = _parse_user_page_data(callback.data)
+    cursor, newer = parse_page_data(callback.data)
 
     try:
-        async with async_session() as session:
-            result = await session.execute(text("""
-                SELECT t.*, u.username, u.telegram_id
-                FROM transactions t
-                JOIN users u ON t.user_id = u.id
-                WHERE t.user_id = :user_id
-                ORDER BY t.created_at DESC
-                LIMIT 20
-            """), {"user_id": user_id})
-
-            transactions = [dict(row._mapping) for row in result.fetchall()]
+        async with replica_router.session() as session:
+            user = await session.get(User, user_id)
+            page = await Transaction.get_user_transactions_page(
+                user_id, limit=20, cursor=cursor, newer=newer, session=session
+            )
 
-        if not transactions:
+        if not user or not page.items:
             tx_text = "📋 Транзакции пользователя\n\n❌ Транзакции не найдены"
         else:
-            user_info = transactions[0]
-            username = f"@{user_info['username']}" if user_info['username'] else f"User {user_info['telegram_id']}"
+            username = f"@{user.username}" if user.username else f"User {user.telegram_id}"
 
             tx_text = f"📋 Транзакции пользователя {username}\n\n"
 
-            for tx in transactions:
-                date_str = tx['created_at'].strftime('%d.%m %H:%M')
-                status_emoji = {"completed": "✅", "pending": "⏳", "failed": "❌", "cancelled": "🚫"}.get(tx['status'],
+            for tx in page.items:
+                date_str = tx.created_at.strftime('%d.%m %H:%M')
+                status_emoji = {"completed": "✅", "pending": "⏳", "failed": "❌", "cancelled": "🚫"}.get(tx.status.value,
                                                                                                        "❓")
                 type_emoji = {"deposit": "💰", "withdrawal": "💸", "duel_stake": "🎮", "duel_win": "🏆",
-                              "commission": "💼"}.get(tx['type'], "❓")
+                              "commission": "💼"}.get(tx.type.value, "❓")
 
-                tx_text += f"{status_emoji} {type_emoji} {tx['type'].upper()}\n"
-                tx_text += f"   💰 {tx['amount']:+,.2f} MORI\n"
+                tx_text += f"{status_emoji} {type_emoji} {tx.type.value.upper()}\n"
+                tx_text += f"   💰 {tx.amount:+,.2f} MORI\n"
                 tx_text += f"   📅 {date_str}\n"
-                if tx['tx_hash']:
-                    tx_text += f"   🔗 {tx['tx_hash'][:12]}...\n"
+                if tx.tx_hash:
+                    tx_text += f"   🔗 {tx.tx_hash[:12]}...\n"
                 tx_text += "\n"
 
         await callback.message.edit_text(
             tx_text,
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                *get_pagination_rows(f"autx:{user_id}", page),
                 [InlineKeyboardButton(text="🔙 Назад к пользователю", callback_data="admin_search_user")]
             ])
         )
@@ -946,52 +992,49 @@ async def show_user_transactions(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("admin_user_duels_"))
+@router.callback_query(F.data.startswith("audu:"))
 async def show_user_duels(callback: CallbackQuery):
-    """Показать дуэли пользователя"""
+    """Показать дуэли пользователя (страницы по курсору)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа!", show_alert=True)
         return
 
-    user_id = int(callback.data.split("_")[3])
+    user_id = _parse_user_page_data(callback.data)
+    cursor, newer = parse_page_data(callback.data)
 
     try:
-        async with async_session() as session:
-            result = await session.execute(text("""
-                SELECT d.*, u.telegram_id, u.username
-                FROM duels d
-                JOIN users u ON u.id = :user_id
-                WHERE (d.player1_id = u.telegram_id OR d.player2_id = u.telegram_id)
-                AND d.status = 'finished'::duelstatus
-                ORDER BY d.finished_at DESC
-                LIMIT 15
-            """), {"user_id": user_id})
-
-            duels = [dict(row._mapping) for row in result.fetchall()]
+        page = None
+        async with replica_router.session() as session:
+            user = await session.get(User, user_id)
+            if user:
+                page = await Duel.get_finished_duels_page(
+                    user.telegram_id, limit=15, cursor=cursor, newer=newer, session=session
+                )
 
-        if not duels:
+        if not page or not page.items:
             duels_text = "🎮 Дуэли пользователя\n\n❌ Дуэли не найдены"
         else:
-            user_info = duels[0]
-            username = f"@{user_info['username']}" if user_info['username'] else f"User {user_info['telegram_id']}"
+            username = f"@{user.username}" if user.username else f"User {user.telegram_id}"
 
             duels_text = f"🎮 Последние дуэли {username}\n\n"
 
-            for duel in duels:
-                date_str = duel['finished_at'].strftime('%d.%m %H:%M')
-                won = (duel['winner_id'] == user_info['telegram_id'])
+            for duel in page.items:
+                date_str = duel.finished_at.strftime('%d.%m %H:%M')
+                won = (duel.winner_id == user.telegram_id)
                 result_emoji = "🏆" if won else "💔"
-                coin_result = "ОРЕЛ" if duel['coin_result'] == 'heads' else "РЕШКА"
+                coin_result = "ОРЕЛ" if duel.coin_result == CoinSide.HEADS else "РЕШКА"
 
-                duels_text += f"{result_emoji} Дуэль #{duel['id']}\n"
-                duels_text += f"   💰 Ставка: {duel['stake']:,.0f} MORI\n"
+                duels_text += f"{result_emoji} Дуэль #{duel.id}\n"
+                duels_text += f"   💰 Ставка: {duel.stake:,.0f} MORI\n"
                 duels_text += f"   🪙 Выпал: {coin_result}\n"
-                if won and duel['winner_amount']:
-                    duels_text += f"   🎉 Выигрыш: {duel['winner_amount']:,.2f} MORI\n"
+                if won and duel.winner_amount:
+                    duels_text += f"   🎉 Выигрыш: {duel.winner_amount:,.2f} MORI\n"
                 duels_text += f"   📅 {date_str}\n\n"
 
         await callback.message.edit_text(
             duels_text,
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                *(get_pagination_rows(f"audu:{user_id}", page) if page else []),
                 [InlineKeyboardButton(text="🔙 Назад к пользователю", callback_data="admin_search_user")]
             ])
         )
@@ -1065,7 +1108,7 @@ async def admin_pending_transactions(callback: CallbackQuery):
 
 async def get_pending_transactions_details() -> list:
     """Получить детали ожидающих транзакций"""
-    async with async_session() as session:
+    async with read_scope() as session:
         try:
             result = await session.execute(text("""
                 SELECT 
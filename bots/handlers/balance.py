@@ -8,12 +8,16 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from database.connection import unit_of_work
 from database.models.user import User
 from database.models.transaction import Transaction, TransactionType, TransactionStatus
+from database.models.ledger import HOT_WALLET_ACCOUNT
 from services.solana_service import solana_service
-from bots.keyboards.main_menu import get_main_menu
+from bots.keyboards.main_menu import get_main_menu, get_pagination_rows
 from config.settings import BOT_WALLET_ADDRESS, WITHDRAWAL_COMMISSION
 from utils.logger import setup_logger
+from utils.user_locks import user_locks, UserLockTimeout
+from utils.pagination import parse_page_data
 
 router = Router()
 logger = setup_logger(__name__)
@@ -263,7 +267,7 @@ async def process_withdrawal_amount(message: Message, state: FSMContext):
             )
             return
 
-        user = await User.get_by_telegram_id(message.from_user.id)
+        user = await User.get_by_telegram_id(message.from_user.id, fresh=True)
         if not user or user.balance < amount:
             await message.answer(
                 "❌ Недостаточно средств!",
@@ -302,7 +306,7 @@ async def process_withdrawal_amount(message: Message, state: FSMContext):
 async def process_withdrawal(callback, user_id: int, amount: Decimal):
     """Обработать вывод средств"""
     try:
-        user = await User.get_by_telegram_id(user_id)
+        user = await User.get_by_telegram_id(user_id, fresh=True)
         if not user:
             await callback.message.edit_text("❌ Пользователь не найден!")
             return
@@ -349,7 +353,8 @@ async def process_withdrawal(callback, user_id: int, amount: Decimal):
         await callback.message.edit_text("❌ Ошибка обработки вывода")
 
 
-@router.callback_query(F.data.startswith("confirm_withdraw_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("confirm_withdraw_"), flags={"db_session": False})
 async def confirm_withdrawal(callback: CallbackQuery):
     """Подтвердить вывод"""
     user_id = callback.from_user.id
@@ -357,85 +362,93 @@ async def confirm_withdrawal(callback: CallbackQuery):
 
     try:
         amount = Decimal(amount_str)
-        user = await User.get_by_telegram_id(user_id)
 
-        if not user or user.balance < amount:
-            await callback.message.edit_text(
-                "❌ Недостаточно средств!",
-                reply_markup=get_main_menu()
-            )
-            await callback.answer()
-            return
-
-        # Снимаем средства с баланса
-        if not await user.subtract_balance(amount):
+        # Вывод не пересекается с другими операциями над балансом пользователя
+        async with user_locks.lock(user_id, "withdrawal"):
+            user = await User.get_by_telegram_id(user_id, fresh=True)
+
+            if not user or user.balance < amount:
+                await callback.message.edit_text(
+                    "❌ Недостаточно средств!",
+                    reply_markup=get_main_menu()
+                )
+                await callback.answer()
+                return
+
+            # Рассчитываем выплату
+            commission = amount * Decimal(WITHDRAWAL_COMMISSION)
+            net_amount = amount - commission
+
+            # Списание (атомарно, с проверкой остатка) и запись о выводе - одной транзакцией,
+            # зафиксированной до отправки в сеть: сбой после отправки не должен вернуть списанные средства
+            async with unit_of_work():
+                new_balance = await User.debit_balance(user_id, amount, HOT_WALLET_ACCOUNT, reason="withdrawal")
+                if new_balance is not None:
+                    transaction = await Transaction.create_transaction(
+                        user.id,
+                        TransactionType.WITHDRAWAL,
+                        net_amount,
+                        to_address=user.wallet_address,
+                        description=f"Вывод {amount} MORI (комиссия {commission})"
+                    )
+
+            if new_balance is None:
+                await callback.message.edit_text(
+                    "❌ Недостаточно средств!",
+                    reply_markup=get_main_menu()
+                )
+                await callback.answer()
+                return
+
+            # Показываем процесс
             await callback.message.edit_text(
-                "❌ Ошибка списания средств!",
-                reply_markup=get_main_menu()
-            )
-            await callback.answer()
-            return
-
-        # Рассчитываем выплату
-        commission = amount * Decimal(WITHDRAWAL_COMMISSION)
-        net_amount = amount - commission
-
-        # Создаем транзакцию
-        transaction = await Transaction.create_transaction(
-            user.id,
-            TransactionType.WITHDRAWAL,
-            net_amount,
-            to_address=user.wallet_address,
-            description=f"Вывод {amount} MORI (комиссия {commission})"
-        )
-
-        # Показываем процесс
-        await callback.message.edit_text(
-            f"""⏳ Обработка вывода...
+                f"""⏳ Обработка вывода...
 
 💰 Сумма: {net_amount:,.2f} MORI
 👛 На кошелек: {user.wallet_address[:8]}...{user.wallet_address[-4:]}
 
 🔄 Отправка транзакции..."""
-        )
+            )
 
-        # Отправляем токены
-        tx_hash = await solana_service.send_token(
-            user.wallet_address,
-            net_amount,
-            solana_service.mori_mint
-        )
+            # Отправляем токены
+            tx_hash = await solana_service.send_token(
+                user.wallet_address,
+                net_amount,
+                solana_service.mori_mint
+            )
 
-        if tx_hash and len(tx_hash) > 10:  # Проверяем что получили реальный хеш
-            # Успешно отправлено
-            await transaction.complete_transaction(tx_hash)
+            if tx_hash and len(tx_hash) > 10:  # Проверяем что получили реальный хеш
+                # Успешно отправлено
+                await transaction.complete_transaction(tx_hash)
 
-            success_text = f"""✅ Вывод выполнен!
+                success_text = f"""✅ Вывод выполнен!
 
         💰 Отправлено: {net_amount:,.2f} MORI
         💳 Комиссия: {commission:,.2f} MORI
         🔗 TX: `{tx_hash[:16]}...`
         👛 На кошелек: {user.wallet_address[:8]}...{user.wallet_address[-4:]}
 
-        💰 Новый баланс: {user.balance:,.2f} MORI
+        💰 Новый баланс: {new_balance:,.2f} MORI
 
         ⏰ Транзакция обрабатывается сетью Solana
         Токены поступят в течение 1-2 минут"""
 
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📊 Баланс", callback_data="balance")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
+                keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="📊 Баланс", callback_data="balance")],
+                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+                ])
 
-        else:
-            # Ошибка отправки - возвращаем деньги
-            await user.add_balance(amount)
-            await transaction.fail_transaction("Ошибка отправки в сеть Solana")
+            else:
+                # Ошибка отправки - возвращаем деньги
+                new_balance = await User.credit_balance(
+                    user_id, amount, HOT_WALLET_ACCOUNT, reason="withdrawal_refund"
+                ) or new_balance
+                await transaction.fail_transaction("Ошибка отправки в сеть Solana")
 
-            success_text = f"""❌ Ошибка вывода!
+                success_text = f"""❌ Ошибка вывода!
 
         Средства возвращены на баланс.
-        💰 Баланс: {user.balance:,.2f} MORI
+        💰 Баланс: {new_balance:,.2f} MORI
 
         🔧 Возможные причины:
         • Недостаточно SOL на кошельке бота для газа
@@ -444,18 +457,21 @@ async def confirm_withdrawal(callback: CallbackQuery):
 
         Попробуйте позже или обратитесь в поддержку."""
 
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="withdraw")],
-                [InlineKeyboardButton(text="👛 Проверить кошелек", callback_data="wallet")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
+                keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="withdraw")],
+                    [InlineKeyboardButton(text="👛 Проверить кошелек", callback_data="wallet")],
+                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+                ])
 
-        await callback.message.edit_text(
-            success_text,
-            reply_markup=keyboard,
-            parse_mode="Markdown"
-        )
+            await callback.message.edit_text(
+                success_text,
+                reply_markup=keyboard,
+                parse_mode="Markdown"
+            )
 
+    except UserLockTimeout:
+        await callback.answer("⏳ Предыдущая операция еще выполняется, попробуйте позже", show_alert=True)
+        return
     except Exception as e:
         logger.error(f"❌ Error confirming withdrawal: {e}")
         await callback.message.edit_text(
@@ -467,8 +483,9 @@ async def confirm_withdrawal(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "transaction_history")
+@router.callback_query(F.data.startswith("txh:"))
 async def show_transaction_history(callback: CallbackQuery):
-    """Показать историю транзакций"""
+    """Показать историю транзакций (страницы по курсору из callback_data)"""
     user_id = callback.from_user.id
     user = await User.get_by_telegram_id(user_id)
 
@@ -476,7 +493,9 @@ async def show_transaction_history(callback: CallbackQuery):
         await callback.answer("❌ Пользователь не найден!", show_alert=True)
         return
 
-    transactions = await Transaction.get_user_transactions(user.id, limit=10)
+    cursor, newer = parse_page_data(callback.data)
+    page = await Transaction.get_user_transactions_page(user.id, limit=10, cursor=cursor, newer=newer)
+    transactions = page.items
 
     if not transactions:
         history_text = """📋 История транзакций
@@ -502,6 +521,7 @@ async def show_transaction_history(callback: CallbackQuery):
             history_text += "\n"
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        *get_pagination_rows("txh", page),
         [InlineKeyboardButton(text="🔙 Назад", callback_data="balance")]
     ])
 
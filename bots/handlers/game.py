@@ -11,7 +11,8 @@ from aiogram.fsm.state import State, StatesGroup
 from database.models.user import User
 from database.models.duel import Duel
 from bots.keyboards.main_menu import get_main_menu, get_bet_amounts, get_coin_flip
-from services.game_service import game_service
+from services.game_service import game_service, SearchRefundFailed
+from services.username_resolver import username_resolver
 from config.settings import MIN_BET, MAX_BET
 from utils.logger import setup_logger
 
@@ -54,7 +55,8 @@ async def quick_game_menu(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("bet_"))
+# Поиск соперника ждет до MATCH_TIMEOUT - без общей сессии апдейта (db_session=False)
+@router.callback_query(F.data.startswith("bet_"), flags={"db_session": False})
 async def process_bet_selection(callback: CallbackQuery):
     """Обработка выбора ставки"""
     # Проверяем контекст (быстрая игра или создание комнаты)
@@ -96,7 +98,7 @@ async def process_bet_selection(callback: CallbackQuery):
     await start_quick_match(callback, user_id, stake)
 
 
-@router.message(GameStates.waiting_for_custom_bet)
+@router.message(GameStates.waiting_for_custom_bet, flags={"db_session": False})
 async def process_custom_bet(message: Message, state: FSMContext):
     """Обработка пользовательской ставки"""
     try:
@@ -150,7 +152,7 @@ async def process_custom_bet(message: Message, state: FSMContext):
 async def start_quick_match(callback, user_id: int, stake: Decimal):
     """Начать быстрый поиск игры"""
     try:
-        user = await User.get_by_telegram_id(user_id)
+        user = await User.get_by_telegram_id(user_id, fresh=True)
 
         if not user or user.balance < stake:
             await callback.message.edit_text(
@@ -162,6 +164,11 @@ async def start_quick_match(callback, user_id: int, stake: Decimal):
             )
             return
 
+        # Повторное нажатие во время поиска не запускает второй поиск
+        if game_service.is_searching(user_id):
+            await callback.answer("⏳ Поиск игры уже идет", show_alert=True)
+            return
+
         # Показываем поиск игры
         await callback.message.edit_text(
             f"""🔍 Поиск игры...
@@ -171,13 +178,16 @@ async def start_quick_match(callback, user_id: int, stake: Decimal):
 
 Подождите до 10 секунд""",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Отмена", callback_data="quick_game")]
+                [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_search")]
             ])
         )
 
         # Запускаем поиск
         result = await game_service.quick_match(user_id, stake)
 
+        if result.get("cancelled"):
+            return  # Сообщение уже обновил обработчик отмены
+
         if "error" in result:
             await callback.message.edit_text(
                 f"❌ {result['error']}",
@@ -191,13 +201,18 @@ async def start_quick_match(callback, user_id: int, stake: Decimal):
         else:
             opponent_text = f"🤖 Противник: {result['opponent']}"
 
+        # Ставка могла снизиться до ставки соперника при подборе с допуском
+        duel_stake = result["stake"]
+        if duel_stake < stake:
+            opponent_text += f"\n↩️ Ставка снижена до ставки соперника, разница {stake - duel_stake:,.0f} MORI возвращена"
+
         # Правильный расчет: своя ставка + 70% от ставки оппонента
-        potential_win = stake + (stake * Decimal('0.7'))
+        potential_win = duel_stake + (duel_stake * Decimal('0.7'))
 
         game_text = f"""✅ Игра найдена!
 
 {opponent_text}
-💰 Ваша ставка: {stake:,.0f} MORI
+💰 Ваша ставка: {duel_stake:,.0f} MORI
 🏆 При победе получите: {potential_win:,.0f} MORI
 💡 (своя ставка + 70% от ставки оппонента)
 
@@ -219,7 +234,40 @@ async def start_quick_match(callback, user_id: int, stake: Decimal):
         )
 
 
-@router.callback_query(F.data.startswith("flip_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data == "cancel_search", flags={"db_session": False})
+async def cancel_search(callback: CallbackQuery):
+    """Отмена поиска игры"""
+    user_id = callback.from_user.id
+
+    try:
+        cancelled = await game_service.cancel_search(user_id)
+    except SearchRefundFailed:
+        await callback.answer("❌ Не удалось отменить поиск, попробуйте еще раз", show_alert=True)
+        return
+
+    if cancelled is None:
+        await callback.answer("❌ Поиск уже завершен")
+        return
+    if not cancelled:
+        # Соперник забрал заявку в последний момент - игра сейчас откроется
+        await callback.answer("⚡ Соперник уже найден!", show_alert=True)
+        return
+
+    await callback.message.edit_text(
+        """❌ Поиск отменен
+
+💰 Ставка возвращена на баланс""",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎮 Играть еще", callback_data="quick_game")],
+            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+        ])
+    )
+    await callback.answer()
+
+
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("flip_"), flags={"db_session": False})
 async def flip_coin(callback: CallbackQuery):
     """Бросок монеты"""
     try:
@@ -261,7 +309,7 @@ async def flip_coin(callback: CallbackQuery):
 {coin_emoji} Выпал: {coin_text}
 🏆 Вы выиграли: {result['winner_amount']:,.2f} MORI
 
-💰 Средства отправлены на ваш кошелек!"""
+💰 Выплата поставлена в очередь и скоро придет на ваш кошелек"""
 
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="🎮 Играть еще", callback_data="quick_game")],
@@ -273,8 +321,8 @@ async def flip_coin(callback: CallbackQuery):
             if result["is_house_duel"]:
                 opponent_name = result["house_account"]
             else:
-                opponent_user = await User.get_by_telegram_id(result["winner_id"])
-                opponent_name = f"@{opponent_user.username}" if opponent_user and opponent_user.username else f"Player {result['winner_id']}"
+                opponent_username = await username_resolver.resolve(result["winner_id"])
+                opponent_name = f"@{opponent_username}" if opponent_username else f"Player {result['winner_id']}"
 
             result_text = f"""💔 Поражение
 
@@ -10,9 +10,12 @@ from aiogram.fsm.state import State, StatesGroup
 
 from database.models.user import User
 from database.models.room import Room, RoomStatus
+from services.room_registry import room_registry
+from services.username_resolver import username_resolver
 from bots.keyboards.main_menu import get_main_menu, get_bet_amounts
 from config.settings import MIN_BET, MAX_BET
 from utils.logger import setup_logger
+from utils.user_locks import user_locks, UserLockTimeout
 
 router = Router()
 logger = setup_logger(__name__)
@@ -41,9 +44,8 @@ async def rooms_menu(callback: CallbackQuery):
         await callback.answer()
         return
 
-    # Получаем активные комнаты
-    await Room.cleanup_expired_rooms()  # Очищаем истекшие
-    active_rooms = await Room.get_active_rooms(limit=10)
+    # Активные комнаты - из реестра в памяти (истекшие он закрывает сам по таймеру)
+    active_rooms = room_registry.get_active_rooms(limit=10)
 
     rooms_text = f"""🏠 Игровые комнаты
 
@@ -60,9 +62,10 @@ async def rooms_menu(callback: CallbackQuery):
 
     if active_rooms:
         rooms_text += "\n"
-        for room in active_rooms[:5]:  # Показываем только первые 5
-            creator = await User.get_by_telegram_id(room.creator_id)
-            creator_name = creator.username if creator and creator.username else f"Player {room.creator_id}"
+        shown_rooms = active_rooms[:5]  # Показываем только первые 5
+        creator_names = await username_resolver.display_names(room.creator_id for room in shown_rooms)
+        for room in shown_rooms:
+            creator_name = creator_names[room.creator_id]
             time_left = room.get_time_left()
             minutes_left = int(time_left.total_seconds() // 60)
 
@@ -112,7 +115,8 @@ async def create_room_menu(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("bet_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("bet_"), flags={"db_session": False})
 async def process_room_bet_selection(callback: CallbackQuery):
     """Обработка выбора ставки для комнаты"""
     # Проверяем, что это запрос из создания комнаты
@@ -154,7 +158,8 @@ async def process_room_bet_selection(callback: CallbackQuery):
     await create_room_with_stake(callback, user_id, stake)
 
 
-@router.message(RoomStates.waiting_for_room_stake)
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.message(RoomStates.waiting_for_room_stake, flags={"db_session": False})
 async def process_custom_room_stake(message: Message, state: FSMContext):
     """Обработка пользовательской ставки для комнаты"""
     try:
@@ -208,7 +213,7 @@ async def process_custom_room_stake(message: Message, state: FSMContext):
 async def create_room_with_stake(callback, user_id: int, stake: Decimal):
     """Создать комнату с указанной ставкой"""
     try:
-        user = await User.get_by_telegram_id(user_id)
+        user = await User.get_by_telegram_id(user_id, fresh=True)
 
         if not user or user.balance < stake:
             await callback.message.edit_text(
@@ -220,18 +225,22 @@ async def create_room_with_stake(callback, user_id: int, stake: Decimal):
             )
             return
 
-        # Создаем комнату
-        room = await Room.create_room(user_id, stake, expires_in_minutes=5)
+        # Создаем комнату - ставка списывается сразу и ждет соперника
+        async with user_locks.lock(user_id, "room_create"):
+            room = await Room.create_room(user_id, stake, expires_in_minutes=5)
 
         if not room:
             await callback.message.edit_text(
-                "❌ Ошибка создания комнаты!",
+                "❌ Недостаточно средств для создания комнаты!",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="💰 Пополнить", callback_data="deposit")],
                     [InlineKeyboardButton(text="🔙 Назад", callback_data="rooms")]
                 ])
             )
             return
 
+        room_registry.add(room)
+
         # Генерируем ссылку для приглашения
         bot_username = "moriduels_bot"  # Нужно будет получить реальное имя бота
         share_link = room.get_share_link(bot_username)
@@ -243,6 +252,8 @@ async def create_room_with_stake(callback, user_id: int, stake: Decimal):
 ⏰ Время ожидания: 5 минут
 🔗 Ссылка: {share_link}
 
+💡 Ставка списана и вернется, если никто не присоединится
+
 Ждем игрока... 👥"""
 
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -266,6 +277,8 @@ async def create_room_with_stake(callback, user_id: int, stake: Decimal):
 
         logger.info(f"✅ Created room {room.room_code} by user {user_id} with stake {stake}")
 
+    except UserLockTimeout:
+        await callback.answer("⏳ Предыдущая операция еще выполняется, попробуйте позже", show_alert=True)
     except Exception as e:
         logger.error(f"❌ Error creating room: {e}")
         await callback.message.edit_text(
@@ -290,7 +303,8 @@ async def copy_room_code(callback: CallbackQuery):
     await callback.answer("📋 Код отправлен отдельным сообщением")
 
 
-@router.callback_query(F.data.startswith("close_room_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("close_room_"), flags={"db_session": False})
 async def close_room(callback: CallbackQuery):
     """Закрыть комнату"""
     room_code = callback.data.split("_")[2]
@@ -311,8 +325,11 @@ async def close_room(callback: CallbackQuery):
             await callback.answer("❌ Комната уже закрыта или заполнена!", show_alert=True)
             return
 
-        # Закрываем комнату
-        await room.close_room()
+        # Закрываем комнату и возвращаем ставку
+        if not await room.close_room():
+            await callback.answer("❌ Комната уже закрыта или заполнена!", show_alert=True)
+            return
+        room_registry.discard(room_code)
 
         await callback.message.edit_text(
             f"""❌ Комната закрыта
@@ -320,7 +337,7 @@ async def close_room(callback: CallbackQuery):
 🏠 Код: {room_code}
 💰 Ставка: {room.stake:,.0f} MORI
 
-Комната была успешно закрыта.""",
+Комната была успешно закрыта, ставка возвращена на баланс.""",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="🏠 Все комнаты", callback_data="rooms")]
             ])
@@ -401,6 +418,7 @@ async def process_room_code(message: Message, state: FSMContext):
 
         if room.is_expired():
             await room.expire_room()
+            room_registry.discard(room_code)
             await message.answer(
                 f"❌ Комната {room_code} истекла!",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -411,8 +429,7 @@ async def process_room_code(message: Message, state: FSMContext):
             return
 
         # Показываем информацию о комнате
-        creator = await User.get_by_telegram_id(room.creator_id)
-        creator_name = creator.username if creator and creator.username else f"Player {room.creator_id}"
+        creator_name = await username_resolver.display_name(room.creator_id)
         time_left = room.get_time_left()
         minutes_left = int(time_left.total_seconds() // 60)
 
@@ -442,7 +459,8 @@ async def process_room_code(message: Message, state: FSMContext):
     await state.clear()
 
 
-@router.callback_query(F.data.startswith("join_room_"))
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.callback_query(F.data.startswith("join_room_"), flags={"db_session": False})
 async def join_room(callback: CallbackQuery):
     """Присоединиться к комнате"""
     room_code = callback.data.split("_")[2]
@@ -459,7 +477,7 @@ async def join_room(callback: CallbackQuery):
             await callback.answer("❌ Вы не можете присоединиться к своей комнате!", show_alert=True)
             return
 
-        user = await User.get_by_telegram_id(user_id)
+        user = await User.get_by_telegram_id(user_id, fresh=True)
         if not user or user.balance < room.stake:
             await callback.message.edit_text(
                 f"""❌ Недостаточно средств!
@@ -475,23 +493,18 @@ async def join_room(callback: CallbackQuery):
             await callback.answer()
             return
 
-        # Снимаем ставку с баланса
-        if not await user.subtract_balance(room.stake):
-            await callback.answer("❌ Ошибка списания средств!", show_alert=True)
-            return
+        # Захват комнаты, списание и дуэль - одной транзакцией (Room.join_room)
+        async with user_locks.lock(user_id, "room_join"):
+            duel = await room.join_room(user_id)
 
-        # Присоединяемся к комнате
-        duel = await room.join_room(user_id)
+            if not duel:
+                await callback.answer("❌ Не удалось присоединиться к комнате!", show_alert=True)
+                return
 
-        if not duel:
-            # Возвращаем деньги
-            await user.add_balance(room.stake)
-            await callback.answer("❌ Не удалось присоединиться к комнате!", show_alert=True)
-            return
+        room_registry.discard(room_code)
 
         # Успешно присоединились
-        creator = await User.get_by_telegram_id(room.creator_id)
-        creator_name = creator.username if creator and creator.username else f"Player {room.creator_id}"
+        creator_name = await username_resolver.display_name(room.creator_id)
         # Правильный расчет выигрыша
         potential_win = room.stake + (room.stake * Decimal('0.7'))
 
@@ -532,6 +545,9 @@ async def join_room(callback: CallbackQuery):
 
         logger.info(f"✅ User {user_id} joined room {room_code}, duel {duel.id} created")
 
+    except UserLockTimeout:
+        await callback.answer("⏳ Предыдущая операция еще выполняется, попробуйте позже", show_alert=True)
+        return
     except Exception as e:
         logger.error(f"❌ Error joining room {room_code}: {e}")
         await callback.answer("❌ Ошибка присоединения к комнате", show_alert=True)
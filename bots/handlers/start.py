@@ -5,6 +5,8 @@ from aiogram.fsm.context import FSMContext
 
 from bots.keyboards.main_menu import get_main_menu
 from database.models.user import User
+from services.room_registry import room_registry
+from services.username_resolver import username_resolver
 from bots.handlers.wallet import WalletStates
 from utils.logger import setup_logger
 
@@ -12,7 +14,8 @@ router = Router()
 logger = setup_logger(__name__)
 
 
-@router.message(CommandStart())
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.message(CommandStart(), flags={"db_session": False})
 async def cmd_start(message: Message, state: FSMContext):
     """Обработчик команды /start"""
     user_id = message.from_user.id
@@ -45,7 +48,10 @@ async def cmd_start(message: Message, state: FSMContext):
         await state.set_state(WalletStates.waiting_for_address)
         return
 
-    # Существующий пользователь
+    # Существующий пользователь: имя в Telegram могло смениться
+    if user.username != username and await user.update_username(username):
+        username_resolver.invalidate(user_id)
+
     balance = await user.get_balance()
 
     # Проверяем, не хочет ли присоединиться к комнате
@@ -108,6 +114,7 @@ async def handle_room_join_existing_user(message: Message, user: User, room_code
         # Проверяем, не истекла ли комната
         if room.is_expired():
             await room.expire_room()
+            room_registry.discard(room_code)
             await message.answer(
                 f"""❌ Время ожидания в комнате {room_code} истекло!
 
@@ -137,8 +144,7 @@ async def handle_room_join_existing_user(message: Message, user: User, room_code
             return
 
         # Показываем информацию о комнате для присоединения
-        creator = await User.get_by_telegram_id(room.creator_id)
-        creator_name = creator.username if creator and creator.username else f"Player {room.creator_id}"
+        creator_name = await username_resolver.display_name(room.creator_id)
         time_left = room.get_time_left()
         minutes_left = max(0, int(time_left.total_seconds() // 60))
 
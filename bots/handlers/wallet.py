@@ -10,6 +10,8 @@ from aiogram.fsm.state import State, StatesGroup
 from database.models.user import User
 from database.models.wallet_history import WalletHistory
 from services.solana_service import validate_solana_address
+from services.room_registry import room_registry
+from services.username_resolver import username_resolver
 from bots.keyboards.main_menu import get_main_menu
 from utils.logger import setup_logger
 
@@ -398,7 +400,8 @@ async def show_wallet_history(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки истории", show_alert=True)
 
 
-@router.message(WalletStates.waiting_for_address)
+# Деньги двигаются в собственных транзакциях хелперов, зафиксированных до сообщений Telegram (db_session=False)
+@router.message(WalletStates.waiting_for_address, flags={"db_session": False})
 async def process_first_wallet_address(message: Message, state: FSMContext):
     """Обработка первого адреса кошелька при регистрации нового пользователя"""
     wallet_address = message.text.strip()
@@ -443,6 +446,7 @@ async def process_first_wallet_address(message: Message, state: FSMContext):
             )
             await state.clear()
             return
+        username_resolver.invalidate(user_id)
 
         # Проверяем, есть ли отложенное присоединение к комнате
         data = await state.get_data()
@@ -534,6 +538,7 @@ async def handle_room_join_after_registration(message: Message, user: User, room
         # Проверяем, не истекла ли комната
         if room.is_expired():
             await room.expire_room()
+            room_registry.discard(room_code)
             await message.answer(
                 f"""❌ Время ожидания в комнате {room_code} истекло!
 
@@ -563,8 +568,7 @@ async def handle_room_join_after_registration(message: Message, user: User, room
             return
 
         # Показываем информацию о комнате для присоединения
-        creator = await User.get_by_telegram_id(room.creator_id)
-        creator_name = creator.username if creator and creator.username else f"Player {room.creator_id}"
+        creator_name = await username_resolver.display_name(room.creator_id)
         time_left = room.get_time_left()
         minutes_left = max(0, int(time_left.total_seconds() // 60))
 
@@ -1,5 +1,9 @@
+from typing import List
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from utils.pagination import Page
+
 def get_main_menu() -> InlineKeyboardMarkup:
     """Главное меню бота"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -48,3 +52,12 @@ def get_coin_flip() -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="🎲 БРОСИТЬ МОНЕТУ", callback_data="flip_coin")
         ]
     ])
+
+def get_pagination_rows(prefix: str, page: Page) -> List[List[InlineKeyboardButton]]:
+    """Ряд кнопок «новее/старее» для страницы истории (пустой список, если листать некуда)"""
+    buttons = []
+    if page.newer_cursor:
+        buttons.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"{prefix}:p:{page.newer_cursor}"))
+    if page.older_cursor:
+        buttons.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"{prefix}:n:{page.older_cursor}"))
+    return [buttons] if buttons else []
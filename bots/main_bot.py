@@ -11,6 +11,7 @@ from utils.logger import setup_logger
 
 # Импорт middleware
 from bots.middlewares.error_handler import ErrorHandlerMiddleware, UserBlockedMiddleware
+from bots.middlewares.db_session import DbSessionMiddleware
 
 # Импорт handlers
 from bots.handlers.start import router as start_router
@@ -27,6 +28,7 @@ logger = setup_logger(__name__)
 bot = Bot(token=MAIN_BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+db_session_middleware = DbSessionMiddleware()
 
 
 async def setup_bot():
@@ -41,6 +43,9 @@ async def setup_bot():
     dp.callback_query.middleware(UserBlockedMiddleware())
     dp.message.middleware(ErrorHandlerMiddleware())
     dp.callback_query.middleware(ErrorHandlerMiddleware())
+    # Сессия БД на апдейт - внутри ErrorHandler, чтобы ошибка хендлера сначала откатывала транзакцию
+    dp.message.middleware(db_session_middleware)
+    dp.callback_query.middleware(db_session_middleware)
 
     # Регистрируем роутеры
     dp.include_router(start_router)
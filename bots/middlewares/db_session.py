@@ -0,0 +1,45 @@
+"""
+Middleware unit of work: одна сессия БД на апдейт Telegram
+"""
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
+
+from database.connection import unit_of_work
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает сессию на апдейт, передает ее хендлеру как session и коммитит один раз в конце.
+
+    Хелперы моделей внутри апдейта берут эту же сессию, поэтому соединение из пула одно,
+    а многошаговые операции атомарны. Изменения фиксируются только после возврата хендлера,
+    поэтому хендлеры, которые двигают деньги или долго ждут, помечены флагом db_session=False:
+    их хелперы коммитят свои транзакции сами, до сообщений в Telegram, и ошибка отправки
+    сообщения не откатывает уже выполненный возврат или списание.
+    """
+
+    def __init__(self):
+        self.updates = 0  # Апдейтов в unit of work
+        self.rollbacks = 0  # Откатов из-за ошибки в хендлере
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "db_session", default=True):
+            return await handler(event, data)
+
+        self.updates += 1
+        try:
+            async with unit_of_work() as session:
+                data["session"] = session
+                return await handler(event, data)
+        except Exception:
+            self.rollbacks += 1
+            raise  # Пропускаем дальше для обработки в ErrorHandlerMiddleware
@@ -23,6 +23,22 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD')
 }
 
+# Database Pool (PostgreSQL)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))  # Постоянных соединений
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))  # Временных соединений сверх пула
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # секунд ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # секунд жизни соединения, -1 - без ограничения
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'  # Проверять соединение перед выдачей
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 500))  # На соединение, 0 - для pgbouncer
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', 60))  # секунд на запрос на стороне клиента
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 30000))  # мс, statement_timeout сервера, 0 - без ограничения
+DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', 500))  # Скомпилированных запросов SQLAlchemy
+
+# Read Replica
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')  # Пусто - все запросы на основную БД
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))  # секунд отставания, дальше - чтение с основной БД
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 5))  # секунд между проверками отставания
+
 # Solana
 SOLANA_RPC_URL = os.getenv('SOLANA_RPC_URL')
 MORI_TOKEN_MINT = os.getenv('MORI_TOKEN_MINT')
@@ -41,6 +57,36 @@ MAX_BET = float(os.getenv('MAX_BET', 100000))
 HOUSE_COMMISSION = float(os.getenv('HOUSE_COMMISSION', 0.30))
 WITHDRAWAL_COMMISSION = float(os.getenv('WITHDRAWAL_COMMISSION', 0.05))
 MATCH_TIMEOUT = int(os.getenv('MATCH_TIMEOUT', 10))
+MATCH_STAKE_TOLERANCE = float(os.getenv('MATCH_STAKE_TOLERANCE', 0))  # 0 - только одинаковые ставки
+MATCHMAKING_BACKEND = os.getenv('MATCHMAKING_BACKEND', 'memory')  # memory | postgres
+MAX_CONCURRENT_SEARCHES = int(os.getenv('MAX_CONCURRENT_SEARCHES', 500))
+MATCH_TICK_INTERVAL = float(os.getenv('MATCH_TICK_INTERVAL', 0))  # 0 - подбор сразу при поиске
+ROOM_EXPIRY_RETRY_DELAY = float(os.getenv('ROOM_EXPIRY_RETRY_DELAY', 5))  # секунд до повтора, если истечь комнаты не удалось
+ROOM_SYNC_INTERVAL = float(os.getenv('ROOM_SYNC_INTERVAL', 60))  # секунд между сверкой реестра комнат с БД
+ROOM_CODE_SECRET = os.getenv('ROOM_CODE_SECRET', '')  # Ключ перестановки кодов комнат, не менять после запуска
+ROOM_CODE_BLOCK_SIZE = int(os.getenv('ROOM_CODE_BLOCK_SIZE', 100))  # Кодов на один nextval
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))  # Профилей в кэше процесса, 0 - без кэша
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30))  # секунд жизни профиля в кэше
+USERNAME_CACHE_SIZE = int(os.getenv('USERNAME_CACHE_SIZE', 50000))  # Имен в кэше для экранов, 0 - без кэша
+USERNAME_CACHE_TTL = float(os.getenv('USERNAME_CACHE_TTL', 600))  # секунд жизни имени в кэше
+USER_LOCK_TIMEOUT = float(os.getenv('USER_LOCK_TIMEOUT', 30))  # секунд ожидания предыдущей операции с балансом
+
+# Payout Settings
+PAYOUT_WORKERS = int(os.getenv('PAYOUT_WORKERS', 4))
+PAYOUT_BATCH_SIZE = int(os.getenv('PAYOUT_BATCH_SIZE', 20))  # Выплат в одной пачке
+PAYOUT_MAX_ATTEMPTS = int(os.getenv('PAYOUT_MAX_ATTEMPTS', 5))
+PAYOUT_RETRY_DELAY = float(os.getenv('PAYOUT_RETRY_DELAY', 10))  # секунд, удваивается с каждой попыткой
+PAYOUT_PROCESSING_TIMEOUT = int(os.getenv('PAYOUT_PROCESSING_TIMEOUT', 300))  # секунд
+
+# Ledger Settings
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv('LEDGER_SNAPSHOT_INTERVAL', 3600))  # секунд, 0 - без снимков
+
+# Partition Settings
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv('PARTITION_MAINTENANCE_INTERVAL', 86400))  # секунд, 0 - выключено
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 2))  # Сколько будущих месяцев создавать заранее
+PARTITION_RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', 12))  # 0 - не архивировать
+ARCHIVE_MODE = os.getenv('ARCHIVE_MODE', 'table')  # table - схема archive, file - сжатый CSV
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
 
 # Logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
\ No newline at end of file
@@ -2,26 +2,113 @@
 Подключение к базе данных (PostgreSQL или SQLite)
 """
 import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, AsyncIterator, Any, Dict, List, Tuple, Union
+
+from sqlalchemy import Select, select, text, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from config.settings import DATABASE_URL
+from config.settings import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_STATEMENT_CACHE_SIZE, DB_COMMAND_TIMEOUT, DB_STATEMENT_TIMEOUT, DB_QUERY_CACHE_SIZE
+)
+from database.pool import MeteredPool, get_pool_stats
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
+# Сессия апдейта Telegram (unit of work) и задача, которой она принадлежит, см. unit_of_work()
+_current_session: ContextVar[Optional[Tuple[AsyncSession, asyncio.Task]]] = ContextVar(
+    "current_session", default=None
+)
+
+# Разобранные SQL-строки fetch_one/fetch_all: (модель, sql) -> select().from_statement()
+_text_statements: Dict[Tuple[type, str], Select] = {}
+
+
 class Base(DeclarativeBase):
     """Базовый класс для всех моделей"""
-    pass
+
+    @classmethod
+    def _as_select(cls, stmt: Union[Select, str]) -> Select:
+        """Запрос, строки которого ORM превращает в объекты модели"""
+        if not isinstance(stmt, str):
+            return stmt
+        key = (cls, stmt)
+        if key not in _text_statements:
+            _text_statements[key] = select(cls).from_statement(text(stmt))
+        return _text_statements[key]
+
+    @classmethod
+    async def fetch_one(cls, stmt: Union[Select, str], params: Optional[Dict[str, Any]] = None,
+                        session: Optional[AsyncSession] = None) -> Optional[Any]:
+        """Первый объект модели по select() или SQL-строке (SELECT * ...).
+
+        Строки собирает ORM: типы колонок (Enum, Decimal, DateTime) конвертируются по модели,
+        а объект попадает в identity map сессии, как после session.get().
+        """
+        async with read_scope(session) as session:
+            return (await session.scalars(cls._as_select(stmt), params)).first()
+
+    @classmethod
+    async def fetch_all(cls, stmt: Union[Select, str], params: Optional[Dict[str, Any]] = None,
+                        session: Optional[AsyncSession] = None) -> List[Any]:
+        """Все объекты модели по select() или SQL-строке (SELECT * ...)"""
+        async with read_scope(session) as session:
+            return list(await session.scalars(cls._as_select(stmt), params))
+
+
+def engine_options(database_url: str) -> Dict[str, Any]:
+    """Параметры пула и драйвера из настроек; SQLite работает с пулом по умолчанию"""
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return {}
+
+    options = {
+        "poolclass": MeteredPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+    if url.get_driver_name() == "asyncpg":
+        # Подготовленные запросы кэшируются на соединении по тексту SQL:
+        # постоянные text() и select() разбираются сервером один раз
+        connect_args = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "command_timeout": DB_COMMAND_TIMEOUT
+        }
+        if DB_STATEMENT_TIMEOUT > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+        options["connect_args"] = connect_args
+    return options
 
 
 # Создаем движок базы данных
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,  # Поставить True для логирования SQL запросов
-    future=True
+    future=True,
+    query_cache_size=DB_QUERY_CACHE_SIZE,
+    **engine_options(DATABASE_URL)
 )
 
+if engine.dialect.name == "sqlite":
+    # pysqlite сам решает, когда начинать транзакцию, и SAVEPOINT без BEGIN коммитится сразу.
+    # Транзакциями управляет SQLAlchemy - вложенные транзакции сессии апдейта работают как в PostgreSQL
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _sqlite_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+
 # Создаем фабрику сессий
 async_session = async_sessionmaker(
     engine,
@@ -44,6 +131,77 @@ async def get_session():
             await session.close()
 
 
+def current_session() -> Optional[AsyncSession]:
+    """Сессия unit of work текущего апдейта (None - вне апдейта или в другой задаче)"""
+    current = _current_session.get()
+    # Фоновые задачи наследуют контекст, но не должны делить сессию с апдейтом
+    if current is None or current[1] is not asyncio.current_task():
+        return None
+    return current[0]
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[AsyncSession]:
+    """Одна сессия и одна транзакция на весь апдейт.
+
+    Хелперы моделей внутри берут эту сессию вместо своей: соединение из пула одно,
+    коммит один в конце. Исключение откатывает все изменения апдейта.
+    """
+    async with async_session() as session:
+        token = _current_session.set((session, asyncio.current_task()))
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            _current_session.reset(token)
+
+
+@asynccontextmanager
+async def session_scope(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """Сессия для записи.
+
+    Внешняя сессия - как есть, коммит за вызывающим кодом. Сессия апдейта - внутри SAVEPOINT:
+    ошибка хелпера откатывает только его изменения. Иначе - новая сессия с коммитом на выходе.
+    """
+    if session is not None:
+        yield session
+        return
+
+    session = current_session()
+    if session is not None:
+        async with session.begin_nested():
+            yield session
+        return
+
+    async with async_session() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+@asynccontextmanager
+async def read_scope(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """Сессия для чтения: внешняя, сессия апдейта или новая без коммита"""
+    session = session or current_session()
+    if session is not None:
+        yield session
+        return
+
+    async with async_session() as session:
+        yield session
+
+
+def get_db_pool_stats() -> Dict[str, Any]:
+    """Метрики пула соединений для админки"""
+    return get_pool_stats(engine.pool)
+
+
 async def init_db():
     """Инициализация базы данных - создание таблиц"""
     try:
@@ -54,6 +212,10 @@ async def init_db():
             from database.models.transaction import Transaction
             from database.models.room import Room
             from database.models.wallet_history import WalletHistory
+            from database.models.match_queue import MatchQueueEntry
+            from database.models.payout_outbox import PayoutOutbox
+            from database.models.ledger import LedgerEntry, BalanceSnapshot
+            from database.models.partition_rollup import PartitionRollup
 
             # Создаем все таблицы
             await conn.run_sync(Base.metadata.create_all)
@@ -67,4 +229,6 @@ async def init_db():
 async def close_db():
     """Закрытие соединения с базой данных"""
     await engine.dispose()
+    from database.replica import replica_router
+    await replica_router.close()
     logger.info("🔒 Database connection closed")
\ No newline at end of file
@@ -3,14 +3,18 @@
 """
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List, Tuple
 from enum import Enum as PyEnum
 
-from sqlalchemy import Integer, String, DECIMAL, DateTime, Boolean, ForeignKey, Enum, text
+from sqlalchemy import (
+    Integer, String, DECIMAL, DateTime, Boolean, Enum, Index, text, insert, update, case, select, or_
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.connection import Base, async_session
+from database.connection import Base, session_scope, read_scope
+from database.replica import replica_router
+from utils.pagination import Cursor, Page, seek, make_page
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -32,17 +36,25 @@ class CoinSide(PyEnum):
 
 class Duel(Base):
     __tablename__ = "duels"
+    __table_args__ = (
+        Index("ix_duels_status_house", "status", "is_house_duel"),
+        # История завершенных дуэлей игрока с курсором (finished_at, id)
+        Index("ix_duels_player1_finished", "player1_id", "finished_at", "id",
+              postgresql_where=text("status = 'FINISHED'"), sqlite_where=text("status = 'FINISHED'")),
+        Index("ix_duels_player2_finished", "player2_id", "finished_at", "id",
+              postgresql_where=text("status = 'FINISHED'"), sqlite_where=text("status = 'FINISHED'")),
+    )
 
     # Основные поля
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
-    # Игроки
-    player1_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
-    player2_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
+    # Игроки (без внешних ключей: таблица партиционирована, см. миграцию 0003)
+    player1_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    player2_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # Игровые данные
     stake: Mapped[Decimal] = mapped_column(DECIMAL(20, 6), nullable=False)  # Ставка
-    winner_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
+    winner_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     coin_result: Mapped[Optional[CoinSide]] = mapped_column(Enum(CoinSide), nullable=True)
 
     # Выплаты
@@ -60,94 +72,275 @@ class Duel(Base):
     finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     # Связи
-    player1: Mapped["User"] = relationship("User", foreign_keys=[player1_id], back_populates="duels_as_player1")
-    player2: Mapped[Optional["User"]] = relationship("User", foreign_keys=[player2_id],
+    player1: Mapped["User"] = relationship("User", primaryjoin="foreign(Duel.player1_id) == User.id",
+                                           back_populates="duels_as_player1")
+    player2: Mapped[Optional["User"]] = relationship("User", primaryjoin="foreign(Duel.player2_id) == User.id",
                                                      back_populates="duels_as_player2")
-    winner: Mapped[Optional["User"]] = relationship("User", foreign_keys=[winner_id])
-    transactions: Mapped[list["Transaction"]] = relationship("Transaction", back_populates="duel")
+    winner: Mapped[Optional["User"]] = relationship("User", primaryjoin="foreign(Duel.winner_id) == User.id")
+    transactions: Mapped[list["Transaction"]] = relationship(
+        "Transaction", primaryjoin="Duel.id == foreign(Transaction.duel_id)", back_populates="duel"
+    )
 
     @classmethod
     async def create_duel(cls, player1_id: int, stake: Decimal, is_house: bool = False,
-                          house_account: str = None) -> "Duel":
-        """Создать новую дуэль"""
-        async with async_session() as session:
-            try:
-                duel = cls(
-                    player1_id=player1_id,
-                    stake=stake,
-                    is_house_duel=is_house,
-                    house_account_name=house_account
+                          house_account: str = None, session: Optional[AsyncSession] = None) -> "Duel":
+        """Создать новую дуэль (id и значения по умолчанию - через RETURNING)"""
+        try:
+            async with session_scope(session) as session:
+                duel = await session.scalar(
+                    insert(cls)
+                    .values(
+                        player1_id=player1_id,
+                        stake=stake,
+                        is_house_duel=is_house,
+                        house_account_name=house_account
+                    )
+                    .returning(cls)
                 )
-                session.add(duel)
-                await session.commit()
-                await session.refresh(duel)
-                logger.info(f"✅ Created new duel: {duel.id}, stake: {stake}")
-                return duel
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error creating duel: {e}")
-                raise
+            logger.info(f"✅ Created new duel: {duel.id}, stake: {stake}")
+            return duel
+        except Exception as e:
+            logger.error(f"❌ Error creating duel: {e}")
+            raise
 
     @classmethod
-    async def get_by_id(cls, duel_id: int) -> Optional["Duel"]:
+    async def create_matched_duels(cls, pairs: List[Tuple[int, int, Decimal]],
+                                   session: Optional[AsyncSession] = None) -> List["Duel"]:
+        """Создать активные дуэли для пар (player1_id, player2_id, stake) одной транзакцией.
+
+        Дуэли и ставки DUEL_STAKE вставляются двумя многострочными INSERT
+        вместо отдельной сессии на каждую запись.
+        """
+        from database.models.transaction import Transaction, TransactionType
+
+        if not pairs:
+            return []
+
+        now = datetime.utcnow()
+        try:
+            async with session_scope(session) as session:
+                result = await session.scalars(
+                    insert(cls).returning(cls, sort_by_parameter_order=True),
+                    [
+                        {
+                            "player1_id": player1_id,
+                            "player2_id": player2_id,
+                            "stake": stake,
+                            "status": DuelStatus.ACTIVE,
+                            "is_house_duel": False,
+                            "created_at": now,
+                            "started_at": now
+                        }
+                        for player1_id, player2_id, stake in pairs
+                    ]
+                )
+                duels = list(result)
+
+                await Transaction.create_many(
+                    [
+                        {
+                            "user_id": player_id,
+                            "type": TransactionType.DUEL_STAKE,
+                            "amount": duel.stake,
+                            "duel_id": duel.id,
+                            "description": f"Ставка в дуэли #{duel.id}",
+                            "created_at": now
+                        }
+                        for duel in duels
+                        for player_id in (duel.player1_id, duel.player2_id)
+                    ],
+                    session=session,
+                    returning=False
+                )
+            logger.info(f"✅ Created {len(duels)} matched duels")
+            return duels
+        except Exception as e:
+            logger.error(f"❌ Error creating matched duels: {e}")
+            raise
+
+    @classmethod
+    async def get_by_id(cls, duel_id: int, session: Optional[AsyncSession] = None) -> Optional["Duel"]:
         """Получить дуэль по ID"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM duels WHERE id = :duel_id"),
-                {"duel_id": duel_id}
+        return await cls.fetch_one(select(cls).where(cls.id == duel_id), session=session)
+
+    @classmethod
+    async def get_finished_duels_page(cls, telegram_id: int, limit: int = 10, cursor: Optional[Cursor] = None,
+                                      newer: bool = False, session: Optional[AsyncSession] = None) -> Page:
+        """Страница завершенных дуэлей игрока.
+
+        Игрок может быть первым или вторым: два диапазона по частичным индексам
+        вместо OR, который индексом не обслуживается. Без переданной сессии читает с реплики.
+        """
+        async with (read_scope(session) if session else replica_router.session()) as session:
+            duels = []
+            for player_column in (cls.player1_id, cls.player2_id):
+                result = await session.scalars(
+                    seek(
+                        select(cls).where(player_column == telegram_id, cls.status == DuelStatus.FINISHED),
+                        cls.finished_at, cls.id, cursor, newer, limit
+                    )
+                )
+                duels.extend(result)
+
+        key = lambda duel: (duel.finished_at, duel.id)
+        duels.sort(key=key, reverse=not newer)
+        return make_page(duels[:limit + 1], limit, cursor, newer, key=key)
+
+    @classmethod
+    async def find_matched_duel(cls, telegram_id: int, since: datetime) -> Optional["Duel"]:
+        """Последняя дуэль с реальным соперником, созданная для игрока после since.
+
+        Нужна, когда результат подбора не дошел (потерянный NOTIFY): дуэль уже есть в БД.
+        """
+        return await cls.fetch_one(
+            select(cls)
+            .where(
+                or_(cls.player1_id == telegram_id, cls.player2_id == telegram_id),
+                cls.is_house_duel.is_(False),
+                cls.created_at >= since
             )
-            row = result.fetchone()
-            if row:
-                duel = cls()
-                for key, value in row._mapping.items():
-                    setattr(duel, key, value)
-                return duel
-            return None
+            .order_by(cls.id.desc())
+            .limit(1)
+        )
 
     @classmethod
     async def get_waiting_duels(cls, stake: Decimal = None) -> list["Duel"]:
         """Получить дуэли, ожидающие игроков"""
-        async with async_session() as session:
-            if stake:
-                result = await session.execute(
-                    text("SELECT * FROM duels WHERE status = 'waiting' AND stake = :stake ORDER BY created_at"),
-                    {"stake": float(stake)}
-                )
-            else:
-                result = await session.execute(
-                    text("SELECT * FROM duels WHERE status = 'waiting' ORDER BY created_at")
-                )
-
-            duels = []
-            for row in result.fetchall():
-                duel = cls()
-                for key, value in row._mapping.items():
-                    setattr(duel, key, value)
-                duels.append(duel)
-            return duels
+        stmt = select(cls).where(cls.status == DuelStatus.WAITING).order_by(cls.created_at)
+        if stake:
+            stmt = stmt.where(cls.stake == stake)
+        return await cls.fetch_all(stmt)
 
-    async def add_player2(self, player2_id: int) -> bool:
+    async def add_player2(self, player2_id: int, session: Optional[AsyncSession] = None) -> bool:
         """Добавить второго игрока"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 self.player2_id = player2_id
                 self.status = DuelStatus.ACTIVE
                 self.started_at = datetime.utcnow()
 
                 session.add(self)
-                await session.commit()
-                logger.info(f"✅ Added player2 to duel {self.id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error adding player2 to duel {self.id}: {e}")
-                return False
+            logger.info(f"✅ Added player2 to duel {self.id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error adding player2 to duel {self.id}: {e}")
+            return False
+
+    @classmethod
+    async def settle_duel(cls, duel_id: int, player_wins: bool, house_only: bool = False,
+                          session: Optional[AsyncSession] = None
+                          ) -> Optional[Tuple["Duel", Optional["Transaction"]]]:
+        """Завершить дуэль одной транзакцией.
+
+        Условный UPDATE по status='active' гарантирует, что дуэль рассчитывается один раз.
+        В той же транзакции обновляется статистика обоих игроков, создается транзакция выигрыша
+        и заявка в payout_outbox.
+        Возвращает (дуэль, транзакция выигрыша) или None, если дуэль уже не активна.
+        """
+        from database.models.user import User
+        from database.models.transaction import Transaction, TransactionType
+        from database.models.payout_outbox import PayoutOutbox
+        from database.models.ledger import LedgerEntry, HOUSE_ACCOUNT, HOT_WALLET_ACCOUNT
+
+        now = datetime.utcnow()
+        conditions = [cls.id == duel_id, cls.status == DuelStatus.ACTIVE]
+        if house_only:
+            conditions.append(cls.is_house_duel.is_(True))
+
+        # Победитель получает свою ставку + 70% от ставки оппонента,
+        # проигравший бот не получает ничего
+        if player_wins:
+            winner_amount = cls.stake * Decimal("1.7")
+        else:
+            winner_amount = case((cls.is_house_duel.is_(True), Decimal("0")), else_=cls.stake * Decimal("1.7"))
+
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                    update(cls)
+                    .where(*conditions)
+                    .values(
+                        winner_id=cls.player1_id if player_wins else cls.player2_id,
+                        coin_result=CoinSide.HEADS if player_wins else CoinSide.TAILS,
+                        winner_amount=winner_amount,
+                        house_commission=cls.stake * Decimal("0.3"),
+                        status=DuelStatus.FINISHED,
+                        finished_at=now
+                    )
+                    .returning(cls)
+                    # Дуэль могла быть загружена раньше в сессии апдейта - берем значения из RETURNING
+                    .execution_options(synchronize_session=False, populate_existing=True)
+                )
+                duel = result.scalar_one_or_none()
+                if duel is None:
+                    return None
+
+                # Статистика обоих игроков одним UPDATE (бот в статистику не попадает)
+                players = [duel.player1_id]
+                if not duel.is_house_duel and duel.player2_id:
+                    players.append(duel.player2_id)
+
+                is_winner = User.telegram_id == duel.winner_id
+                users = await session.execute(
+                    update(User)
+                    .where(User.telegram_id.in_(players))
+                    .values(
+                        total_games=User.total_games + 1,
+                        total_wagered=User.total_wagered + duel.stake,
+                        wins=User.wins + case((is_winner, 1), else_=0),
+                        total_won=User.total_won + case((is_winner, duel.winner_amount), else_=Decimal("0"))
+                    )
+                    .returning(User.id, User.telegram_id, User.wallet_address)
+                    .execution_options(synchronize_session=False)
+                )
+                winner = next((row for row in users if row.telegram_id == duel.winner_id), None)
+                for telegram_id in players:
+                    User.invalidate_cache(telegram_id, session)
+
+                # Запись о выигрыше и заявка на выплату - в той же транзакции,
+                # токены отправят воркеры выплат после коммита
+                win_transaction = None
+                if winner and duel.winner_amount > 0:
+                    win_transaction = await session.scalar(
+                        insert(Transaction)
+                        .values(
+                            user_id=winner.id,
+                            type=TransactionType.DUEL_WIN,
+                            amount=duel.winner_amount,
+                            duel_id=duel.id,
+                            to_address=winner.wallet_address,
+                            description=f"Выигрыш в дуэли #{duel.id}",
+                            created_at=now
+                        )
+                        .returning(Transaction)
+                    )
+                    await session.execute(
+                        insert(PayoutOutbox).values(
+                            transaction_id=win_transaction.id,
+                            telegram_id=duel.winner_id,
+                            wallet_address=winner.wallet_address,
+                            amount=duel.winner_amount,
+                            created_at=now,
+                            next_attempt_at=now
+                        )
+                    )
+                    # Выигрыш уходит из кассы в сеть
+                    await LedgerEntry.record(
+                        session, HOUSE_ACCOUNT, HOT_WALLET_ACCOUNT, duel.winner_amount,
+                        "duel_payout", f"duel:{duel.id}"
+                    )
+
+            logger.info(f"✅ Settled duel {duel.id}, winner: {duel.winner_id}")
+            return duel, win_transaction
+        except Exception as e:
+            logger.error(f"❌ Error settling duel {duel_id}: {e}")
+            raise
 
     async def finish_duel(self, winner_id: int, coin_result: CoinSide, winner_amount: Decimal,
-                          commission: Decimal) -> bool:
+                          commission: Decimal, session: Optional[AsyncSession] = None) -> bool:
         """Завершить дуэль"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 self.winner_id = winner_id
                 self.coin_result = coin_result
                 self.winner_amount = winner_amount
@@ -156,29 +349,25 @@ class Duel(Base):
                 self.finished_at = datetime.utcnow()
 
                 session.add(self)
-                await session.commit()
-                logger.info(f"✅ Finished duel {self.id}, winner: {winner_id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error finishing duel {self.id}: {e}")
-                return False
-
-    async def cancel_duel(self) -> bool:
+            logger.info(f"✅ Finished duel {self.id}, winner: {winner_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error finishing duel {self.id}: {e}")
+            return False
+
+    async def cancel_duel(self, session: Optional[AsyncSession] = None) -> bool:
         """Отменить дуэль"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 self.status = DuelStatus.CANCELLED
                 self.finished_at = datetime.utcnow()
 
                 session.add(self)
-                await session.commit()
-                logger.info(f"✅ Cancelled duel {self.id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error cancelling duel {self.id}: {e}")
-                return False
+            logger.info(f"✅ Cancelled duel {self.id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error cancelling duel {self.id}: {e}")
+            return False
 
     def get_opponent_id(self, player_id: int) -> Optional[int]:
         """Получить ID оппонента"""
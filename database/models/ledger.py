@@ -0,0 +1,171 @@
+"""
+Модель двойной записи движения средств (append-only журнал) и снимков балансов
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import BigInteger, Integer, String, DECIMAL, DateTime, Index, bindparam, insert, text
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import Base, async_session
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Счет казино: ставки, комиссия, выигрыши
+HOUSE_ACCOUNT = "house"
+# Встречный счет для движений в сети: депозиты списываются с него, выводы и выплаты зачисляются на него
+HOT_WALLET_ACCOUNT = "hot_wallet"
+
+
+def user_account(telegram_id: int) -> str:
+    """Счет пользователя в журнале"""
+    return f"user:{telegram_id}"
+
+
+class LedgerEntry(Base):
+    """Проводка: перевод amount со счета source на счет destination.
+
+    Одна строка - обе стороны записи, поэтому сумма по всем счетам всегда равна нулю.
+    """
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        Index("ix_ledger_entries_source_id", "source_account", "id"),
+        Index("ix_ledger_entries_destination_id", "destination_account", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    source_account: Mapped[str] = mapped_column(String(64), nullable=False)
+    destination_account: Mapped[str] = mapped_column(String(64), nullable=False)
+    amount: Mapped[Decimal] = mapped_column(DECIMAL(20, 6), nullable=False)
+    reason: Mapped[str] = mapped_column(String(32), nullable=False)
+    reference: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)  # duel:12, tx:<hash>
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    async def record(cls, session: AsyncSession, source: str, destination: str, amount: Decimal,
+                     reason: str, reference: Optional[str] = None):
+        """Записать перевод в транзакции вызывающего кода (коммит - вместе с изменением баланса)"""
+        await session.execute(
+            insert(cls).values(
+                source_account=source,
+                destination_account=destination,
+                amount=amount,
+                reason=reason,
+                reference=reference,
+                created_at=datetime.utcnow()
+            )
+        )
+
+    @classmethod
+    async def balance_at(cls, account: str, at: Optional[datetime] = None) -> Decimal:
+        """Баланс счета на момент at: последний снимок до at плюс проводки после него"""
+        at = at or datetime.utcnow()
+        async with async_session() as session:
+            snapshot = (await session.execute(
+                text("""
+                    SELECT balance, last_entry_id FROM ledger_snapshots
+                    WHERE account = :account AND created_at <= :at
+                    ORDER BY last_entry_id DESC
+                    LIMIT 1
+                """),
+                {"account": account, "at": at}
+            )).fetchone()
+
+            base_balance = snapshot.balance if snapshot else Decimal(0)
+            last_entry_id = snapshot.last_entry_id if snapshot else 0
+
+            # Обе стороны проводок идут по своим индексам (account, id)
+            delta = (await session.execute(
+                text("""
+                    SELECT
+                        COALESCE((SELECT SUM(amount) FROM ledger_entries
+                                  WHERE destination_account = :account AND id > :last_entry_id
+                                    AND created_at <= :at), 0)
+                        - COALESCE((SELECT SUM(amount) FROM ledger_entries
+                                    WHERE source_account = :account AND id > :last_entry_id
+                                      AND created_at <= :at), 0)
+                """),
+                {"account": account, "last_entry_id": last_entry_id, "at": at}
+            )).scalar()
+
+            return Decimal(base_balance) + Decimal(delta)
+
+    def __repr__(self):
+        return (f"<LedgerEntry(id={self.id}, {self.source_account} -> {self.destination_account}, "
+                f"amount={self.amount}, reason={self.reason})>")
+
+
+class BalanceSnapshot(Base):
+    """Снимок баланса счета: сумма всех проводок с id <= last_entry_id"""
+    __tablename__ = "ledger_snapshots"
+    __table_args__ = (
+        Index("ix_ledger_snapshots_account_entry", "account", "last_entry_id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account: Mapped[str] = mapped_column(String(64), nullable=False)
+    balance: Mapped[Decimal] = mapped_column(DECIMAL(20, 6), nullable=False)
+    last_entry_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    async def take_snapshots(cls, settle_seconds: int = 60) -> int:
+        """Снять снимки по всем счетам, у которых были проводки после прошлого снимка.
+
+        Читаются только проводки после предыдущего снимка. Берутся проводки старше
+        settle_seconds, чтобы не пропустить строки еще не закоммиченных транзакций с меньшими id.
+        Граница считается в Python по utcnow(), как и created_at проводок, - часовой пояс
+        сервера БД не важен. Запрос без DISTINCT ON и make_interval работает и на SQLite
+        (INSERT идет первым, чтобы драйвер SQLite вернул rowcount).
+        """
+        now = datetime.utcnow()
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    text("""
+                        INSERT INTO ledger_snapshots (account, balance, last_entry_id, created_at)
+                        WITH bound AS (
+                            SELECT COALESCE(MAX(id), 0) AS max_id FROM ledger_entries
+                            WHERE created_at < :cutoff
+                        ),
+                        previous AS (
+                            SELECT COALESCE(MAX(last_entry_id), 0) AS max_id FROM ledger_snapshots
+                        ),
+                        changes AS (
+                            SELECT e.destination_account AS account, e.amount AS amount
+                            FROM ledger_entries e, bound, previous
+                            WHERE e.id > previous.max_id AND e.id <= bound.max_id
+                            UNION ALL
+                            SELECT e.source_account AS account, -e.amount AS amount
+                            FROM ledger_entries e, bound, previous
+                            WHERE e.id > previous.max_id AND e.id <= bound.max_id
+                        )
+                        SELECT
+                            c.account,
+                            -- Последний снимок счета - по индексу (account, last_entry_id)
+                            COALESCE((SELECT s.balance FROM ledger_snapshots s
+                                      WHERE s.account = c.account
+                                      ORDER BY s.last_entry_id DESC
+                                      LIMIT 1), 0) + SUM(c.amount),
+                            bound.max_id,
+                            :now
+                        FROM changes c
+                        CROSS JOIN bound
+                        GROUP BY c.account, bound.max_id
+                    """).bindparams(
+                        bindparam("cutoff", now - timedelta(seconds=settle_seconds), type_=DateTime),
+                        bindparam("now", now, type_=DateTime)
+                    )
+                )
+                await session.commit()
+                return result.rowcount
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error taking balance snapshots: {e}")
+                return 0
+
+    def __repr__(self):
+        return f"<BalanceSnapshot(account={self.account}, balance={self.balance}, last_entry_id={self.last_entry_id})>"
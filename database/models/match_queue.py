@@ -0,0 +1,232 @@
+"""
+Модель общей очереди поиска игры (для нескольких процессов бота)
+"""
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from enum import Enum as PyEnum
+
+from sqlalchemy import Integer, BigInteger, String, DECIMAL, DateTime, text
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import Base, async_session, session_scope
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Канал LISTEN/NOTIFY, в который сообщается о найденном сопернике
+MATCH_QUEUE_CHANNEL = "match_queue"
+
+
+class MatchQueueStatus(PyEnum):
+    """Статусы заявки в очереди"""
+    WAITING = "waiting"  # Ждет соперника
+    MATCHED = "matched"  # Соперник найден, дуэль создается
+
+
+class MatchQueueEntry(Base):
+    __tablename__ = "match_queue"
+
+    # Основные поля
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Telegram ID игрока
+    username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    stake: Mapped[Decimal] = mapped_column(DECIMAL(20, 6), nullable=False)
+
+    # Статус хранится строкой, чтобы очередь читалась простым SQL
+    status: Mapped[str] = mapped_column(String(16), default=MatchQueueStatus.WAITING.value)
+
+    # Временные метки
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    async def enqueue(cls, user_id: int, username: Optional[str], stake: Decimal) -> int:
+        """Добавить заявку в очередь, вернуть ее ID"""
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    text("""
+                        INSERT INTO match_queue (user_id, username, stake, status, created_at)
+                        VALUES (:user_id, :username, :stake, 'waiting', NOW())
+                        RETURNING id
+                    """),
+                    {"user_id": user_id, "username": username, "stake": stake}
+                )
+                entry_id = result.scalar()
+                await session.commit()
+                return entry_id
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error enqueueing user {user_id} to match queue: {e}")
+                raise
+
+    @classmethod
+    async def claim(cls, user_id: int, low: Decimal, high: Decimal, stake: Decimal,
+                    max_age_seconds: int) -> Optional[Dict]:
+        """Атомарно забрать ближайшую по ставке заявку другого игрока.
+
+        Строки, уже заблокированные другими процессами, пропускаются (SKIP LOCKED),
+        поэтому несколько воркеров разбирают очередь без взаимных ожиданий.
+        """
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    text("""
+                        UPDATE match_queue SET status = 'matched'
+                        WHERE id = (
+                            SELECT id FROM match_queue
+                            WHERE status = 'waiting'
+                              AND user_id <> :user_id
+                              AND stake BETWEEN :low AND :high
+                              AND created_at > NOW() - make_interval(secs => :max_age)
+                            ORDER BY ABS(stake - :stake), stake, created_at
+                            LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, user_id, username, stake
+                    """),
+                    {"user_id": user_id, "low": low, "high": high, "stake": stake,
+                     "max_age": max_age_seconds}
+                )
+                row = result.fetchone()
+                await session.commit()
+                return dict(row._mapping) if row else None
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error claiming match queue entry for user {user_id}: {e}")
+                return None
+
+    @classmethod
+    async def claim_pairs(cls, to_ticket: Callable[[Dict], Any],
+                          make_pairs: Callable[[List[Any]], List[Tuple[Any, Any]]],
+                          max_age_seconds: int, limit: int = 1000) -> List[Tuple[Any, Any]]:
+        """Забрать пары заявок одной транзакцией.
+
+        Ожидающие заявки блокируются (SKIP LOCKED), make_pairs составляет из них пары,
+        и все попавшие в пары заявки помечаются одним UPDATE.
+        """
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    text("""
+                        SELECT id, user_id, username, stake FROM match_queue
+                        WHERE status = 'waiting'
+                          AND created_at > NOW() - make_interval(secs => :max_age)
+                        ORDER BY stake, created_at
+                        LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    """),
+                    {"max_age": max_age_seconds, "limit": limit}
+                )
+                tickets = [to_ticket(dict(row._mapping)) for row in result.fetchall()]
+                pairs = make_pairs(tickets)
+
+                if pairs:
+                    await session.execute(
+                        text("UPDATE match_queue SET status = 'matched' WHERE id = ANY(:ids)"),
+                        {"ids": [ticket.entry_id for pair in pairs for ticket in pair]}
+                    )
+                await session.commit()
+                return pairs
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error claiming match queue pairs: {e}")
+                return []
+
+    @classmethod
+    async def withdraw(cls, entry_id: int, session: Optional[AsyncSession] = None) -> bool:
+        """Удалить заявку, если ее еще никто не забрал.
+
+        С внешней сессией коммит и обработка ошибок - за вызывающим кодом.
+        """
+        try:
+            async with session_scope(session) as scope:
+                result = await scope.execute(
+                    text("DELETE FROM match_queue WHERE id = :id AND status = 'waiting' RETURNING id"),
+                    {"id": entry_id}
+                )
+                return result.scalar() is not None
+        except Exception as e:
+            logger.error(f"❌ Error withdrawing match queue entry {entry_id}: {e}")
+            if session is not None:
+                raise
+            return False
+
+    @classmethod
+    async def notify_match(cls, entry_id: int, result: Optional[Dict]) -> bool:
+        """Сообщить ожидающему процессу результат подбора.
+
+        NOTIFY доставляется слушателям только после коммита.
+        """
+        payload = json.dumps({"id": entry_id, "result": result}, default=str)
+        async with async_session() as session:
+            try:
+                await session.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": MATCH_QUEUE_CHANNEL, "payload": payload}
+                )
+                await session.execute(
+                    text("DELETE FROM match_queue WHERE id = :id"),
+                    {"id": entry_id}
+                )
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error notifying match for entry {entry_id}: {e}")
+                return False
+
+    @classmethod
+    async def notify_matches(cls, matches: List[Tuple[int, Optional[Dict]]]) -> bool:
+        """Сообщить результаты нескольким заявкам одной транзакцией"""
+        async with async_session() as session:
+            try:
+                await session.execute(
+                    text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+                    {"channel": MATCH_QUEUE_CHANNEL,
+                     "payloads": [json.dumps({"id": entry_id, "result": result}, default=str)
+                                  for entry_id, result in matches]}
+                )
+                await session.execute(
+                    text("DELETE FROM match_queue WHERE id = ANY(:ids)"),
+                    {"ids": [entry_id for entry_id, _ in matches]}
+                )
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error notifying {len(matches)} matches: {e}")
+                return False
+
+    @classmethod
+    async def cleanup_stale(cls, max_age_seconds: int) -> int:
+        """Удалить заявки, брошенные упавшими процессами"""
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    text("""
+                        DELETE FROM match_queue
+                        WHERE created_at < NOW() - make_interval(secs => :max_age)
+                    """),
+                    {"max_age": max_age_seconds}
+                )
+                await session.commit()
+                return result.rowcount
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error cleaning up match queue: {e}")
+                return 0
+
+    @classmethod
+    async def count_waiting(cls) -> int:
+        """Количество ожидающих заявок"""
+        async with async_session() as session:
+            result = await session.execute(
+                text("SELECT COUNT(*) FROM match_queue WHERE status = 'waiting'")
+            )
+            return result.scalar()
+
+    def __repr__(self):
+        return f"<MatchQueueEntry(id={self.id}, user_id={self.user_id}, stake={self.stake}, status={self.status})>"
@@ -0,0 +1,149 @@
+"""
+Помесячные итоги по партициям transactions и duels для статистики админки
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import Integer, String, DateTime, JSON, UniqueConstraint, insert, select, text
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import Base, session_scope, read_scope
+from database.replica import replica_router
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Итоги месяца считаются, когда месяц закончился хотя бы столько времени назад
+ROLLUP_DELAY = timedelta(days=1)
+
+# Верхняя граница «до конца времен» для живой части статистики
+FAR_FUTURE = datetime(9999, 1, 1)
+
+# Метрики месяца по таблице: один проход по одной партиции (фильтр по created_at)
+ROLLUP_QUERIES = {
+    "duels": """
+        SELECT
+            COALESCE(SUM(CASE WHEN status = 'FINISHED' THEN 1 ELSE 0 END), 0) AS finished,
+            COALESCE(SUM(CASE WHEN status = 'FINISHED' AND is_house_duel = true THEN 1 ELSE 0 END), 0) AS house_finished,
+            COALESCE(SUM(CASE WHEN status = 'FINISHED' THEN stake ELSE 0 END), 0) AS stake_sum,
+            COALESCE(SUM(CASE WHEN status = 'FINISHED' THEN COALESCE(house_commission, 0) ELSE 0 END), 0) AS commission_sum,
+            COALESCE(SUM(CASE WHEN status = 'FINISHED' THEN COALESCE(winner_amount, 0) ELSE 0 END), 0) AS winnings_sum
+        FROM duels
+        WHERE created_at >= :start AND created_at < :end
+    """,
+    "transactions": """
+        SELECT
+            COALESCE(SUM(CASE WHEN type = 'DEPOSIT' THEN 1 ELSE 0 END), 0) AS deposits,
+            COALESCE(SUM(CASE WHEN type = 'DEPOSIT' THEN amount ELSE 0 END), 0) AS deposit_sum
+        FROM transactions
+        WHERE created_at >= :start AND created_at < :end
+    """,
+}
+
+
+def month_start(moment: datetime) -> datetime:
+    """Начало месяца"""
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """Сдвинуть начало месяца на months месяцев"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+class PartitionRollup(Base):
+    """Итоги одного месяца таблицы. Закрытые месяцы не пересчитываются и переживают архивацию партиций"""
+    __tablename__ = "partition_rollups"
+    __table_args__ = (
+        UniqueConstraint("table_name", "month", name="uq_partition_rollups_table_month"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    table_name: Mapped[str] = mapped_column(String(64), nullable=False)
+    month: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # Начало месяца
+    metrics: Mapped[dict] = mapped_column(JSON, nullable=False)  # {метрика: строка с числом}
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    async def compute(cls, table_name: str, start: datetime, end: datetime = FAR_FUTURE,
+                      session: Optional[AsyncSession] = None) -> Dict[str, Decimal]:
+        """Посчитать метрики таблицы за период [start, end)"""
+        async with read_scope(session) as session:
+            row = (await session.execute(
+                text(ROLLUP_QUERIES[table_name]), {"start": start, "end": end}
+            )).fetchone()
+            return {key: Decimal(value) for key, value in row._mapping.items()}
+
+    @classmethod
+    async def get_live_from(cls, table_name: str, session: Optional[AsyncSession] = None) -> Optional[datetime]:
+        """Начало месяца, с которого итогов еще нет (None - итогов нет совсем)"""
+        async with read_scope(session) as session:
+            last_month = await session.scalar(
+                select(cls.month).where(cls.table_name == table_name).order_by(cls.month.desc()).limit(1)
+            )
+            return add_months(last_month, 1) if last_month else None
+
+    @classmethod
+    async def pending_months(cls, table_name: str, now: Optional[datetime] = None) -> List[datetime]:
+        """Закончившиеся месяцы, по которым еще нет итогов"""
+        now = now or datetime.utcnow()
+        first = await cls.get_live_from(table_name)
+        if first is None:
+            async with read_scope() as session:
+                oldest = await session.scalar(text(f"SELECT MIN(created_at) FROM {table_name}"))
+            if oldest is None:
+                return []
+            if isinstance(oldest, str):  # SQLite отдает текст
+                oldest = datetime.fromisoformat(oldest)
+            first = month_start(oldest)
+
+        months = []
+        month = first
+        while add_months(month, 1) + ROLLUP_DELAY <= now:
+            months.append(month)
+            month = add_months(month, 1)
+        return months
+
+    @classmethod
+    async def rollup_month(cls, table_name: str, month: datetime) -> Dict[str, Decimal]:
+        """Посчитать и сохранить итоги месяца"""
+        metrics = await cls.compute(table_name, month, add_months(month, 1))
+        try:
+            async with session_scope() as session:
+                await session.execute(
+                    insert(cls).values(
+                        table_name=table_name,
+                        month=month,
+                        metrics={key: str(value) for key, value in metrics.items()},
+                        created_at=datetime.utcnow()
+                    )
+                )
+            return metrics
+        except Exception as e:
+            logger.error(f"❌ Error saving rollup for {table_name} {month:%Y-%m}: {e}")
+            raise
+
+    @classmethod
+    async def get_totals(cls, table_name: str, session: Optional[AsyncSession] = None) -> Dict[str, Decimal]:
+        """Метрики за все время: сохраненные итоги плюс живой подсчет по месяцам без итогов.
+
+        Живая часть ограничена по created_at, поэтому читает только свежие партиции.
+        Без переданной сессии читает с реплики (если она настроена и не отстает).
+        """
+        if session is None:
+            async with replica_router.session() as session:
+                return await cls.get_totals(table_name, session=session)
+
+        rollups = (await session.scalars(select(cls.metrics).where(cls.table_name == table_name))).all()
+        live_from = await cls.get_live_from(table_name, session=session)
+        totals = await cls.compute(table_name, live_from or datetime(1970, 1, 1), session=session)
+        for metrics in rollups:
+            for key, value in metrics.items():
+                totals[key] = totals.get(key, Decimal(0)) + Decimal(value)
+        return totals
+
+    def __repr__(self):
+        return f"<PartitionRollup(table={self.table_name}, month={self.month:%Y-%m})>"
@@ -0,0 +1,296 @@
+"""
+Модель очереди выплат выигрышей (outbox)
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional, List, Dict
+from enum import Enum as PyEnum
+
+from sqlalchemy import Integer, BigInteger, String, DECIMAL, DateTime, text, update, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from database.connection import Base, async_session
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class PayoutStatus(PyEnum):
+    """Статусы выплаты"""
+    PENDING = "pending"  # Ждет отправки (или повтора)
+    PROCESSING = "processing"  # Забрана воркером
+    SENT = "sent"  # Отправлена в сеть
+    RECONCILE = "reconcile"  # Транзакция могла уйти в сеть: ждет проверки подписи, повтор и возврат запрещены
+    FAILED = "failed"  # Попытки исчерпаны, сумма зачислена на баланс
+
+
+class PayoutOutbox(Base):
+    __tablename__ = "payout_outbox"
+
+    # Основные поля
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    transaction_id: Mapped[int] = mapped_column(Integer, nullable=False)  # Без внешнего ключа: transactions партиционирована
+    telegram_id: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Получатель
+    wallet_address: Mapped[str] = mapped_column(String(44), nullable=False)
+    amount: Mapped[Decimal] = mapped_column(DECIMAL(20, 6), nullable=False)
+
+    # Статус хранится строкой, чтобы очередь читалась простым SQL
+    status: Mapped[str] = mapped_column(String(16), default=PayoutStatus.PENDING.value)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(String(1000), nullable=True)
+
+    # Подпись транзакции записывается до отправки: по ней проверяется выплата с потерянным ответом
+    signature: Mapped[Optional[str]] = mapped_column(String(88), nullable=True)
+    valid_until_height: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # last_valid_block_height
+
+    # Временные метки
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    locked_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    @classmethod
+    async def claim_batch(cls, limit: int = 1) -> List[Dict]:
+        """Забрать готовые к отправке выплаты.
+
+        Строки, забранные другими воркерами (или процессами), пропускаются (SKIP LOCKED на PostgreSQL).
+        Время считается в Python, как и created_at/next_attempt_at при записи.
+        """
+        now = datetime.utcnow()
+        ready = (
+            select(cls.id)
+            .where(cls.status == PayoutStatus.PENDING.value, cls.next_attempt_at <= now)
+            .order_by(cls.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)  # На SQLite не рендерится: там пишет один процесс
+        )
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.id.in_(ready.scalar_subquery()))
+                    .values(status=PayoutStatus.PROCESSING.value, locked_at=now, attempts=cls.attempts + 1)
+                    .returning(cls.id, cls.transaction_id, cls.telegram_id, cls.wallet_address,
+                               cls.amount, cls.attempts)
+                    .execution_options(synchronize_session=False)
+                )
+                rows = [dict(row._mapping) for row in result.fetchall()]
+                await session.commit()
+                return rows
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error claiming payouts: {e}")
+                return []
+
+    @classmethod
+    async def record_signature(cls, payout_ids: List[int], signature: str, valid_until_height: int) -> bool:
+        """Сохранить подпись транзакции до отправки. False - не все выплаты еще наши, отправлять нельзя"""
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.id.in_(payout_ids), cls.status == PayoutStatus.PROCESSING.value)
+                    .values(signature=signature, valid_until_height=valid_until_height)
+                )
+                if result.rowcount != len(payout_ids):
+                    await session.rollback()
+                    return False
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error recording signature for payouts {payout_ids}: {e}")
+                return False
+
+    @classmethod
+    async def mark_sent(cls, payout_id: int, transaction_id: int, tx_hash: str) -> bool:
+        """Отметить выплату отправленной и завершить транзакцию выигрыша"""
+        from database.models.transaction import Transaction, TransactionStatus
+
+        now = datetime.utcnow()
+        async with async_session() as session:
+            try:
+                await session.execute(
+                    update(cls)
+                    .where(cls.id == payout_id)
+                    .values(status=PayoutStatus.SENT.value, sent_at=now, last_error=None, locked_at=None)
+                )
+                await session.execute(
+                    update(Transaction)
+                    .where(Transaction.id == transaction_id)
+                    .values(status=TransactionStatus.COMPLETED, tx_hash=tx_hash, completed_at=now)
+                )
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error marking payout {payout_id} as sent: {e}")
+                return False
+
+    @classmethod
+    async def schedule_retry(cls, payout_id: int, delay_seconds: float, error: str) -> bool:
+        """Вернуть выплату в очередь с задержкой"""
+        async with async_session() as session:
+            try:
+                await session.execute(
+                    update(cls)
+                    .where(cls.id == payout_id)
+                    .values(
+                        status=PayoutStatus.PENDING.value,
+                        locked_at=None,
+                        signature=None,
+                        valid_until_height=None,
+                        last_error=error[:1000],
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay_seconds)
+                    )
+                )
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error scheduling retry for payout {payout_id}: {e}")
+                return False
+
+    @classmethod
+    async def mark_failed(cls, payout: Dict, error: str) -> bool:
+        """Попытки исчерпаны: зачислить выигрыш на баланс и провалить транзакцию.
+
+        Все три изменения - одной транзакцией, чтобы сумма не потерялась и не задвоилась.
+        """
+        from database.models.transaction import Transaction, TransactionStatus
+        from database.models.user import User
+        from database.models.ledger import LedgerEntry, HOT_WALLET_ACCOUNT, user_account
+
+        now = datetime.utcnow()
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.id == payout["id"], cls.status == PayoutStatus.PROCESSING.value)
+                    .values(status=PayoutStatus.FAILED.value, last_error=error[:1000], locked_at=None,
+                            signature=None, valid_until_height=None)
+                    .returning(cls.id)
+                )
+                if result.scalar() is None:
+                    await session.rollback()
+                    return False
+
+                await session.execute(
+                    update(User)
+                    .where(User.telegram_id == payout["telegram_id"])
+                    .values(balance=User.balance + payout["amount"])
+                )
+                User.invalidate_cache(payout["telegram_id"], session)
+                await LedgerEntry.record(
+                    session, HOT_WALLET_ACCOUNT, user_account(payout["telegram_id"]), payout["amount"],
+                    "payout_refund", f"payout:{payout['id']}"
+                )
+                await session.execute(
+                    update(Transaction)
+                    .where(Transaction.id == payout["transaction_id"])
+                    .values(
+                        status=TransactionStatus.FAILED,
+                        error_message="Ошибка отправки, добавлено на баланс",
+                        completed_at=now
+                    )
+                )
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error failing payout {payout['id']}: {e}")
+                return False
+
+    @classmethod
+    async def mark_reconcile(cls, payout_id: int, error: str) -> bool:
+        """Транзакция с выплатой могла уйти в сеть: отложить до проверки подписи"""
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    update(cls)
+                    .where(
+                        cls.id == payout_id,
+                        cls.status == PayoutStatus.PROCESSING.value,
+                        cls.signature.is_not(None)
+                    )
+                    .values(status=PayoutStatus.RECONCILE.value, locked_at=None, last_error=error[:1000])
+                )
+                await session.commit()
+                return result.rowcount == 1
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error marking payout {payout_id} for reconciliation: {e}")
+                return False
+
+    @classmethod
+    async def get_reconcile_batch(cls, limit: int) -> List[Dict]:
+        """Выплаты, ждущие проверки подписи"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(cls.id, cls.transaction_id, cls.telegram_id, cls.amount, cls.attempts,
+                       cls.signature, cls.valid_until_height)
+                .where(cls.status == PayoutStatus.RECONCILE.value)
+                .order_by(cls.id)
+                .limit(limit)
+            )
+            return [dict(row._mapping) for row in result.fetchall()]
+
+    @classmethod
+    async def release_reconcile(cls, payout_id: int) -> bool:
+        """Транзакция точно не попала в блок: забрать выплату обратно в processing для повтора или возврата"""
+        async with async_session() as session:
+            try:
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.id == payout_id, cls.status == PayoutStatus.RECONCILE.value)
+                    .values(status=PayoutStatus.PROCESSING.value, locked_at=datetime.utcnow(),
+                            signature=None, valid_until_height=None)
+                )
+                await session.commit()
+                return result.rowcount == 1
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error releasing payout {payout_id}: {e}")
+                return False
+
+    @classmethod
+    async def recover_stale(cls, timeout_seconds: int) -> int:
+        """Вернуть в очередь выплаты, зависшие в processing после падения процесса.
+
+        Выплаты с записанной подписью могли уйти в сеть - они идут на проверку подписи, а не в очередь.
+        """
+        async with async_session() as session:
+            try:
+                now = datetime.utcnow()
+                stale = (
+                    cls.status == PayoutStatus.PROCESSING.value,
+                    cls.locked_at < now - timedelta(seconds=timeout_seconds)
+                )
+                signed = await session.execute(
+                    update(cls)
+                    .where(*stale, cls.signature.is_not(None))
+                    .values(status=PayoutStatus.RECONCILE.value, locked_at=None)
+                )
+                unsigned = await session.execute(
+                    update(cls)
+                    .where(*stale, cls.signature.is_(None))
+                    .values(status=PayoutStatus.PENDING.value, locked_at=None, next_attempt_at=now)
+                )
+                await session.commit()
+                return signed.rowcount + unsigned.rowcount
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Error recovering stale payouts: {e}")
+                return 0
+
+    @classmethod
+    async def get_stats(cls) -> Dict[str, int]:
+        """Количество выплат по статусам"""
+        async with async_session() as session:
+            result = await session.execute(
+                text("SELECT status, COUNT(*) AS count FROM payout_outbox GROUP BY status")
+            )
+            return {row.status: row.count for row in result.fetchall()}
+
+    def __repr__(self):
+        return f"<PayoutOutbox(id={self.id}, amount={self.amount}, status={self.status})>"
@@ -1,19 +1,28 @@
 """
 Модель игровой комнаты
 """
+import asyncio
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List, Dict
 from enum import Enum as PyEnum
 
-from sqlalchemy import Integer, String, DECIMAL, DateTime, Boolean, ForeignKey, Enum, text
+from sqlalchemy import (
+    Integer, String, DECIMAL, DateTime, Boolean, ForeignKey, Enum, Index, Sequence, insert, select, update, case, func
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.connection import Base, async_session
+from database.connection import Base, session_scope, read_scope
+from config.settings import ROOM_CODE_SECRET, ROOM_CODE_BLOCK_SIZE
 from utils.logger import setup_logger
+from utils import room_codes
 
 logger = setup_logger(__name__)
 
+# Номера блоков для кодов комнат (hi/lo). На SQLite последовательностей нет - см. RoomCodeAllocator
+room_code_sequence = Sequence("room_code_seq", metadata=Base.metadata)
+
 
 class RoomStatus(PyEnum):
     """Статусы комнаты"""
@@ -25,6 +34,9 @@ class RoomStatus(PyEnum):
 
 class Room(Base):
     __tablename__ = "rooms"
+    __table_args__ = (
+        Index("ix_rooms_status_expires", "status", "expires_at"),
+    )
 
     # Основные поля
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -38,8 +50,8 @@ class Room(Base):
     status: Mapped[RoomStatus] = mapped_column(Enum(RoomStatus), default=RoomStatus.WAITING)
     is_private: Mapped[bool] = mapped_column(Boolean, default=False)  # Приватная комната
 
-    # Связанная дуэль (когда комната заполнится)
-    duel_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("duels.id"), nullable=True)
+    # Связанная дуэль (когда комната заполнится); без внешнего ключа - duels партиционирована, см. миграцию 0003
+    duel_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # Временные ограничения
     expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # Когда истекает
@@ -48,182 +60,227 @@ class Room(Base):
 
     # Связи
     creator: Mapped["User"] = relationship("User", back_populates="rooms_created")
-    duel: Mapped[Optional["Duel"]] = relationship("Duel")
+    duel: Mapped[Optional["Duel"]] = relationship("Duel", primaryjoin="foreign(Room.duel_id) == Duel.id")
 
     @classmethod
     async def create_room(cls, creator_id: int, stake: Decimal, is_private: bool = False,
-                          expires_in_minutes: int = 5) -> "Room":
-        """Создать новую комнату"""
-        async with async_session() as session:
-            try:
-                # Генерируем уникальный код комнаты
-                room_code = await cls._generate_room_code()
-                expires_at = datetime.utcnow() + timedelta(minutes=expires_in_minutes)
-
-                room = cls(
-                    room_code=room_code,
-                    creator_id=creator_id,
-                    stake=stake,
-                    is_private=is_private,
-                    expires_at=expires_at
+                          expires_in_minutes: int = 5, session: Optional[AsyncSession] = None) -> Optional["Room"]:
+        """Создать комнату и списать ставку создателя (id и значения по умолчанию - через RETURNING).
+
+        Ставка ждет соперника на счете казино и возвращается при закрытии или истечении комнаты.
+        Возвращает None, если у создателя не хватает средств.
+        """
+        from database.models.user import User
+
+        try:
+            # Генерируем уникальный код комнаты
+            room_code = await cls._generate_room_code()
+            expires_at = datetime.utcnow() + timedelta(minutes=expires_in_minutes)
+
+            # Списание и комната - одной транзакцией
+            async with session_scope(session) as session:
+                if await User.debit_balance(creator_id, stake, reason="duel_stake",
+                                            reference=f"room:{room_code}", session=session) is None:
+                    return None
+
+                room = await session.scalar(
+                    insert(cls)
+                    .values(
+                        room_code=room_code,
+                        creator_id=creator_id,
+                        stake=stake,
+                        is_private=is_private,
+                        expires_at=expires_at
+                    )
+                    .returning(cls)
                 )
-                session.add(room)
-                await session.commit()
-                await session.refresh(room)
-                logger.info(f"✅ Created room: {room.room_code}, stake: {stake}")
-                return room
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error creating room: {e}")
-                raise
+            logger.info(f"✅ Created room: {room.room_code}, stake: {stake}")
+            return room
+        except Exception as e:
+            logger.error(f"❌ Error creating room: {e}")
+            raise
 
     @classmethod
-    async def get_by_code(cls, room_code: str) -> Optional["Room"]:
+    async def get_by_code(cls, room_code: str, session: Optional[AsyncSession] = None) -> Optional["Room"]:
         """Получить комнату по коду"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM rooms WHERE room_code = :room_code"),
-                {"room_code": room_code}
-            )
-            row = result.fetchone()
-            if row:
-                room = cls()
-                for key, value in row._mapping.items():
-                    setattr(room, key, value)
-                return room
-            return None
+        return await cls.fetch_one(select(cls).where(cls.room_code == room_code), session=session)
 
     @classmethod
     async def get_active_rooms(cls, limit: int = 20) -> list["Room"]:
         """Получить активные комнаты"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("""
-                    SELECT * FROM rooms 
-                    WHERE status = 'waiting' AND expires_at > NOW() 
-                    ORDER BY created_at DESC 
-                    LIMIT :limit
-                """),
-                {"limit": limit}
+        return await cls.fetch_all(
+            select(cls)
+            .where(cls.status == RoomStatus.WAITING, cls.expires_at > datetime.utcnow())
+            .order_by(cls.created_at.desc())
+            .limit(limit)
+        )
+
+    @classmethod
+    async def get_waiting_rooms(cls) -> list["Room"]:
+        """Все комнаты, ожидающие игрока (включая уже просроченные, но еще не закрытые)"""
+        return await cls.fetch_all(
+            select(cls).where(cls.status == RoomStatus.WAITING).order_by(cls.created_at)
+        )
+
+    @classmethod
+    async def expire_rooms(cls, room_codes: Optional[List[str]] = None,
+                           session: Optional[AsyncSession] = None) -> List["Room"]:
+        """Пометить истекшими просроченные ожидающие комнаты (все или из room_codes) и вернуть ставки.
+
+        Условный UPDATE ... RETURNING забирает только комнаты, которые еще ждут игрока,
+        поэтому ставка за комнату, к которой успели присоединиться, не возвращается.
+        Возвраты всем создателям - одним UPDATE users и одной пачкой проводок.
+        """
+        if room_codes is not None and not room_codes:
+            return []
+
+        now = datetime.utcnow()
+        conditions = [cls.status == RoomStatus.WAITING, cls.expires_at <= now]
+        if room_codes is not None:
+            conditions.append(cls.room_code.in_(room_codes))
+
+        async with session_scope(session) as session:
+            result = await session.scalars(
+                update(cls)
+                .where(*conditions)
+                .values(status=RoomStatus.EXPIRED, closed_at=now)
+                .returning(cls)
+                .execution_options(synchronize_session=False, populate_existing=True)
             )
+            rooms = list(result)
+            await cls._refund_creators(session, rooms)
 
-            rooms = []
-            for row in result.fetchall():
-                room = cls()
-                for key, value in row._mapping.items():
-                    setattr(room, key, value)
-                rooms.append(room)
-            return rooms
+        if rooms:
+            logger.info(f"✅ Expired {len(rooms)} rooms")
+        return rooms
 
     @classmethod
-    async def cleanup_expired_rooms(cls) -> int:
+    async def cleanup_expired_rooms(cls, session: Optional[AsyncSession] = None) -> int:
         """Очистить истекшие комнаты"""
-        async with async_session() as session:
-            try:
-                result = await session.execute(
-                    text("""
-                        UPDATE rooms 
-                        SET status = 'expired', closed_at = NOW() 
-                        WHERE status = 'waiting' AND expires_at < NOW()
-                    """)
-                )
-                await session.commit()
-                count = result.rowcount
-                logger.info(f"✅ Cleaned up {count} expired rooms")
-                return count
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error cleaning up expired rooms: {e}")
-                return 0
+        try:
+            count = len(await cls.expire_rooms(session=session))
+            logger.info(f"✅ Cleaned up {count} expired rooms")
+            return count
+        except Exception as e:
+            logger.error(f"❌ Error cleaning up expired rooms: {e}")
+            return 0
+
+    @staticmethod
+    async def _refund_creators(session: AsyncSession, rooms: List["Room"]):
+        """Вернуть ставки создателям комнат в транзакции вызывающего кода"""
+        from database.models.user import User
+        from database.models.ledger import LedgerEntry, HOUSE_ACCOUNT, user_account
+
+        if not rooms:
+            return
+
+        # У одного создателя может быть несколько комнат - суммируем
+        refunds: Dict[int, Decimal] = {}
+        for room in rooms:
+            refunds[room.creator_id] = refunds.get(room.creator_id, Decimal(0)) + room.stake
+
+        await session.execute(
+            update(User)
+            .where(User.telegram_id.in_(list(refunds)))
+            .values(balance=User.balance + case(refunds, value=User.telegram_id, else_=Decimal(0)))
+            .execution_options(synchronize_session=False)
+        )
+        now = datetime.utcnow()
+        await session.execute(insert(LedgerEntry), [
+            {
+                "source_account": HOUSE_ACCOUNT,
+                "destination_account": user_account(room.creator_id),
+                "amount": room.stake,
+                "reason": "refund",
+                "reference": f"room:{room.room_code}",
+                "created_at": now
+            }
+            for room in rooms
+        ])
+        for telegram_id in refunds:
+            User.invalidate_cache(telegram_id, session)
 
     @classmethod
     async def _generate_room_code(cls) -> str:
-        """Генерировать уникальный код комнаты"""
-        import random
-        import string
-
-        while True:
-            # Генерируем 6-символьный код
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-            # Проверяем уникальность
-            async with async_session() as session:
-                result = await session.execute(
-                    text("SELECT COUNT(*) FROM rooms WHERE room_code = :code"),
-                    {"code": code}
+        """Уникальный код комнаты без проверочных запросов: номер из последовательности через перестановку"""
+        return room_codes.room_code(await room_code_allocator.allocate(), ROOM_CODE_SECRET.encode())
+
+    async def join_room(self, player_id: int, session: Optional[AsyncSession] = None) -> Optional["Duel"]:
+        """Занять комнату и начать дуэль одной транзакцией.
+
+        Комнату забирает условный UPDATE rooms ... WHERE status = 'WAITING' AND expires_at > now
+        RETURNING: из одновременных игроков его строку получает только один, остальные - пустой
+        результат. В той же транзакции списывается ставка игрока (ставку создателя списали при
+        создании комнаты) и создается активная дуэль со ставками DUEL_STAKE.
+        Статус self не проверяется - он мог устареть. Возвращает дуэль или None.
+        """
+        from database.models.user import User
+        from database.models.duel import Duel
+
+        now = datetime.utcnow()
+        try:
+            async with session_scope(session) as session:
+                room = await session.scalar(
+                    update(Room)
+                    .where(
+                        Room.room_code == self.room_code,
+                        Room.status == RoomStatus.WAITING,
+                        Room.expires_at > now,
+                        Room.creator_id != player_id
+                    )
+                    .values(status=RoomStatus.FULL, closed_at=now)
+                    .returning(Room)
+                    .execution_options(synchronize_session=False, populate_existing=True)
                 )
-                count = result.scalar()
-                if count == 0:
-                    return code
-
-    async def join_room(self, player_id: int) -> Optional["Duel"]:
-        """Присоединиться к комнате"""
-        if self.status != RoomStatus.WAITING:
-            logger.warning(f"⚠️ Cannot join room {self.room_code}: status is {self.status}")
-            return None
-
-        if self.creator_id == player_id:
-            logger.warning(f"⚠️ Creator cannot join their own room {self.room_code}")
+                if room is None:
+                    logger.warning(f"⚠️ Cannot join room {self.room_code}: not waiting, expired or own room")
+                    return None
+
+                if await User.debit_balance(player_id, room.stake, reason="duel_stake",
+                                            reference=f"room:{room.room_code}", session=session) is None:
+                    # Откатываем захват комнаты вместе со всей транзакцией
+                    raise RuntimeError(f"insufficient balance of player {player_id}")
+
+                duel = (await Duel.create_matched_duels(
+                    [(room.creator_id, player_id, room.stake)], session=session
+                ))[0]
+                room.duel_id = duel.id
+
+            logger.info(f"✅ Player {player_id} joined room {self.room_code}")
+            return duel
+        except Exception as e:
+            logger.error(f"❌ Error joining room {self.room_code}: {e}")
             return None
 
-        if datetime.utcnow() > self.expires_at:
-            logger.warning(f"⚠️ Room {self.room_code} has expired")
-            await self.expire_room()
-            return None
-
-        async with async_session() as session:
-            try:
-                # Создаем дуэль
-                from database.models.duel import Duel
-                duel = await Duel.create_duel(self.creator_id, self.stake)
-                await duel.add_player2(player_id)
-
-                # Обновляем комнату
-                self.status = RoomStatus.FULL
-                self.duel_id = duel.id
-                self.closed_at = datetime.utcnow()
-
-                session.add(self)
-                await session.commit()
-
-                logger.info(f"✅ Player {player_id} joined room {self.room_code}")
-                return duel
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error joining room {self.room_code}: {e}")
-                return None
-
-    async def close_room(self) -> bool:
-        """Закрыть комнату"""
-        async with async_session() as session:
-            try:
-                self.status = RoomStatus.CLOSED
-                self.closed_at = datetime.utcnow()
-
-                session.add(self)
-                await session.commit()
-                logger.info(f"✅ Closed room {self.room_code}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error closing room {self.room_code}: {e}")
-                return False
-
-    async def expire_room(self) -> bool:
-        """Пометить комнату как истекшую"""
-        async with async_session() as session:
-            try:
-                self.status = RoomStatus.EXPIRED
-                self.closed_at = datetime.utcnow()
-
-                session.add(self)
-                await session.commit()
-                logger.info(f"✅ Expired room {self.room_code}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error expiring room {self.room_code}: {e}")
-                return False
+    async def close_room(self, session: Optional[AsyncSession] = None) -> bool:
+        """Закрыть ожидающую комнату и вернуть ставку создателю"""
+        try:
+            async with session_scope(session) as session:
+                room = await session.scalar(
+                    update(Room)
+                    .where(Room.id == self.id, Room.status == RoomStatus.WAITING)
+                    .values(status=RoomStatus.CLOSED, closed_at=datetime.utcnow())
+                    .returning(Room)
+                    .execution_options(synchronize_session=False, populate_existing=True)
+                )
+                if room is None:
+                    logger.warning(f"⚠️ Cannot close room {self.room_code}: not waiting")
+                    return False
+                await self._refund_creators(session, [room])
+
+            logger.info(f"✅ Closed room {self.room_code}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error closing room {self.room_code}: {e}")
+            return False
+
+    async def expire_room(self, session: Optional[AsyncSession] = None) -> bool:
+        """Пометить комнату как истекшую и вернуть ставку создателю"""
+        try:
+            return bool(await Room.expire_rooms([self.room_code], session=session))
+        except Exception as e:
+            logger.error(f"❌ Error expiring room {self.room_code}: {e}")
+            return False
 
     def is_expired(self) -> bool:
         """Проверить, истекла ли комната"""
@@ -240,4 +297,46 @@ class Room(Base):
         return f"https://t.me/{bot_username}?start=room_{self.room_code}"
 
     def __repr__(self):
-        return f"<Room(code={self.room_code}, stake={self.stake}, status={self.status})>"
\ No newline at end of file
+        return f"<Room(code={self.room_code}, stake={self.stake}, status={self.status})>"
+
+
+class RoomCodeAllocator:
+    """Номера кодов блоками (hi/lo): один nextval на block_size комнат, внутри блока - счетчик процесса.
+
+    Блоки разных процессов не пересекаются, номер внутри блока выдается один раз,
+    поэтому коды не повторяются и не требуют проверки в БД.
+    """
+
+    def __init__(self, block_size: int = ROOM_CODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self.next_number = 0
+        self.block_end = 0
+        self.lock = asyncio.Lock()
+        self.blocks = 0  # Сколько блоков взято из БД
+
+    async def allocate(self) -> int:
+        """Следующий номер кода"""
+        async with self.lock:
+            if self.next_number >= self.block_end:
+                if not self.blocks and not ROOM_CODE_SECRET:
+                    logger.warning("⚠️ ROOM_CODE_SECRET is not set, room codes are predictable")
+                self.next_number = await self._next_block() * self.block_size
+                self.block_end = self.next_number + self.block_size
+                self.blocks += 1
+            number = self.next_number
+            self.next_number += 1
+            return number
+
+    @staticmethod
+    async def _next_block() -> int:
+        """Номер нового блока"""
+        async with read_scope() as session:
+            if session.bind.dialect.name == "postgresql":
+                return await session.scalar(select(room_code_sequence.next_value()))
+            # SQLite (один процесс): каждая созданная комната увеличивает MAX(id),
+            # поэтому блок после самой новой комнаты еще не выдавался
+            return await session.scalar(select(func.coalesce(func.max(Room.id), 0) + 1))
+
+
+# Глобальный распределитель номеров кодов
+room_code_allocator = RoomCodeAllocator()
\ No newline at end of file
@@ -3,17 +3,23 @@
 """
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List, Dict, Any, Union
 from enum import Enum as PyEnum
 
-from sqlalchemy import Integer, String, DECIMAL, DateTime, ForeignKey, Enum, text
+from sqlalchemy import Integer, String, DECIMAL, DateTime, ForeignKey, Enum, Index, text, insert, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.connection import Base, async_session
+from database.connection import Base, session_scope, read_scope
+from database.replica import replica_router
+from utils.pagination import Cursor, Page, seek, make_page
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# С какого размера пачки create_many на PostgreSQL пишет через COPY
+COPY_THRESHOLD = 1000
+
 
 class TransactionType(PyEnum):
     """Типы транзакций"""
@@ -34,6 +40,12 @@ class TransactionStatus(PyEnum):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_tx_hash", "tx_hash"),
+        Index("ix_transactions_user_created_id", "user_id", "created_at", "id"),  # История с курсором
+        Index("ix_transactions_pending", "created_at",
+              postgresql_where=text("status = 'PENDING'"), sqlite_where=text("status = 'PENDING'")),
+    )
 
     # Основные поля
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -49,8 +61,8 @@ class Transaction(Base):
     from_address: Mapped[Optional[str]] = mapped_column(String(44), nullable=True)
     to_address: Mapped[Optional[str]] = mapped_column(String(44), nullable=True)
 
-    # Связанная дуэль (если есть)
-    duel_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("duels.id"), nullable=True)
+    # Связанная дуэль (если есть); без внешнего ключа - duels партиционирована, см. миграцию 0003
+    duel_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # Метаданные
     description: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
@@ -62,7 +74,8 @@ class Transaction(Base):
 
     # Связи
     user: Mapped["User"] = relationship("User", back_populates="transactions")
-    duel: Mapped[Optional["Duel"]] = relationship("Duel", back_populates="transactions")
+    duel: Mapped[Optional["Duel"]] = relationship("Duel", primaryjoin="foreign(Transaction.duel_id) == Duel.id",
+                                                  back_populates="transactions")
 
     @classmethod
     async def create_transaction(
@@ -74,119 +87,165 @@ class Transaction(Base):
             tx_hash: Optional[str] = None,
             from_address: Optional[str] = None,
             to_address: Optional[str] = None,
-            description: Optional[str] = None
+            description: Optional[str] = None,
+            session: Optional[AsyncSession] = None
     ) -> "Transaction":
-        """Создать новую транзакцию"""
-        async with async_session() as session:
-            try:
-                transaction = cls(
-                    user_id=user_id,
-                    type=transaction_type,
-                    amount=amount,
-                    duel_id=duel_id,
-                    tx_hash=tx_hash,
-                    from_address=from_address,
-                    to_address=to_address,
-                    description=description
+        """Создать новую транзакцию (id и значения по умолчанию - через RETURNING)"""
+        try:
+            async with session_scope(session) as session:
+                transaction = await session.scalar(
+                    insert(cls)
+                    .values(
+                        user_id=user_id,
+                        type=transaction_type,
+                        amount=amount,
+                        duel_id=duel_id,
+                        tx_hash=tx_hash,
+                        from_address=from_address,
+                        to_address=to_address,
+                        description=description
+                    )
+                    .returning(cls)
                 )
-                session.add(transaction)
-                await session.commit()
-                await session.refresh(transaction)
-                logger.info(f"✅ Created transaction: {transaction.id}, type: {transaction_type}")
-                return transaction
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error creating transaction: {e}")
-                raise
+            logger.info(f"✅ Created transaction: {transaction.id}, type: {transaction_type}")
+            return transaction
+        except Exception as e:
+            logger.error(f"❌ Error creating transaction: {e}")
+            raise
 
     @classmethod
-    async def get_by_id(cls, transaction_id: int) -> Optional["Transaction"]:
-        """Получить транзакцию по ID"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM transactions WHERE id = :transaction_id"),
-                {"transaction_id": transaction_id}
+    async def create_many(
+            cls,
+            rows: List[Dict[str, Any]],
+            session: Optional[AsyncSession] = None,
+            returning: bool = True
+    ) -> Union[List["Transaction"], int]:
+        """Создать пачку транзакций одним запросом.
+
+        rows - словари с полями транзакции (user_id, type, amount обязательны).
+        С returning=True возвращает созданные транзакции (multi-row INSERT ... RETURNING),
+        иначе - количество строк; большие пачки на asyncpg при этом пишутся через COPY.
+        Если передана session, запись идет в ее транзакции и коммит остается вызывающему коду.
+        """
+        if not rows:
+            return [] if returning else 0
+
+        # Одинаковый набор колонок во всех строках - одна пачка без разбиения по ключам
+        now = datetime.utcnow()
+        records = [
+            {
+                "user_id": row["user_id"],
+                "type": row["type"],
+                "amount": row["amount"],
+                "status": row.get("status", TransactionStatus.PENDING),
+                "tx_hash": row.get("tx_hash"),
+                "from_address": row.get("from_address"),
+                "to_address": row.get("to_address"),
+                "duel_id": row.get("duel_id"),
+                "description": row.get("description"),
+                "error_message": row.get("error_message"),
+                "created_at": row.get("created_at", now),
+                "completed_at": row.get("completed_at")
+            }
+            for row in rows
+        ]
+
+        try:
+            async with session_scope(session) as session:
+                result = await cls._insert_many(session, records, returning)
+            logger.info(f"✅ Created {len(records)} transactions")
+            return result
+        except Exception as e:
+            logger.error(f"❌ Error creating transactions: {e}")
+            raise
+
+    @classmethod
+    async def _insert_many(cls, session: AsyncSession, records: List[Dict[str, Any]],
+                           returning: bool) -> Union[List["Transaction"], int]:
+        """Вставить подготовленные строки в транзакции сессии"""
+        if returning:
+            result = await session.scalars(
+                insert(cls).returning(cls, sort_by_parameter_order=True),
+                records
+            )
+            return list(result)
+
+        connection = await session.connection()
+        if len(records) >= COPY_THRESHOLD and connection.dialect.driver == "asyncpg":
+            raw_connection = await connection.get_raw_connection()
+            columns = list(records[0])
+            # Enum-колонки хранят имена членов перечисления
+            await raw_connection.driver_connection.copy_records_to_table(
+                cls.__tablename__,
+                columns=columns,
+                records=[
+                    tuple(value.name if isinstance(value, PyEnum) else value for value in record.values())
+                    for record in records
+                ]
             )
-            row = result.fetchone()
-            if row:
-                transaction = cls()
-                for key, value in row._mapping.items():
-                    setattr(transaction, key, value)
-                return transaction
-            return None
+            return len(records)
+
+        await session.execute(insert(cls), records)
+        return len(records)
+
+    @classmethod
+    async def get_by_id(cls, transaction_id: int, session: Optional[AsyncSession] = None) -> Optional["Transaction"]:
+        """Получить транзакцию по ID"""
+        return await cls.fetch_one(select(cls).where(cls.id == transaction_id), session=session)
 
     @classmethod
     async def get_user_transactions(cls, user_id: int, limit: int = 50) -> list["Transaction"]:
-        """Получить транзакции пользователя"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("""
-                    SELECT * FROM transactions 
-                    WHERE user_id = :user_id 
-                    ORDER BY created_at DESC 
-                    LIMIT :limit
-                """),
-                {"user_id": user_id, "limit": limit}
-            )
+        """Получить последние транзакции пользователя"""
+        return (await cls.get_user_transactions_page(user_id, limit)).items
 
-            transactions = []
-            for row in result.fetchall():
-                transaction = cls()
-                for key, value in row._mapping.items():
-                    setattr(transaction, key, value)
-                transactions.append(transaction)
-            return transactions
+    @classmethod
+    async def get_user_transactions_page(cls, user_id: int, limit: int = 10, cursor: Optional[Cursor] = None,
+                                         newer: bool = False, session: Optional[AsyncSession] = None) -> Page:
+        """Страница истории транзакций пользователя (диапазон по индексу user_id, created_at, id).
+
+        Без переданной сессии читает с реплики (если она настроена и не отстает).
+        """
+        async with (read_scope(session) if session else replica_router.session()) as session:
+            result = await session.scalars(
+                seek(select(cls).where(cls.user_id == user_id), cls.created_at, cls.id, cursor, newer, limit)
+            )
+            return make_page(list(result), limit, cursor, newer, key=lambda tx: (tx.created_at, tx.id))
 
     @classmethod
     async def get_pending_transactions(cls) -> list["Transaction"]:
         """Получить все ожидающие транзакции"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM transactions WHERE status = 'pending' ORDER BY created_at")
-            )
-
-            transactions = []
-            for row in result.fetchall():
-                transaction = cls()
-                for key, value in row._mapping.items():
-                    setattr(transaction, key, value)
-                transactions.append(transaction)
-            return transactions
+        return await cls.fetch_all(
+            select(cls).where(cls.status == TransactionStatus.PENDING).order_by(cls.created_at)
+        )
 
-    async def complete_transaction(self, tx_hash: str = None) -> bool:
+    async def complete_transaction(self, tx_hash: str = None, session: Optional[AsyncSession] = None) -> bool:
         """Завершить транзакцию"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 self.status = TransactionStatus.COMPLETED
                 self.completed_at = datetime.utcnow()
                 if tx_hash:
                     self.tx_hash = tx_hash
-
                 session.add(self)
-                await session.commit()
-                logger.info(f"✅ Completed transaction {self.id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error completing transaction {self.id}: {e}")
-                return False
-
-    async def fail_transaction(self, error_message: str) -> bool:
+            logger.info(f"✅ Completed transaction {self.id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error completing transaction {self.id}: {e}")
+            return False
+
+    async def fail_transaction(self, error_message: str, session: Optional[AsyncSession] = None) -> bool:
         """Пометить транзакцию как неудачную"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 self.status = TransactionStatus.FAILED
                 self.error_message = error_message
                 self.completed_at = datetime.utcnow()
-
                 session.add(self)
-                await session.commit()
-                logger.info(f"❌ Failed transaction {self.id}: {error_message}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error failing transaction {self.id}: {e}")
-                return False
+            logger.info(f"❌ Failed transaction {self.id}: {error_message}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error failing transaction {self.id}: {e}")
+            return False
 
     def get_display_type(self) -> str:
         """Получить отображаемый тип транзакции"""
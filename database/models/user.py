@@ -5,18 +5,34 @@ from datetime import datetime
 from decimal import Decimal
 from typing import Optional, List
 
-from sqlalchemy import BigInteger, String, DECIMAL, Integer, DateTime, Boolean, text
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import (
+    BigInteger, String, DECIMAL, Integer, DateTime, Boolean, Index, text, insert, update, select, event, inspect
+)
+from sqlalchemy.orm import Mapped, mapped_column, relationship, Session, make_transient_to_detached
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.connection import Base, async_session
+from database.connection import Base, session_scope, current_session
+from database.models.ledger import LedgerEntry, HOUSE_ACCOUNT, user_account
+from config.settings import USER_CACHE_SIZE, USER_CACHE_TTL
 from utils.logger import setup_logger
+from utils.ttl_cache import TTLCache
 
 logger = setup_logger(__name__)
 
+# Профили пользователей процесса: {telegram_id: значения колонок}. Сбрасываются при записи через модель
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Ключи session.info: кэш апдейта и пользователи, которых сбросить из кэша после коммита
+MEMO_KEY = "user_memo"
+INVALIDATE_KEY = "invalidate_users"
+
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_wallet_address", "wallet_address"),
+        Index("ix_users_username_lower", text("lower(username)")),  # Поиск по username без учета регистра
+    )
 
     # Основные поля
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -37,127 +53,218 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     # Связи
-    duels_as_player1: Mapped[List["Duel"]] = relationship("Duel", foreign_keys="Duel.player1_id",
+    duels_as_player1: Mapped[List["Duel"]] = relationship("Duel", primaryjoin="User.id == foreign(Duel.player1_id)",
                                                           back_populates="player1")
-    duels_as_player2: Mapped[List["Duel"]] = relationship("Duel", foreign_keys="Duel.player2_id",
+    duels_as_player2: Mapped[List["Duel"]] = relationship("Duel", primaryjoin="User.id == foreign(Duel.player2_id)",
                                                           back_populates="player2")
     transactions: Mapped[List["Transaction"]] = relationship("Transaction", back_populates="user")
     rooms_created: Mapped[List["Room"]] = relationship("Room", back_populates="creator")
 
     @classmethod
-    async def get_by_telegram_id(cls, telegram_id: int) -> Optional["User"]:
-        """Получить пользователя по Telegram ID"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM users WHERE telegram_id = :telegram_id"),
-                {"telegram_id": telegram_id}
-            )
-            row = result.fetchone()
-            if row:
-                user = cls()
-                for key, value in row._mapping.items():
-                    setattr(user, key, value)
+    async def get_by_telegram_id(cls, telegram_id: int, session: Optional[AsyncSession] = None,
+                                 fresh: bool = False) -> Optional["User"]:
+        """Получить пользователя по Telegram ID.
+
+        Сначала кэш апдейта (session.info), затем кэш процесса, затем БД.
+        fresh=True - всегда из БД: для проверок баланса перед списанием.
+        """
+        session = session or current_session()
+        memo = session.info.setdefault(MEMO_KEY, {}) if session is not None else {}
+
+        if not fresh:
+            if telegram_id in memo:
+                user_cache.count("memo_hits")
+                return memo[telegram_id]
+
+            values = user_cache.get(telegram_id)
+            if values is not None:
+                user = cls(**values)
+                make_transient_to_detached(user)  # Как загруженный из БД: session.add обновит, а не вставит
+                if session is not None:
+                    user = await session.merge(user, load=False)
+                memo[telegram_id] = user
                 return user
-            return None
+
+        # populate_existing - обновить объект, если он уже есть в identity map сессии
+        user = await cls.fetch_one(
+            select(cls).where(cls.telegram_id == telegram_id).execution_options(populate_existing=True),
+            session=session
+        )
+        if user is not None:
+            # Незакоммиченные изменения этой сессии в кэш процесса не кладем - их видят другие задачи
+            if session is None or telegram_id not in session.info.get(INVALIDATE_KEY, ()):
+                user_cache.set(telegram_id, {attr.key: getattr(user, attr.key) for attr in inspect(cls).column_attrs})
+            memo[telegram_id] = user
+        return user
+
+    @classmethod
+    def invalidate_cache(cls, telegram_id: int, session: Optional[AsyncSession] = None):
+        """Сбросить пользователя из кэша процесса сейчас и еще раз после коммита транзакции сессии.
+
+        Повторный сброс нужен, чтобы чтение до коммита не вернуло в кэш старые значения.
+        """
+        user_cache.invalidate(telegram_id)
+        session = session or current_session()
+        if session is not None:
+            session.info.setdefault(INVALIDATE_KEY, set()).add(telegram_id)
 
     @classmethod
-    async def create_user(cls, telegram_id: int, wallet_address: str, username: str = None) -> "User":
-        """Создать нового пользователя"""
-        async with async_session() as session:
-            try:
-                user = cls(
-                    telegram_id=telegram_id,
-                    username=username,
-                    wallet_address=wallet_address
+    async def create_user(cls, telegram_id: int, wallet_address: str, username: str = None,
+                          session: Optional[AsyncSession] = None) -> "User":
+        """Создать нового пользователя (id и значения по умолчанию - через RETURNING)"""
+        try:
+            async with session_scope(session) as session:
+                user = await session.scalar(
+                    insert(cls)
+                    .values(
+                        telegram_id=telegram_id,
+                        username=username,
+                        wallet_address=wallet_address
+                    )
+                    .returning(cls)
                 )
-                session.add(user)
-                await session.commit()
-                await session.refresh(user)
-                logger.info(f"✅ Created new user: {telegram_id}")
-                return user
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error creating user {telegram_id}: {e}")
-                raise
+            logger.info(f"✅ Created new user: {telegram_id}")
+            return user
+        except Exception as e:
+            logger.error(f"❌ Error creating user {telegram_id}: {e}")
+            raise
 
-    async def update_wallet(self, new_wallet_address: str) -> bool:
+    async def update_wallet(self, new_wallet_address: str, session: Optional[AsyncSession] = None) -> bool:
         """Обновить адрес кошелька"""
-        async with async_session() as session:
-            try:
+        try:
+            async with session_scope(session) as session:
                 # Записываем в историю смены кошельков
                 from database.models.wallet_history import WalletHistory
-                history = WalletHistory(
-                    user_id=self.id,
-                    old_address=self.wallet_address,
-                    new_address=new_wallet_address
+                await WalletHistory.create_history_record(
+                    self.id, self.wallet_address, new_wallet_address, session=session
                 )
-                session.add(history)
 
                 # Обновляем кошелек
                 self.wallet_address = new_wallet_address
                 self.wallet_updated_at = datetime.utcnow()
+                session.add(self)
+                User.invalidate_cache(self.telegram_id, session)
+            logger.info(f"✅ Updated wallet for user {self.telegram_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error updating wallet for user {self.telegram_id}: {e}")
+            return False
 
+    async def update_username(self, username: Optional[str], session: Optional[AsyncSession] = None) -> bool:
+        """Обновить username (пользователь сменил имя в Telegram)"""
+        try:
+            async with session_scope(session) as session:
+                self.username = username
                 session.add(self)
-                await session.commit()
-                logger.info(f"✅ Updated wallet for user {self.telegram_id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error updating wallet for user {self.telegram_id}: {e}")
-                return False
-
-    async def add_balance(self, amount: Decimal) -> bool:
+                User.invalidate_cache(self.telegram_id, session)
+            logger.info(f"✅ Updated username for user {self.telegram_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error updating username for user {self.telegram_id}: {e}")
+            return False
+
+    @classmethod
+    async def credit_balance(cls, telegram_id: int, amount: Decimal, source: str = HOUSE_ACCOUNT,
+                             reason: str = "credit", reference: Optional[str] = None,
+                             session: Optional[AsyncSession] = None) -> Optional[Decimal]:
+        """Атомарно зачислить на баланс со счета source. Возвращает новый баланс или None"""
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.telegram_id == telegram_id)
+                    .values(balance=cls.balance + amount)
+                    .returning(cls.balance)
+                )
+                new_balance = result.scalar()
+                if new_balance is None:
+                    logger.warning(f"⚠️ User {telegram_id} not found for balance credit")
+                    return None
+
+                # Проводка - в той же транзакции, что и изменение баланса
+                await LedgerEntry.record(session, source, user_account(telegram_id), amount, reason, reference)
+                cls.invalidate_cache(telegram_id, session)
+
+            logger.info(f"✅ Added {amount} to balance of user {telegram_id}")
+            return new_balance
+        except Exception as e:
+            logger.error(f"❌ Error adding balance to user {telegram_id}: {e}")
+            return None
+
+    @classmethod
+    async def debit_balance(cls, telegram_id: int, amount: Decimal, destination: str = HOUSE_ACCOUNT,
+                            reason: str = "debit", reference: Optional[str] = None,
+                            session: Optional[AsyncSession] = None) -> Optional[Decimal]:
+        """Атомарно списать с баланса на счет destination, если хватает средств.
+
+        Возвращает новый баланс или None.
+        """
+        try:
+            async with session_scope(session) as session:
+                # Проверка и списание одним условным UPDATE - без гонок между запросами
+                result = await session.execute(
+                    update(cls)
+                    .where(cls.telegram_id == telegram_id, cls.balance >= amount)
+                    .values(balance=cls.balance - amount)
+                    .returning(cls.balance)
+                )
+                new_balance = result.scalar()
+                if new_balance is None:
+                    logger.warning(f"⚠️ Insufficient balance for user {telegram_id}: < {amount}")
+                    return None
+
+                await LedgerEntry.record(session, user_account(telegram_id), destination, amount, reason, reference)
+                cls.invalidate_cache(telegram_id, session)
+
+            logger.info(f"✅ Subtracted {amount} from balance of user {telegram_id}")
+            return new_balance
+        except Exception as e:
+            logger.error(f"❌ Error subtracting balance from user {telegram_id}: {e}")
+            return None
+
+    async def add_balance(self, amount: Decimal, source: str = HOUSE_ACCOUNT, reason: str = "credit",
+                          reference: Optional[str] = None) -> bool:
         """Добавить к балансу"""
-        async with async_session() as session:
-            try:
-                self.balance += amount
-                session.add(self)
-                await session.commit()
-                logger.info(f"✅ Added {amount} to balance of user {self.telegram_id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error adding balance to user {self.telegram_id}: {e}")
-                return False
-
-    async def subtract_balance(self, amount: Decimal) -> bool:
+        new_balance = await User.credit_balance(self.telegram_id, amount, source, reason, reference)
+        if new_balance is None:
+            return False
+        self.balance = new_balance
+        return True
+
+    async def subtract_balance(self, amount: Decimal, destination: str = HOUSE_ACCOUNT, reason: str = "debit",
+                               reference: Optional[str] = None) -> bool:
         """Снять с баланса"""
-        if self.balance < amount:
-            logger.warning(f"⚠️ Insufficient balance for user {self.telegram_id}: {self.balance} < {amount}")
+        new_balance = await User.debit_balance(self.telegram_id, amount, destination, reason, reference)
+        if new_balance is None:
             return False
+        self.balance = new_balance
+        return True
 
-        async with async_session() as session:
-            try:
-                self.balance -= amount
-                session.add(self)
-                await session.commit()
-                logger.info(f"✅ Subtracted {amount} from balance of user {self.telegram_id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error subtracting balance from user {self.telegram_id}: {e}")
-                return False
-
-    async def update_game_stats(self, won: bool, wagered: Decimal, won_amount: Decimal = None) -> bool:
+    async def update_game_stats(self, won: bool, wagered: Decimal, won_amount: Decimal = None,
+                                session: Optional[AsyncSession] = None) -> bool:
         """Обновить игровую статистику"""
-        async with async_session() as session:
-            try:
-                self.total_games += 1
-                self.total_wagered += wagered
-
-                if won:
-                    self.wins += 1
-                    if won_amount:
-                        self.total_won += won_amount
-
-                session.add(self)
-                await session.commit()
-                logger.info(f"✅ Updated game stats for user {self.telegram_id}")
-                return True
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error updating game stats for user {self.telegram_id}: {e}")
-                return False
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                    update(User)
+                    .where(User.telegram_id == self.telegram_id)
+                    .values(
+                        total_games=User.total_games + 1,
+                        total_wagered=User.total_wagered + wagered,
+                        wins=User.wins + (1 if won else 0),
+                        total_won=User.total_won + (won_amount if won and won_amount else 0)
+                    )
+                    .returning(User.total_games, User.wins, User.total_wagered, User.total_won)
+                )
+                row = result.fetchone()
+                User.invalidate_cache(self.telegram_id, session)
+            if row:
+                self.total_games, self.wins, self.total_wagered, self.total_won = row
+            logger.info(f"✅ Updated game stats for user {self.telegram_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error updating game stats for user {self.telegram_id}: {e}")
+            return False
 
     def get_win_rate(self) -> float:
         """Получить процент побед"""
@@ -174,4 +281,23 @@ class User(Base):
         return self.balance
 
     def __repr__(self):
-        return f"<User(id={self.id}, telegram_id={self.telegram_id}, balance={self.balance})>"
\ No newline at end of file
+        return f"<User(id={self.id}, telegram_id={self.telegram_id}, balance={self.balance})>"
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    """Сбросить из кэша пользователей, измененных в закоммиченной транзакции"""
+    if session.in_nested_transaction():
+        return  # Освобожден SAVEPOINT хелпера - транзакция апдейта еще не закоммичена
+    for telegram_id in session.info.pop(INVALIDATE_KEY, ()):
+        user_cache.invalidate(telegram_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _invalidate_after_rollback(session: Session):
+    """Сбросить пользователей, измененных в откаченной транзакции: в кэше могли остаться их значения"""
+    for telegram_id in session.info.get(INVALIDATE_KEY, ()):
+        user_cache.invalidate(telegram_id)
+    session.info.pop(MEMO_KEY, None)  # Объекты кэша апдейта тоже видели откаченные значения
+    if not session.in_nested_transaction():
+        session.info.pop(INVALIDATE_KEY, None)
\ No newline at end of file
@@ -4,10 +4,12 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Integer, String, DateTime, ForeignKey, text
+from sqlalchemy import Integer, String, DateTime, ForeignKey, insert, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.connection import Base, async_session
+from database.connection import Base, session_scope
+from database.replica import replica_router
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -32,47 +34,35 @@ class WalletHistory(Base):
     user: Mapped["User"] = relationship("User")
 
     @classmethod
-    async def create_history_record(cls, user_id: int, old_address: Optional[str], new_address: str) -> "WalletHistory":
-        """Создать запись в истории"""
-        async with async_session() as session:
-            try:
-                history = cls(
-                    user_id=user_id,
-                    old_address=old_address,
-                    new_address=new_address
+    async def create_history_record(cls, user_id: int, old_address: Optional[str], new_address: str,
+                                    session: Optional[AsyncSession] = None) -> "WalletHistory":
+        """Создать запись в истории (id и время - через RETURNING)"""
+        try:
+            async with session_scope(session) as session:
+                history = await session.scalar(
+                    insert(cls)
+                    .values(
+                        user_id=user_id,
+                        old_address=old_address,
+                        new_address=new_address
+                    )
+                    .returning(cls)
                 )
-                session.add(history)
-                await session.commit()
-                await session.refresh(history)
-                logger.info(f"✅ Created wallet history record for user {user_id}")
-                return history
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"❌ Error creating wallet history: {e}")
-                raise
+            logger.info(f"✅ Created wallet history record for user {user_id}")
+            return history
+        except Exception as e:
+            logger.error(f"❌ Error creating wallet history: {e}")
+            raise
 
     @classmethod
     async def get_user_history(cls, user_id: int, limit: int = 10) -> list["WalletHistory"]:
-        """Получить историю смены кошельков пользователя"""
-        async with async_session() as session:
-            result = await session.execute(
-                text("""
-                    SELECT * FROM wallet_history 
-                    WHERE user_id = :user_id 
-                    ORDER BY changed_at DESC 
-                    LIMIT :limit
-                """),
-                {"user_id": user_id, "limit": limit}
+        """Получить историю смены кошельков пользователя (с реплики, если она настроена и не отстает)"""
+        async with replica_router.session() as session:
+            return await cls.fetch_all(
+                select(cls).where(cls.user_id == user_id).order_by(cls.changed_at.desc()).limit(limit),
+                session=session
             )
 
-            history_records = []
-            for row in result.fetchall():
-                record = cls()
-                for key, value in row._mapping.items():
-                    setattr(record, key, value)
-                history_records.append(record)
-            return history_records
-
     def get_display_change(self) -> str:
         """Получить отображаемое описание изменения"""
         if self.old_address:
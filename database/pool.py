@@ -0,0 +1,61 @@
+"""
+Пул соединений с метриками ожидания для админки
+"""
+import time
+from typing import Dict, Any
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+
+class PoolMetrics:
+    """Счетчики выдачи соединений (общие для пула и его пересозданий после dispose)"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, waited: float):
+        """Учесть выдачу соединения"""
+        self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """Очередь соединений, которая замеряет время ожидания свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+
+def get_pool_stats(pool: Pool) -> Dict[str, Any]:
+    """Состояние пула и метрики ожидания для админки"""
+    stats = {
+        "pool_class": type(pool).__name__,
+        "checkouts": pool_metrics.checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "avg_wait_ms": pool_metrics.total_wait / pool_metrics.checkouts * 1000 if pool_metrics.checkouts else 0.0,
+        "max_wait_ms": pool_metrics.max_wait * 1000
+    }
+    # Размеры есть только у очереди соединений (у SQLite в памяти пул статический)
+    if hasattr(pool, "checkedout"):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0)
+        })
+    return stats
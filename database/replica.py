@@ -0,0 +1,127 @@
+"""
+Маршрутизация аналитических запросов и истории на реплику PostgreSQL
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator, Dict, Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from database.connection import engine_options, read_scope
+from config.settings import DATABASE_REPLICA_URL, REPLICA_MAX_LAG, REPLICA_LAG_CHECK_INTERVAL
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Отставание реплики в секундах. Если все полученное WAL уже применено, реплика актуальна
+# (иначе простаивающая основная БД выглядела бы как растущее отставание)
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class ReplicaRouter:
+    """Отдает сессию на реплике для чтений, допускающих небольшое отставание.
+
+    Отставание проверяется не чаще раза в check_interval секунд. Если реплика недоступна
+    или отстает больше max_lag, чтение идет с основной БД.
+    """
+
+    def __init__(self, url: Optional[str] = DATABASE_REPLICA_URL, max_lag: float = REPLICA_MAX_LAG,
+                 check_interval: float = REPLICA_LAG_CHECK_INTERVAL):
+        self.engine = None
+        self.sessionmaker = None
+        if url:
+            options = engine_options(url)
+            if "poolclass" in options:
+                options["poolclass"] = AsyncAdaptedQueuePool  # Метрики MeteredPool - только для основной БД
+            self.engine = create_async_engine(url, future=True, **options)
+            self.sessionmaker = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self.checked_at = 0.0  # time.monotonic() последней проверки
+        self.check_lock = asyncio.Lock()
+
+        self.replica_reads = 0
+        self.fallback_reads = 0  # Чтения с основной БД из-за отставания или недоступности реплики
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    async def is_usable(self) -> bool:
+        """Можно ли сейчас читать с реплики"""
+        if not self.enabled:
+            return False
+        if time.monotonic() - self.checked_at < self.check_interval:
+            return self.healthy
+
+        async with self.check_lock:
+            # Пока ждали блокировку, проверку мог сделать другой запрос
+            if time.monotonic() - self.checked_at < self.check_interval:
+                return self.healthy
+            await self._check_lag()
+        return self.healthy
+
+    async def _check_lag(self):
+        """Измерить отставание реплики"""
+        was_healthy = self.healthy
+        try:
+            async with self.engine.connect() as connection:
+                lag = await connection.scalar(text(LAG_QUERY))
+            self.lag = float(lag) if lag is not None else None
+            self.healthy = self.lag is not None and self.lag <= self.max_lag
+        except Exception as e:
+            logger.error(f"❌ Replica lag check failed: {e}")
+            self.lag = None
+            self.healthy = False
+        self.checked_at = time.monotonic()
+
+        if was_healthy and not self.healthy:
+            logger.warning(f"⚠️ Replica lag {self.lag}s > {self.max_lag}s, reading from primary")
+        elif self.healthy and not was_healthy:
+            logger.info(f"✅ Replica is in sync (lag {self.lag:.1f}s), routing reads to replica")
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """Сессия только для чтения: реплика или основная БД, если реплика отстает"""
+        if await self.is_usable():
+            self.replica_reads += 1
+            async with self.sessionmaker() as session:
+                yield session
+            return
+
+        if self.enabled:
+            self.fallback_reads += 1
+        async with read_scope() as session:
+            yield session
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние реплики для админки"""
+        return {
+            "enabled": self.enabled,
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "replica_reads": self.replica_reads,
+            "fallback_reads": self.fallback_reads
+        }
+
+    async def close(self):
+        """Закрыть соединения с репликой"""
+        if self.engine is not None:
+            await self.engine.dispose()
+
+
+# Глобальный маршрутизатор чтений
+replica_router = ReplicaRouter()
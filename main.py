@@ -23,6 +23,26 @@ async def main():
         from services.deposit_monitor import start_deposit_monitoring
         await start_deposit_monitoring()
 
+        # Запускаем воркеров выплат выигрышей
+        from services.payout_service import start_payout_workers
+        await start_payout_workers()
+
+        # Запускаем снимки балансов журнала
+        from services.ledger_service import start_ledger_snapshots
+        await start_ledger_snapshots()
+
+        # Запускаем обслуживание партиций (новые месяцы, итоги, архивация)
+        from services.partition_service import start_partition_maintenance
+        await start_partition_maintenance()
+
+        # Запускаем тик матчмейкинга (если задан MATCH_TICK_INTERVAL)
+        from services.game_service import game_service
+        await game_service.start_matchmaking_ticks()
+
+        # Загружаем открытые комнаты и запускаем таймер их истечения
+        from services.room_registry import start_room_registry
+        await start_room_registry()
+
         # Запускаем все компоненты параллельно
         await asyncio.gather(
             main_bot_polling(),
@@ -34,6 +54,14 @@ async def main():
         # Останавливаем мониторинг
         from services.deposit_monitor import stop_deposit_monitoring
         await stop_deposit_monitoring()
+        from services.payout_service import stop_payout_workers
+        await stop_payout_workers()
+        from services.ledger_service import stop_ledger_snapshots
+        await stop_ledger_snapshots()
+        from services.partition_service import stop_partition_maintenance
+        await stop_partition_maintenance()
+        from services.room_registry import stop_room_registry
+        await stop_room_registry()
     except Exception as e:
         logger.error(f"❌ Ошибка запуска: {e}")
 
@@ -0,0 +1,59 @@
+"""
+Окружение миграций Alembic (асинхронный движок из database.connection)
+"""
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+
+from config.settings import DATABASE_URL
+from database.connection import Base, engine
+
+# Импортируем все модели, чтобы их таблицы попали в метаданные
+from database.models.user import User
+from database.models.duel import Duel
+from database.models.transaction import Transaction
+from database.models.room import Room
+from database.models.wallet_history import WalletHistory
+from database.models.match_queue import MatchQueueEntry
+from database.models.payout_outbox import PayoutOutbox
+from database.models.ledger import LedgerEntry, BalanceSnapshot
+from database.models.partition_rollup import PartitionRollup
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Сгенерировать SQL миграций без подключения к базе (alembic upgrade --sql)"""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    """Применить миграции на открытом соединении"""
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    """Применить миграции через асинхронный движок бота"""
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,39 @@
+"""Индексы для частых запросов
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+Базовая схема создается init_db(); миграция добавляет индексы в уже работающую базу.
+На PostgreSQL индексы строятся CONCURRENTLY, без блокировки записи в таблицы.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# (имя индекса, таблица, колонки или выражения)
+INDEXES = [
+    ("ix_transactions_tx_hash", "transactions", ["tx_hash"]),
+    ("ix_transactions_user_created", "transactions", ["user_id", "created_at"]),  # Заменен в 0002
+    ("ix_duels_status_house", "duels", ["status", "is_house_duel"]),
+    ("ix_rooms_status_expires", "rooms", ["status", "expires_at"]),
+    ("ix_users_wallet_address", "users", ["wallet_address"]),
+    ("ix_users_username_lower", "users", [sa.text("lower(username)")]),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""Индексы для постраничной истории транзакций и дуэлей
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Страница истории читается диапазоном по (игрок, время, id), поэтому id входит в индекс.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+FINISHED = sa.text("status = 'FINISHED'")
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index("ix_transactions_user_created_id", "transactions", ["user_id", "created_at", "id"],
+                        if_not_exists=True, postgresql_concurrently=True)
+        # Новый индекс покрывает префикс старого
+        op.drop_index("ix_transactions_user_created", table_name="transactions",
+                      if_exists=True, postgresql_concurrently=True)
+
+        for player_column in ("player1_id", "player2_id"):
+            op.create_index(f"ix_duels_{player_column[:-3]}_finished", "duels", [player_column, "finished_at", "id"],
+                            if_not_exists=True, postgresql_concurrently=True,
+                            postgresql_where=FINISHED, sqlite_where=FINISHED)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for player_column in ("player1_id", "player2_id"):
+            op.drop_index(f"ix_duels_{player_column[:-3]}_finished", table_name="duels",
+                          if_exists=True, postgresql_concurrently=True)
+
+        op.create_index("ix_transactions_user_created", "transactions", ["user_id", "created_at"],
+                        if_not_exists=True, postgresql_concurrently=True)
+        op.drop_index("ix_transactions_user_created_id", table_name="transactions",
+                      if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,144 @@
+"""Помесячные партиции transactions и duels, таблица итогов месяцев
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+Таблицы пересоздаются как PARTITION BY RANGE (created_at) и заполняются копией данных -
+на большой базе миграцию нужно запускать в окно обслуживания.
+
+Первичный ключ партиционированной таблицы обязан включать created_at, поэтому внешние ключи
+на transactions.id и duels.id (payout_outbox, rooms, transactions.duel_id) удаляются.
+Из исходящих ключей восстанавливается transactions.user_id -> users.id.
+На SQLite партиций нет: создается только таблица итогов.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# Сколько будущих месяцев создать сразу (дальше их создает PartitionService)
+MONTHS_AHEAD = 2
+
+INDEXES = {
+    "transactions": [
+        "CREATE INDEX ix_transactions_tx_hash ON transactions (tx_hash)",
+        "CREATE INDEX ix_transactions_user_created_id ON transactions (user_id, created_at, id)",
+        "CREATE INDEX ix_transactions_pending ON transactions (created_at) WHERE status = 'PENDING'",
+    ],
+    "duels": [
+        "CREATE INDEX ix_duels_status_house ON duels (status, is_house_duel)",
+        "CREATE INDEX ix_duels_player1_finished ON duels (player1_id, finished_at, id) WHERE status = 'FINISHED'",
+        "CREATE INDEX ix_duels_player2_finished ON duels (player2_id, finished_at, id) WHERE status = 'FINISHED'",
+    ],
+}
+
+
+def partition_table(table):
+    """Пересоздать таблицу как партиционированную по месяцам и перенести данные"""
+    legacy = f"{table}_unpartitioned"
+
+    # Последовательность id переживает удаление старой таблицы
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    op.execute(f"UPDATE {table} SET created_at = NOW() WHERE created_at IS NULL")
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(f"ALTER INDEX {table}_pkey RENAME TO {legacy}_pkey")
+
+    op.execute(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL")
+    op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+
+    # Партиции с месяца самой старой строки до MONTHS_AHEAD месяцев вперед + партиция по умолчанию
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month date;
+            last_month date := (date_trunc('month', NOW()) + interval '{MONTHS_AHEAD} months')::date;
+        BEGIN
+            SELECT date_trunc('month', COALESCE(MIN(created_at), NOW()))::date INTO month FROM {legacy};
+            WHILE month <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                    '{table}_p' || to_char(month, 'YYYY_MM'), month, (month + interval '1 month')::date
+                );
+                month := (month + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    op.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+    # CASCADE удаляет только внешние ключи, ссылающиеся на старую таблицу
+    op.execute(f"DROP TABLE {legacy} CASCADE")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+
+    for statement in INDEXES[table]:
+        op.execute(statement)
+
+
+def unpartition_table(table):
+    """Вернуть обычную таблицу с первичным ключом id"""
+    partitioned = f"{table}_partitioned"
+
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    op.execute(f"ALTER TABLE {table} RENAME TO {partitioned}")
+    op.execute(f"ALTER INDEX {table}_pkey RENAME TO {partitioned}_pkey")
+    op.execute(f"CREATE TABLE {table} (LIKE {partitioned} INCLUDING DEFAULTS)")
+    op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+    op.execute(f"INSERT INTO {table} SELECT * FROM {partitioned}")
+    op.execute(f"DROP TABLE {partitioned} CASCADE")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+
+    for statement in INDEXES[table]:
+        op.execute(statement)
+
+
+def create_rollups_table():
+    op.create_table(
+        "partition_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("table_name", sa.String(64), nullable=False),
+        sa.Column("month", sa.DateTime(), nullable=False),
+        sa.Column("metrics", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint("table_name", "month", name="uq_partition_rollups_table_month"),
+        if_not_exists=True
+    )
+
+
+def upgrade():
+    create_rollups_table()
+
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    partition_table("duels")
+    partition_table("transactions")
+    op.execute(
+        "ALTER TABLE transactions ADD CONSTRAINT transactions_user_id_fkey "
+        "FOREIGN KEY (user_id) REFERENCES users (id)"
+    )
+
+
+def downgrade():
+    if op.get_context().dialect.name == "postgresql":
+        unpartition_table("transactions")
+        unpartition_table("duels")
+        op.execute(
+            "ALTER TABLE transactions ADD CONSTRAINT transactions_user_id_fkey "
+            "FOREIGN KEY (user_id) REFERENCES users (id)"
+        )
+        op.execute(
+            "ALTER TABLE transactions ADD CONSTRAINT transactions_duel_id_fkey "
+            "FOREIGN KEY (duel_id) REFERENCES duels (id)"
+        )
+        op.execute("ALTER TABLE rooms ADD CONSTRAINT rooms_duel_id_fkey FOREIGN KEY (duel_id) REFERENCES duels (id)")
+        op.execute(
+            "ALTER TABLE payout_outbox ADD CONSTRAINT payout_outbox_transaction_id_fkey "
+            "FOREIGN KEY (transaction_id) REFERENCES transactions (id)"
+        )
+
+    op.drop_table("partition_rollups")
@@ -0,0 +1,27 @@
+"""Последовательность номеров для кодов комнат
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Коды комнат выдаются блоками по номеру из room_code_seq и переставляются ключом ROOM_CODE_SECRET.
+Старые случайные коды в это пространство тоже попадают: совпадение нового кода со старым
+маловероятно (число старых комнат / 36^6), и такая вставка просто отклоняется уникальным индексом.
+На SQLite последовательностей нет: номер блока берется от MAX(rooms.id).
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_context().dialect.name == "postgresql":
+        op.execute("CREATE SEQUENCE IF NOT EXISTS room_code_seq")
+
+
+def downgrade():
+    if op.get_context().dialect.name == "postgresql":
+        op.execute("DROP SEQUENCE IF EXISTS room_code_seq")
@@ -0,0 +1,26 @@
+"""Подпись транзакции выплаты в payout_outbox
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+Подпись и last_valid_block_height записываются до отправки. Выплата, ответ на отправку которой
+потерян, переходит в статус reconcile и решается только по статусу подписи в сети.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("payout_outbox", sa.Column("signature", sa.String(88), nullable=True))
+    op.add_column("payout_outbox", sa.Column("valid_until_height", sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("payout_outbox", "valid_until_height")
+    op.drop_column("payout_outbox", "signature")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Сравнение способов собрать объекты моделей из строк запроса.
+
+- setattr: text("SELECT * ...") и цикл setattr по колонкам (как было в get_*)
+- fetch_all(sql): та же SQL-строка через Base.fetch_all (ORM select().from_statement())
+- fetch_all(select): ORM select() через Base.fetch_all
+
+Тестовые строки пишутся в транзакции, которая в конце откатывается.
+
+    python scripts/benchmark_hydration.py --rows 5000 --repeat 20
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+LEGACY_SQL = "SELECT * FROM transactions WHERE user_id = :user_id"
+
+
+async def run_benchmark(rows: int, repeat: int):
+    """Замерить три способа на одной сессии и одних данных"""
+    from sqlalchemy import insert, select, text
+    from database.connection import async_session, init_db
+    from database.models.user import User
+    from database.models.transaction import Transaction, TransactionType, TransactionStatus
+
+    await init_db()
+
+    async with async_session() as session:
+        user_id = await session.scalar(
+            insert(User).values(telegram_id=-1, wallet_address="benchmark", balance=Decimal(0)).returning(User.id)
+        )
+        now = datetime.utcnow()
+        await Transaction.create_many([
+            {
+                "user_id": user_id,
+                "type": TransactionType.DEPOSIT,
+                "amount": Decimal(i),
+                "status": TransactionStatus.COMPLETED,
+                "created_at": now - timedelta(seconds=i)
+            }
+            for i in range(rows)
+        ], session=session, returning=False)
+        print(f"🌱 Тестовых транзакций: {rows}, повторов: {repeat}")
+
+        async def legacy():
+            result = await session.execute(text(LEGACY_SQL), {"user_id": user_id})
+            transactions = []
+            for row in result.fetchall():
+                transaction = Transaction()
+                for key, value in row._mapping.items():
+                    setattr(transaction, key, value)
+                transactions.append(transaction)
+            return transactions
+
+        async def fetch_text():
+            return await Transaction.fetch_all(LEGACY_SQL, {"user_id": user_id}, session=session)
+
+        async def fetch_select():
+            return await Transaction.fetch_all(
+                select(Transaction).where(Transaction.user_id == user_id), session=session
+            )
+
+        results = {}
+        for name, method in (("setattr", legacy), ("fetch_all(sql)", fetch_text), ("fetch_all(select)", fetch_select)):
+            await method()  # Прогрев: компиляция запроса и кэши
+            session.expunge_all()
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                items = await method()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+                session.expunge_all()  # Каждый прогон собирает объекты заново
+            results[name] = (best, items)
+
+        await session.rollback()
+
+    baseline = results["setattr"][0]
+    print("=" * 60)
+    for name, (best, items) in results.items():
+        sample = items[0] if items else None
+        typed = isinstance(getattr(sample, "type", None), TransactionType)
+        print(
+            f"📊 {name:<18} {best * 1000:8.1f} мс  {baseline / best:5.2f}x  "
+            f"{'✅' if typed else '⚠️'} type: {type(getattr(sample, 'type', None)).__name__}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение способов сборки объектов моделей")
+    parser.add_argument("--rows", type=int, default=5000, help="Сколько строк читать за прогон")
+    parser.add_argument("--repeat", type=int, default=20, help="Сколько прогонов (берется лучший)")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Проверка планов SQL-запросов: EXPLAIN для каждого text("...") в моделях, хендлерах и сервисах
+и для горячих ORM-запросов (select()/update()) из реестра hot_queries().
+
+Запросы строятся без значений параметров (EXPLAIN GENERIC_PLAN, PostgreSQL 16+);
+ORM-запросы компилируются диалектом PostgreSQL с параметрами $n.
+С --seed таблицы временно наполняются тестовыми строками; все изменения откатываются.
+Код возврата 1, если запрос читает большую таблицу последовательным сканированием.
+
+    python scripts/check_query_plans.py --seed 100000
+"""
+import argparse
+import ast
+import asyncio
+import json
+import re
+import sys
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import List, Tuple, Dict, Set, Any
+
+from sqlalchemy.dialects import postgresql
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Где искать SQL
+SOURCE_DIRS = ["database", "bots", "services", "utils"]
+
+# Запросы, которым полное чтение таблицы разрешено: сводная статистика админки
+ALLOWED_SEQ_SCANS = {
+    "bots/handlers/admin.py:get_admin_stats",
+    "bots/handlers/admin.py:get_detailed_stats",
+    "bots/handlers/admin.py:get_top_users",
+    "services/deposit_monitor.py:get_monitoring_stats",
+}
+
+# :name -> $1 (но не приведение типа ::type)
+PARAM_RE = re.compile(r"(?<!:):([A-Za-z_]\w*)")
+
+# ORM-запросы компилируются сразу с позиционными параметрами $n
+PG_DIALECT = postgresql.dialect(paramstyle="numeric_dollar")
+
+
+def collect_queries() -> List[Tuple[str, str]]:
+    """Найти все text() с постоянной строкой: [(файл:функция, sql)]"""
+    queries = []
+    for directory in SOURCE_DIRS:
+        for path in sorted((ROOT / directory).rglob("*.py")):
+            tree = ast.parse(path.read_text(encoding="utf-8"))
+            for function in ast.walk(tree):
+                if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    continue
+                for node in ast.walk(function):
+                    if (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "text"
+                            and node.args and isinstance(node.args[0], ast.Constant)
+                            and isinstance(node.args[0].value, str)):
+                        location = f"{path.relative_to(ROOT).as_posix()}:{function.name}"
+                        queries.append((location, node.args[0].value))
+
+    # Вложенные функции дают повторы
+    queries = list(dict.fromkeys(queries))
+
+    for location, statement in hot_queries().items():
+        queries.append((location, compile_statement(statement)))
+    return queries
+
+
+def hot_queries() -> Dict[str, Any]:
+    """Горячие ORM-запросы моделей: файл:функция -> выражение в том виде, в каком его строит модель.
+
+    Значения параметров пробные: в план попадают только их типы.
+    """
+    from sqlalchemy import select, update, or_
+    from database.models.user import User
+    from database.models.duel import Duel, DuelStatus
+    from database.models.transaction import Transaction, TransactionStatus
+    from database.models.room import Room, RoomStatus
+    from database.models.payout_outbox import PayoutOutbox, PayoutStatus
+    from utils.pagination import seek
+
+    now = datetime.utcnow()
+    amount = Decimal(10)
+    cursor = (now, 1)
+
+    queries = {
+        "database/models/user.py:get_by_telegram_id": select(User).where(User.telegram_id == 1),
+        "database/models/user.py:credit_balance": (
+            update(User).where(User.telegram_id == 1)
+            .values(balance=User.balance + amount).returning(User.balance)
+        ),
+        "database/models/user.py:debit_balance": (
+            update(User).where(User.telegram_id == 1, User.balance >= amount)
+            .values(balance=User.balance - amount).returning(User.balance)
+        ),
+        "database/models/duel.py:get_by_id": select(Duel).where(Duel.id == 1),
+        "database/models/duel.py:find_matched_duel": (
+            select(Duel)
+            .where(or_(Duel.player1_id == 1, Duel.player2_id == 1),
+                   Duel.is_house_duel.is_(False), Duel.created_at >= now)
+            .order_by(Duel.id.desc()).limit(1)
+        ),
+        "database/models/duel.py:get_waiting_duels": (
+            select(Duel).where(Duel.status == DuelStatus.WAITING, Duel.stake == amount).order_by(Duel.created_at)
+        ),
+        "database/models/duel.py:settle_duel": (
+            update(Duel).where(Duel.id == 1, Duel.status == DuelStatus.ACTIVE)
+            .values(status=DuelStatus.FINISHED, finished_at=now).returning(Duel)
+        ),
+        "database/models/transaction.py:get_by_id": select(Transaction).where(Transaction.id == 1),
+        "database/models/transaction.py:get_user_transactions_page": seek(
+            select(Transaction).where(Transaction.user_id == 1),
+            Transaction.created_at, Transaction.id, cursor, False, 10
+        ),
+        "database/models/transaction.py:get_pending_transactions": (
+            select(Transaction).where(Transaction.status == TransactionStatus.PENDING)
+            .order_by(Transaction.created_at)
+        ),
+        "database/models/room.py:get_by_code": select(Room).where(Room.room_code == "ABC123"),
+        "database/models/room.py:get_active_rooms": (
+            select(Room).where(Room.status == RoomStatus.WAITING, Room.expires_at > now)
+            .order_by(Room.created_at.desc()).limit(20)
+        ),
+        "database/models/room.py:expire_rooms": (
+            update(Room).where(Room.status == RoomStatus.WAITING, Room.expires_at <= now)
+            .values(status=RoomStatus.EXPIRED, closed_at=now).returning(Room)
+        ),
+        "database/models/room.py:join_room": (
+            update(Room)
+            .where(Room.room_code == "ABC123", Room.status == RoomStatus.WAITING,
+                   Room.expires_at > now, Room.creator_id != 1)
+            .values(status=RoomStatus.FULL, closed_at=now).returning(Room)
+        ),
+        "database/models/payout_outbox.py:claim_batch": (
+            update(PayoutOutbox)
+            .where(PayoutOutbox.id.in_(
+                select(PayoutOutbox.id)
+                .where(PayoutOutbox.status == PayoutStatus.PENDING.value, PayoutOutbox.next_attempt_at <= now)
+                .order_by(PayoutOutbox.id).limit(20).with_for_update(skip_locked=True)
+                .scalar_subquery()
+            ))
+            .values(status=PayoutStatus.PROCESSING.value, locked_at=now, attempts=PayoutOutbox.attempts + 1)
+            .returning(PayoutOutbox.id)
+        ),
+        "database/models/payout_outbox.py:get_reconcile_batch": (
+            select(PayoutOutbox.id, PayoutOutbox.signature)
+            .where(PayoutOutbox.status == PayoutStatus.RECONCILE.value).order_by(PayoutOutbox.id).limit(20)
+        ),
+        "database/models/payout_outbox.py:recover_stale": (
+            update(PayoutOutbox)
+            .where(PayoutOutbox.status == PayoutStatus.PROCESSING.value, PayoutOutbox.locked_at < now)
+            .values(status=PayoutStatus.PENDING.value, locked_at=None)
+        ),
+    }
+
+    # Завершенные дуэли читаются двумя диапазонами: игрок первым и игрок вторым
+    for player_column in (Duel.player1_id, Duel.player2_id):
+        queries[f"database/models/duel.py:get_finished_duels_page({player_column.key})"] = seek(
+            select(Duel).where(player_column == 1, Duel.status == DuelStatus.FINISHED),
+            Duel.finished_at, Duel.id, cursor, False, 10
+        )
+    return queries
+
+
+def compile_statement(statement) -> str:
+    """SQL ORM-запроса для PostgreSQL с параметрами $n (списки IN раскрыты)"""
+    return str(statement.compile(dialect=PG_DIALECT, compile_kwargs={"render_postcompile": True}))
+
+
+def to_generic_sql(sql: str) -> str:
+    """Заменить именованные параметры на $n"""
+    numbers: Dict[str, int] = {}
+
+    def replace(match):
+        name = match.group(1)
+        numbers.setdefault(name, len(numbers) + 1)
+        return f"${numbers[name]}"
+
+    return PARAM_RE.sub(replace, sql)
+
+
+def find_seq_scans(plan: Dict) -> Set[str]:
+    """Таблицы, которые план читает последовательным сканированием"""
+    tables = set()
+    if plan.get("Node Type") == "Seq Scan":
+        tables.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables |= find_seq_scans(child)
+    return tables
+
+
+async def seed(connection, rows: int):
+    """Наполнить таблицы тестовыми данными в текущей транзакции"""
+    print(f"🌱 Заполнение тестовыми данными: {rows} пользователей...")
+    await connection.execute("""
+        INSERT INTO users (telegram_id, username, wallet_address, balance, total_games, wins,
+                           total_wagered, total_won, is_active, wallet_updated_at, created_at)
+        SELECT 9000000000 + g, 'seed_' || g, lpad(g::text, 44, 'S'), g % 1000, g % 50, g % 25,
+               g % 5000, g % 4000, true, NOW(), NOW() - make_interval(mins => g)
+        FROM generate_series(1, $1) AS g
+    """, rows)
+    await connection.execute("""
+        INSERT INTO duels (player1_id, player2_id, stake, status, is_house_duel, created_at)
+        SELECT u.id, u.id, 100,
+               (CASE WHEN g % 100 = 0 THEN 'WAITING' WHEN g % 100 = 1 THEN 'ACTIVE' ELSE 'FINISHED' END)::duelstatus,
+               g % 3 = 0, NOW() - make_interval(mins => g)
+        FROM users u CROSS JOIN generate_series(1, 3) AS g
+        WHERE u.telegram_id > 9000000000
+    """)
+    await connection.execute("""
+        INSERT INTO transactions (user_id, type, amount, status, tx_hash, description, created_at)
+        SELECT u.id,
+               (ARRAY['DEPOSIT', 'WITHDRAWAL', 'DUEL_STAKE', 'DUEL_WIN'])[1 + g % 4]::transactiontype,
+               10, (CASE WHEN g % 200 = 0 THEN 'PENDING' ELSE 'COMPLETED' END)::transactionstatus,
+               md5(u.id::text || '-' || g), 'seed', NOW() - make_interval(mins => u.id + g)
+        FROM users u CROSS JOIN generate_series(1, 5) AS g
+        WHERE u.telegram_id > 9000000000
+    """)
+    await connection.execute("""
+        INSERT INTO rooms (room_code, creator_id, stake, status, is_private, expires_at, created_at)
+        SELECT 'Z' || lpad(u.id::text, 9, '0'), u.id, 100,
+               (CASE WHEN u.id % 100 = 0 THEN 'WAITING' ELSE 'EXPIRED' END)::roomstatus,
+               false, NOW() + interval '5 minutes', NOW()
+        FROM users u
+        WHERE u.telegram_id > 9000000000
+    """)
+    await connection.execute("ANALYZE users, duels, transactions, rooms")
+
+
+async def check_plans(seed_rows: int, min_rows: int) -> bool:
+    """Проверить планы всех запросов. True - последовательных сканирований нет"""
+    from database.connection import engine
+
+    if engine.dialect.name != "postgresql":
+        print("❌ Проверка планов работает только с PostgreSQL (DATABASE_URL)")
+        return False
+
+    queries = collect_queries()
+    print(f"🔍 Найдено запросов: {len(queries)}")
+
+    async with engine.connect() as sa_connection:
+        connection = (await sa_connection.get_raw_connection()).driver_connection
+
+        if int(await connection.fetchval("SHOW server_version_num")) < 160000:
+            print("❌ Нужен PostgreSQL 16+ (EXPLAIN GENERIC_PLAN)")
+            return False
+
+        # Все изменения (тестовые строки и статистика ANALYZE) откатываются в конце
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            if seed_rows:
+                await seed(connection, seed_rows)
+
+            large_tables = {
+                row["relname"] for row in await connection.fetch(
+                    "SELECT relname FROM pg_class WHERE relkind IN ('r', 'p') AND reltuples >= $1",
+                    min_rows
+                )
+            }
+            print(f"📊 Большие таблицы (>= {min_rows} строк): {', '.join(sorted(large_tables)) or 'нет'}")
+
+            failures = 0
+            for location, sql in queries:
+                try:
+                    async with connection.transaction():  # SAVEPOINT: ошибка не ломает общую транзакцию
+                        # В скомпилированных ORM-запросах параметры уже $n, :name в них не встречается
+                        plan_json = await connection.fetchval(
+                            f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {to_generic_sql(sql)}"
+                        )
+                except Exception as e:
+                    failures += 1
+                    print(f"❌ {location}: ошибка EXPLAIN - {e}")
+                    continue
+
+                plan = json.loads(plan_json)[0]["Plan"]
+                scanned = find_seq_scans(plan) & large_tables
+                if not scanned:
+                    print(f"✅ {location}")
+                elif location in ALLOWED_SEQ_SCANS:
+                    print(f"⚠️ {location}: Seq Scan {', '.join(sorted(scanned))} (разрешено)")
+                else:
+                    failures += 1
+                    print(f"❌ {location}: Seq Scan {', '.join(sorted(scanned))}")
+                    print("   " + " ".join(sql.split())[:200])
+        finally:
+            await transaction.rollback()
+
+    print("=" * 60)
+    if failures:
+        print(f"❌ Проблемных запросов: {failures}")
+        return False
+    print("✅ Все запросы используют индексы")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов SQL-запросов")
+    parser.add_argument("--seed", type=int, default=0, help="сколько тестовых пользователей добавить (откатывается)")
+    parser.add_argument("--min-rows", type=int, default=10000, help="с какого размера таблица считается большой")
+    args = parser.parse_args()
+
+    ok = asyncio.run(check_plans(args.seed, args.min_rows))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,12 +12,15 @@ from solana.rpc.commitment import Confirmed
 
 from database.models.user import User
 from database.models.transaction import Transaction, TransactionType
+from database.models.ledger import HOT_WALLET_ACCOUNT
+from database.models.partition_rollup import PartitionRollup
 from database.connection import async_session
+from database.replica import replica_router
 from services.solana_service import solana_service
 from config.settings import BOT_WALLET_ADDRESS, MORI_TOKEN_MINT
 from utils.logger import setup_logger
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import text
+from sqlalchemy import text, select
 
 logger = setup_logger(__name__)
 
@@ -188,7 +191,7 @@ class DepositMonitor:
             )
 
             # Зачисляем средства на баланс
-            if await user.add_balance(amount):
+            if await user.add_balance(amount, HOT_WALLET_ACCOUNT, reason="deposit", reference=f"tx:{tx_hash}"):
                 await transaction.complete_transaction()
 
                 # Уведомляем пользователя
@@ -224,19 +227,7 @@ class DepositMonitor:
             owner_address = str(owner_pubkey)
 
             # Ищем пользователя по wallet_address
-            async with async_session() as session:
-                result = await session.execute(
-                    text("SELECT * FROM users WHERE wallet_address = :wallet_address"),
-                    {"wallet_address": owner_address}
-                )
-                row = result.fetchone()
-                if row:
-                    user = User()
-                    for key, value in row._mapping.items():
-                        setattr(user, key, value)
-                    return user
-
-            return None
+            return await User.fetch_one(select(User).where(User.wallet_address == owner_address))
 
         except Exception as e:
             logger.error(f"❌ Error finding user by token account {token_account}: {e}")
@@ -310,29 +301,27 @@ class DepositMonitor:
     async def get_monitoring_stats(self) -> Dict[str, Any]:
         """Получить статистику мониторинга"""
         try:
-            async with async_session() as session:
+            async with replica_router.session() as session:
                 # Статистика депозитов за последние 24ч
                 result = await session.execute(text("""
                     SELECT 
                         COUNT(*) as count_24h,
                         COALESCE(SUM(amount), 0) as sum_24h
                     FROM transactions 
-                    WHERE type = 'deposit'::transactiontype 
-                    AND status = 'completed'::transactionstatus
+                    WHERE type = 'DEPOSIT'
+                    AND status = 'COMPLETED'
                     AND created_at >= NOW() - INTERVAL '24 hours'
                 """))
                 stats_24h = result.fetchone()
 
-                # Общая статистика депозитов
-                result = await session.execute(text("""
-                    SELECT 
-                        COUNT(*) as total_count,
-                        COALESCE(SUM(amount), 0) as total_sum,
-                        COUNT(CASE WHEN status = 'pending'::transactionstatus THEN 1 END) as pending_count
-                    FROM transactions 
-                    WHERE type = 'deposit'::transactiontype
-                """))
-                total_stats = result.fetchone()
+                # Общая статистика депозитов: помесячные итоги плюс свежие партиции
+                totals = await PartitionRollup.get_totals("transactions", session=session)
+
+                # Ожидающие - по частичному индексу ix_transactions_pending
+                pending_count = (await session.execute(text("""
+                    SELECT COUNT(*) FROM transactions
+                    WHERE status = 'PENDING' AND type = 'DEPOSIT'
+                """))).scalar()
 
                 return {
                     "monitoring": self.monitoring,
@@ -344,9 +333,9 @@ class DepositMonitor:
                         "sum": float(stats_24h.sum_24h)
                     },
                     "deposits_total": {
-                        "count": total_stats.total_count,
-                        "sum": float(total_stats.total_sum),
-                        "pending": total_stats.pending_count
+                        "count": int(totals["deposits"]),
+                        "sum": float(totals["deposit_sum"]),
+                        "pending": pending_count
                     }
                 }
 
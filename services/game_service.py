@@ -4,79 +4,205 @@
 import asyncio
 import random
 from decimal import Decimal
-from typing import Optional, Dict, List
-from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Set
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models.user import User
 from database.models.duel import Duel, DuelStatus, CoinSide
 from database.models.transaction import Transaction, TransactionType
-from services.solana_service import solana_service
-from config.settings import HOUSE_ACCOUNTS, HOUSE_COMMISSION, MATCH_TIMEOUT
+from services.payout_service import payout_service
+from services.matchmaking_service import matchmaking_service, MatchTicket, ClaimedMatchLost, Refund
+from config.settings import (
+    HOUSE_ACCOUNTS, HOUSE_COMMISSION, MATCH_TIMEOUT, MAX_CONCURRENT_SEARCHES, MATCH_TICK_INTERVAL
+)
 from utils.logger import setup_logger
+from utils.user_locks import user_locks, UserLockTimeout
 
 logger = setup_logger(__name__)
 
 
+class SearchRefundFailed(Exception):
+    """Ставку отменяемого поиска вернуть не удалось - поиск не отменен"""
+
+
 class GameService:
     def __init__(self):
-        self.waiting_players = {}  # {stake: [(user_id, timestamp), ...]}
         self.active_duels = {}  # {duel_id: duel_data}
         self.house_accounts = HOUSE_ACCOUNTS or ["@crypto_king", "@moon_trader", "@diamond_hands"]
+        self.searches: Dict[int, asyncio.Task] = {}  # {user_id: задача поиска}
+        self.search_tickets: Dict[int, MatchTicket] = {}  # {user_id: заявка в очереди}
+        self.cancel_requests: Set[int] = set()  # Отмена пришла, пока заявки еще нет
+        self.tick_task: Optional[asyncio.Task] = None  # Фоновый тик матчмейкинга
+
+    def is_searching(self, user_id: int) -> bool:
+        """Идет ли у пользователя поиск игры"""
+        return user_id in self.searches
 
     async def quick_match(self, user_id: int, stake: Decimal) -> Optional[Dict]:
-        """Быстрый поиск игры"""
+        """Быстрый поиск игры (не больше одного поиска на пользователя)"""
+        if user_id in self.searches:
+            return {"error": "Поиск игры уже идет"}
+
+        if len(self.searches) >= MAX_CONCURRENT_SEARCHES:
+            logger.warning(f"⚠️ Search limit reached ({MAX_CONCURRENT_SEARCHES}), rejecting user {user_id}")
+            return {"error": "Слишком много игроков в поиске, попробуйте через минуту"}
+
+        task = asyncio.create_task(self._search(user_id, stake))
+        self.searches[user_id] = task
+        try:
+            return await task
+        finally:
+            self.searches.pop(user_id, None)
+            self.cancel_requests.discard(user_id)
+
+    async def cancel_search(self, user_id: int) -> Optional[bool]:
+        """Отменить поиск и вернуть ставку.
+
+        True - поиск отменен, False - соперник уже найден, None - поиска нет или он уже завершен.
+        """
+        task = self.searches.get(user_id)
+        if not task or task.done():
+            return None
+
+        ticket = self.search_tickets.get(user_id)
+        if ticket is None:
+            # Заявки еще нет: поиск сам вернет ставку вместо постановки в очередь
+            self.cancel_requests.add(user_id)
+            result = await asyncio.shield(task)
+            if "cancelled" in result:
+                if not result["cancelled"]:
+                    raise SearchRefundFailed(result["error"])
+                return True
+            return False if result.get("type") == "real_duel" else None
+
+        # Снять заявку может только один: либо отмена, либо соперник, либо таймаут.
+        # Снятие и возврат ставки - одной транзакцией: без возврата заявка остается в очереди
+        try:
+            withdrawn = await matchmaking_service.withdraw(ticket, refund=self._stake_refund(user_id, ticket.stake))
+        except Exception as e:
+            logger.error(f"❌ Error cancelling search for user {user_id}: {e}")
+            raise SearchRefundFailed("Не удалось отменить поиск") from e
+
+        if not withdrawn:
+            # Заявку забрал соперник (в том числе другой процесс) - или ее уже снял таймаут
+            return False if ticket.claimed else None
+
+        task.cancel()
+        logger.info(f"✅ Search cancelled for user {user_id}, refunded {ticket.stake}")
+        return True
+
+    @staticmethod
+    def _stake_refund(user_id: int, stake: Decimal, reason: str = "search_cancel") -> Refund:
+        """Возврат ставки поиска в транзакции снятия заявки"""
+        async def refund(session: Optional[AsyncSession]):
+            if await User.credit_balance(user_id, stake, reason=reason, session=session) is None:
+                raise SearchRefundFailed(f"Refund of {stake} to user {user_id} failed")
+        return refund
+
+    async def _search(self, user_id: int, stake: Decimal) -> Optional[Dict]:
+        """Поиск соперника или создание игры с ботом"""
         try:
             # Проверяем баланс пользователя
             user = await User.get_by_telegram_id(user_id)
-            if not user or user.balance < stake:
+            if not user:
                 return {"error": "Недостаточно средств"}
 
-            # Снимаем ставку с баланса
-            if not await user.subtract_balance(stake):
-                return {"error": "Ошибка списания средств"}
-
-            # Проверяем, есть ли ожидающие игроки с такой же ставкой
-            if stake in self.waiting_players and self.waiting_players[stake]:
-                # Находим оппонента
-                opponent_data = self.waiting_players[stake].pop(0)
-                opponent_id = opponent_data[0]
-
-                # Проверяем, что оппонент все еще активен (не тот же игрок)
-                if opponent_id != user_id:
-                    opponent = await User.get_by_telegram_id(opponent_id)
-                    if opponent and opponent.balance >= 0:  # Проверка что оппонент еще валиден
-                        # Создаем дуэль между реальными игроками
-                        duel = await self._create_real_duel(user_id, opponent_id, stake)
-                        if duel:
-                            return {
-                                "type": "real_duel",
-                                "duel_id": duel.id,
-                                "opponent": opponent.username or f"Player {opponent_id}",
-                                "stake": stake
-                            }
-
-            # Добавляем игрока в очередь ожидания
-            if stake not in self.waiting_players:
-                self.waiting_players[stake] = []
-
-            self.waiting_players[stake].append((user_id, datetime.utcnow()))
-
-            # Ждем MATCH_TIMEOUT секунд
-            await asyncio.sleep(MATCH_TIMEOUT)
-
-            # Проверяем, нашелся ли оппонент за это время
-            if stake in self.waiting_players:
-                # Удаляем игрока из очереди
-                self.waiting_players[stake] = [
-                    (uid, ts) for uid, ts in self.waiting_players[stake]
-                    if uid != user_id
-                ]
+            # Проверка и списание ставки - одним атомарным запросом
+            try:
+                async with user_locks.lock(user_id, "duel_stake"):
+                    if await User.debit_balance(user_id, stake, reason="duel_stake") is None:
+                        return {"error": "Недостаточно средств"}
+            except UserLockTimeout:
+                return {"error": "Предыдущая операция еще выполняется, попробуйте позже"}
+        except Exception as e:
+            logger.error(f"❌ Error in quick_match for user {user_id}: {e}")
+            return {"error": "Внутренняя ошибка"}
+
+        # Ставка списана: пока она не ушла в дуэль и не возвращена, при любой ошибке ее нужно вернуть
+        stake_held = True
+        ticket: Optional[MatchTicket] = None
+        try:
+            player_name = user.username or f"Player {user_id}"
+
+            # Проверяем, есть ли ожидающие игроки с подходящей ставкой.
+            # При включенном тике пары составляет он, сразу встаем в очередь
+            opponent = None
+            if self.tick_task is None:
+                opponent = await matchmaking_service.claim_opponent(user_id, stake)
+            if opponent:
+                # Играем по меньшей из двух ставок
+                duel_stake = min(stake, opponent.stake)
+
+                # Создаем дуэль между реальными игроками
+                duel = await self._create_real_duel(user_id, opponent.user_id, duel_stake)
+                if duel:
+                    stake_held = False  # Ставка в дуэли
+
+                    # Возвращаем разницу тому, чья ставка была больше
+                    await self._refund_excess(user_id, stake, duel_stake)
+                    await self._refund_excess(opponent.user_id, opponent.stake, duel_stake)
+
+                    # Сразу будим ожидающего соперника
+                    await matchmaking_service.notify_match(opponent, {
+                        "type": "real_duel",
+                        "duel_id": duel.id,
+                        "opponent": player_name,
+                        "stake": duel_stake
+                    })
+                    return {
+                        "type": "real_duel",
+                        "duel_id": duel.id,
+                        "opponent": opponent.display_name,
+                        "stake": duel_stake
+                    }
+
+                # Дуэль не создалась - соперник уйдет в игру с ботом
+                await matchmaking_service.notify_match(opponent, None)
+
+            if user_id in self.cancel_requests:
+                stake_held = False
+                return await self._refund_cancelled(user_id, stake)
+
+            # Встаем в очередь и ждем соперника не дольше MATCH_TIMEOUT
+            ticket = await matchmaking_service.enqueue(user_id, user.username, stake)
+            self.search_tickets[user_id] = ticket
+            try:
+                # Отмена пришла, пока заявка вставала в очередь
+                if user_id in self.cancel_requests:
+                    try:
+                        if await matchmaking_service.withdraw(ticket, refund=self._stake_refund(user_id, stake)):
+                            stake_held = False
+                            logger.info(f"✅ Search cancelled for user {user_id} while queueing, refunded {stake}")
+                            return {"cancelled": True}
+                    except Exception as e:
+                        # Заявка осталась в очереди - поиск продолжается как обычно
+                        logger.error(f"❌ Error cancelling search for user {user_id}: {e}")
+                match = await matchmaking_service.wait_for_opponent(ticket, MATCH_TIMEOUT)
+            except asyncio.CancelledError:
+                if not ticket.future.cancelled():
+                    raise  # Отмена не через cancel_search (остановка бота)
+                # Ставку вернул cancel_search
+                stake_held = False
+                return {"cancelled": True}
+            except ClaimedMatchLost:
+                # Соперник забрал заявку, но дуэль так и не появилась - игру с ботом не начинаем
+                stake_held = False
+                await User.credit_balance(user_id, stake, reason="refund")
+                return {"error": "Соперник не ответил, ставка возвращена"}
+            finally:
+                self.search_tickets.pop(user_id, None)
+
+            if match:
+                stake_held = False  # Дуэль создал соперник
+                return match
 
             # Создаем дуэль с ботом
             house_account = random.choice(self.house_accounts)
             duel = await self._create_house_duel(user_id, stake, house_account)
 
             if duel:
+                stake_held = False
                 return {
                     "type": "house_duel",
                     "duel_id": duel.id,
@@ -85,29 +211,112 @@ class GameService:
                 }
 
             # Если не удалось создать дуэль, возвращаем деньги
-            await user.add_balance(stake)
+            stake_held = False
+            await User.credit_balance(user_id, stake, reason="refund")
             return {"error": "Не удалось создать игру"}
 
         except Exception as e:
             logger.error(f"❌ Error in quick_match for user {user_id}: {e}")
+            if stake_held:
+                await self._refund_failed_search(user_id, stake, ticket)
             return {"error": "Внутренняя ошибка"}
 
+    async def _refund_failed_search(self, user_id: int, stake: Decimal, ticket: Optional[MatchTicket]):
+        """Вернуть ставку поиска, упавшего с ошибкой.
+
+        Заявку из очереди сначала снимаем вместе с возвратом: забранную соперником заявку
+        не возвращаем - ставка уже в его дуэли.
+        """
+        refund = self._stake_refund(user_id, stake, reason="refund")
+        try:
+            if ticket is not None:
+                if await matchmaking_service.withdraw(ticket, refund=refund):
+                    logger.info(f"✅ Refunded {stake} to user {user_id} after search error")
+                    return
+                if ticket.claimed:
+                    logger.error(f"❌ Search of user {user_id} failed after its ticket was claimed, stake not refunded")
+                    return
+                # Заявку уже снял таймаут - возвращаем без снятия
+
+            await refund(None)
+            logger.info(f"✅ Refunded {stake} to user {user_id} after search error")
+        except Exception as e:
+            logger.error(f"❌ Failed to refund {stake} to user {user_id} after search error: {e}")
+
+    async def _refund_cancelled(self, user_id: int, stake: Decimal) -> Dict:
+        """Вернуть ставку поиска, отмененного до постановки в очередь"""
+        if await User.credit_balance(user_id, stake, reason="search_cancel") is None:
+            logger.error(f"❌ Failed to refund cancelled search for user {user_id}, stake {stake}")
+            return {"cancelled": False, "error": "Не удалось вернуть ставку, обратитесь в поддержку"}
+        logger.info(f"✅ Search cancelled for user {user_id} before queueing, refunded {stake}")
+        return {"cancelled": True}
+
+    async def start_matchmaking_ticks(self, interval: float = MATCH_TICK_INTERVAL):
+        """Запустить фоновый тик матчмейкинга (0 - подбор сразу при поиске)"""
+        if interval <= 0 or self.tick_task is not None:
+            return
+
+        self.tick_task = asyncio.create_task(self._tick_loop(interval))
+        logger.info(f"🚀 Matchmaking tick started, interval: {interval}s")
+
+    async def stop_matchmaking_ticks(self):
+        """Остановить тик матчмейкинга"""
+        if self.tick_task is not None:
+            self.tick_task.cancel()
+            self.tick_task = None
+            logger.info("🛑 Matchmaking tick stopped")
+
+    async def _tick_loop(self, interval: float):
+        """Основной цикл тика"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.match_tick()
+            except Exception as e:
+                logger.error(f"❌ Error in matchmaking tick: {e}")
+
+    async def match_tick(self) -> int:
+        """Составить все возможные пары и создать дуэли одной транзакцией"""
+        pairs = await matchmaking_service.drain_pairs()
+        if not pairs:
+            return 0
+
+        specs = [(first.user_id, second.user_id, min(first.stake, second.stake)) for first, second in pairs]
+        try:
+            duels = await Duel.create_matched_duels(specs)
+        except Exception:
+            # Игроки уйдут в игры с ботом
+            await matchmaking_service.notify_matches([(ticket, None) for pair in pairs for ticket in pair])
+            return 0
+
+        matches = []
+        for (first, second), (_, _, duel_stake), duel in zip(pairs, specs, duels):
+            for ticket, opponent in ((first, second), (second, first)):
+                await self._refund_excess(ticket.user_id, ticket.stake, duel_stake)
+                matches.append((ticket, {
+                    "type": "real_duel",
+                    "duel_id": duel.id,
+                    "opponent": opponent.display_name,
+                    "stake": duel_stake
+                }))
+
+        await matchmaking_service.notify_matches(matches)
+        logger.info(f"✅ Matchmaking tick created {len(duels)} duels")
+        return len(duels)
+
+    async def _refund_excess(self, user_id: int, stake: Decimal, duel_stake: Decimal):
+        """Вернуть разницу, если дуэль идет по меньшей ставке соперника"""
+        if stake <= duel_stake:
+            return
+
+        await User.credit_balance(user_id, stake - duel_stake, reason="stake_difference")
+
     async def _create_real_duel(self, player1_id: int, player2_id: int, stake: Decimal) -> Optional[Duel]:
         """Создать дуэль между реальными игроками"""
         try:
-            # Создаем дуэль
-            duel = await Duel.create_duel(player1_id, stake, is_house=False)
-            await duel.add_player2(player2_id)
-
-            # Создаем транзакции для ставок
-            await Transaction.create_transaction(
-                player1_id, TransactionType.DUEL_STAKE, stake, duel.id,
-                description=f"Ставка в дуэли #{duel.id}"
-            )
-            await Transaction.create_transaction(
-                player2_id, TransactionType.DUEL_STAKE, stake, duel.id,
-                description=f"Ставка в дуэли #{duel.id}"
-            )
+            # Дуэль и обе ставки - одной транзакцией
+            duels = await Duel.create_matched_duels([(player1_id, player2_id, stake)])
+            duel = duels[0]
 
             logger.info(f"✅ Created real duel {duel.id}: {player1_id} vs {player2_id}, stake: {stake}")
             return duel
@@ -141,144 +350,56 @@ class GameService:
     async def flip_coin(self, duel_id: int, admin_decision: Optional[bool] = None) -> Optional[Dict]:
         """Бросок монеты"""
         try:
-            duel = await Duel.get_by_id(duel_id)
-            if not duel or duel.status != DuelStatus.ACTIVE:
-                return {"error": "Дуэль не найдена или неактивна"}
-
             # Определяем результат
-            if duel.is_house_duel and admin_decision is not None:
-                # Админ решает исход для дуэли с ботом
+            if admin_decision is not None:
+                # Админ решает исход только для дуэли с ботом
                 player_wins = admin_decision
             else:
-                # Случайный результат для дуэлей между игроками
+                # Случайный результат
                 player_wins = random.choice([True, False])
 
-            # Определяем результат монеты и победителя
-            coin_result = CoinSide.HEADS if player_wins else CoinSide.TAILS
-            winner_id = duel.player1_id if player_wins else duel.player2_id
-
-            # ИСПРАВЛЕННАЯ ЛОГИКА ВЫПЛАТ:
-            # Победитель получает свою ставку + 70% от ставки оппонента
-            if duel.is_house_duel:
-                # Дуэль с ботом: игрок vs бот
-                if player_wins:
-                    # Игрок выиграл: своя ставка + 70% от ставки бота (равной ставке игрока)
-                    winner_amount = duel.stake + (duel.stake * Decimal("0.7"))
-                    commission = duel.stake * Decimal("0.3")  # 30% от ставки бота
-                else:
-                    # Бот выиграл: игрок ничего не получает
-                    winner_amount = Decimal("0")
-                    commission = duel.stake * Decimal("0.3")  # 30% от ставки игрока
-            else:
-                # Дуэль между игроками: обе ставки равны
-                winner_amount = duel.stake + (duel.stake * Decimal("0.7"))  # своя + 70% от чужой
-                commission = duel.stake * Decimal("0.3")  # 30% от ставки проигравшего
-
-            # Завершаем дуэль
-            await duel.finish_duel(winner_id, coin_result, winner_amount, commission)
-
-            # Обновляем статистику игроков
-            player1 = await User.get_by_telegram_id(duel.player1_id)
-            if player1:
-                await player1.update_game_stats(
-                    won=(winner_id == duel.player1_id),
-                    wagered=duel.stake,
-                    won_amount=winner_amount if winner_id == duel.player1_id else Decimal(0)
-                )
+            # Завершаем дуэль, статистику и запись о выигрыше одной транзакцией.
+            # Повторный бросок той же дуэли сюда не пройдет
+            settled = await Duel.settle_duel(duel_id, player_wins, house_only=admin_decision is not None)
+            if not settled:
+                return {"error": "Дуэль не найдена или неактивна"}
 
-            if not duel.is_house_duel and duel.player2_id:
-                player2 = await User.get_by_telegram_id(duel.player2_id)
-                if player2:
-                    await player2.update_game_stats(
-                        won=(winner_id == duel.player2_id),
-                        wagered=duel.stake,
-                        won_amount=winner_amount if winner_id == duel.player2_id else Decimal(0)
-                    )
-
-            # Отправляем выигрыш победителю
-            if winner_id > 0 and winner_amount > 0:  # Не бот и есть выигрыш
-                await self._send_winnings(winner_id, winner_amount, duel_id)
+            duel, win_transaction = settled
+
+            # Выплату отправят воркеры, результат показываем сразу
+            if win_transaction:
+                payout_service.notify()
 
             result = {
-                "coin_result": coin_result.value,
-                "winner_id": winner_id,
-                "winner_amount": winner_amount,
-                "commission": commission,
+                "coin_result": duel.coin_result.value,
+                "winner_id": duel.winner_id,
+                "winner_amount": duel.winner_amount,
+                "commission": duel.house_commission,
                 "player1_id": duel.player1_id,
                 "player2_id": duel.player2_id,
                 "is_house_duel": duel.is_house_duel,
                 "house_account": duel.house_account_name
             }
 
-            logger.info(f"✅ Coin flipped for duel {duel_id}: {coin_result.value}, winner: {winner_id}, amount: {winner_amount}")
+            logger.info(f"✅ Coin flipped for duel {duel_id}: {duel.coin_result.value}, "
+                        f"winner: {duel.winner_id}, amount: {duel.winner_amount}")
             return result
 
         except Exception as e:
             logger.error(f"❌ Error flipping coin for duel {duel_id}: {e}")
             return {"error": "Ошибка при броске монеты"}
 
-    async def _send_winnings(self, user_id: int, amount: Decimal, duel_id: int) -> bool:
-        """Отправить выигрыш игроку"""
-        try:
-            user = await User.get_by_telegram_id(user_id)
-            if not user:
-                logger.error(f"❌ User {user_id} not found for winnings")
-                return False
-
-            # Создаем транзакцию выигрыша
-            transaction = await Transaction.create_transaction(
-                user.id, TransactionType.DUEL_WIN, amount, duel_id,
-                to_address=user.wallet_address,
-                description=f"Выигрыш в дуэли #{duel_id}"
-            )
-
-            # Отправляем токены на кошелек
-            tx_hash = await solana_service.send_token(
-                user.wallet_address,
-                amount,
-                solana_service.mori_mint
-            )
-
-            if tx_hash:
-                # Обновляем транзакцию
-                await transaction.complete_transaction(tx_hash)
-                logger.info(f"✅ Sent winnings {amount} MORI to user {user_id}")
-                return True
-            else:
-                # Если не удалось отправить, добавляем на баланс
-                await user.add_balance(amount)
-                await transaction.fail_transaction("Ошибка отправки, добавлено на баланс")
-                logger.warning(f"⚠️ Failed to send winnings, added to balance for user {user_id}")
-                return False
-
-        except Exception as e:
-            logger.error(f"❌ Error sending winnings to user {user_id}: {e}")
-            return False
-
     async def get_active_house_duels(self) -> List[Dict]:
         """Получить активные дуэли с ботами для админки"""
         try:
             # Получаем активные house дуэли из БД
-            from database.connection import async_session
-            from sqlalchemy import text
-
-            async with async_session() as session:
-                result = await session.execute(
-                    text("""
-                        SELECT * FROM duels 
-                        WHERE status = 'active' AND is_house_duel = true 
-                        ORDER BY created_at DESC
-                    """)
-                )
-
-                duels = []
-                for row in result.fetchall():
-                    duel = Duel()
-                    for key, value in row._mapping.items():
-                        setattr(duel, key, value)
-                    duels.append(duel)
-
-                return duels
+            from sqlalchemy import select
+
+            return await Duel.fetch_all(
+                select(Duel)
+                .where(Duel.status == DuelStatus.ACTIVE, Duel.is_house_duel.is_(True))
+                .order_by(Duel.created_at.desc())
+            )
 
         except Exception as e:
             logger.error(f"❌ Error getting active house duels: {e}")
@@ -293,14 +414,12 @@ class GameService:
 
             # Возвращаем ставки игрокам
             if duel.player1_id:
-                player1 = await User.get_by_telegram_id(duel.player1_id)
-                if player1:
-                    await player1.add_balance(duel.stake)
+                await User.credit_balance(duel.player1_id, duel.stake, reason="duel_cancel",
+                                          reference=f"duel:{duel_id}")
 
             if not duel.is_house_duel and duel.player2_id:
-                player2 = await User.get_by_telegram_id(duel.player2_id)
-                if player2:
-                    await player2.add_balance(duel.stake)
+                await User.credit_balance(duel.player2_id, duel.stake, reason="duel_cancel",
+                                          reference=f"duel:{duel_id}")
 
             # Отменяем дуэль
             await duel.cancel_duel()
@@ -311,26 +430,6 @@ class GameService:
             logger.error(f"❌ Error cancelling duel {duel_id}: {e}")
             return False
 
-    async def cleanup_expired_waiting(self):
-        """Очистка истекших ожиданий"""
-        try:
-            current_time = datetime.utcnow()
-            timeout_threshold = timedelta(seconds=MATCH_TIMEOUT + 5)
-
-            for stake in list(self.waiting_players.keys()):
-                # Фильтруем устаревшие записи
-                self.waiting_players[stake] = [
-                    (user_id, timestamp) for user_id, timestamp in self.waiting_players[stake]
-                    if current_time - timestamp < timeout_threshold
-                ]
-
-                # Удаляем пустые списки
-                if not self.waiting_players[stake]:
-                    del self.waiting_players[stake]
-
-        except Exception as e:
-            logger.error(f"❌ Error cleaning up expired waiting: {e}")
-
 
 # Глобальный экземпляр сервиса
 game_service = GameService()
\ No newline at end of file
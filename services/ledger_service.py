@@ -0,0 +1,85 @@
+"""
+Сервис журнала средств: периодические снимки балансов и сверка
+"""
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any
+
+from database.models.ledger import LedgerEntry, BalanceSnapshot, user_account
+from config.settings import LEDGER_SNAPSHOT_INTERVAL
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class LedgerService:
+    def __init__(self, snapshot_interval: int = LEDGER_SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self.task: Optional[asyncio.Task] = None
+        self.last_snapshot_at: Optional[datetime] = None
+
+    async def start(self):
+        """Запустить периодические снимки"""
+        if self.snapshot_interval <= 0 or self.task is not None:
+            return
+
+        self.task = asyncio.create_task(self._snapshot_loop())
+        logger.info(f"🚀 Ledger snapshots started, interval: {self.snapshot_interval}s")
+
+    async def stop(self):
+        """Остановить снимки"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            logger.info("🛑 Ledger snapshots stopped")
+
+    async def _snapshot_loop(self):
+        """Основной цикл снимков"""
+        while True:
+            try:
+                await self.take_snapshots()
+            except Exception as e:
+                logger.error(f"❌ Error in ledger snapshot loop: {e}")
+            await asyncio.sleep(self.snapshot_interval)
+
+    async def take_snapshots(self) -> int:
+        """Снять снимки по счетам с новыми проводками"""
+        count = await BalanceSnapshot.take_snapshots()
+        self.last_snapshot_at = datetime.utcnow()
+        if count:
+            logger.info(f"✅ Took {count} ledger balance snapshots")
+        return count
+
+    async def get_user_balance_at(self, telegram_id: int, at: Optional[datetime] = None) -> Decimal:
+        """Баланс пользователя по журналу на момент at"""
+        return await LedgerEntry.balance_at(user_account(telegram_id), at)
+
+    async def reconcile_user(self, telegram_id: int) -> Dict[str, Any]:
+        """Сверить баланс пользователя с журналом"""
+        from database.models.user import User
+
+        user = await User.get_by_telegram_id(telegram_id, fresh=True)
+        if not user:
+            return {"error": "Пользователь не найден"}
+
+        ledger_balance = await self.get_user_balance_at(telegram_id)
+        return {
+            "balance": user.balance,
+            "ledger_balance": ledger_balance,
+            "difference": user.balance - ledger_balance
+        }
+
+
+# Глобальный экземпляр сервиса
+ledger_service = LedgerService()
+
+
+async def start_ledger_snapshots():
+    """Запустить снимки балансов в фоне"""
+    await ledger_service.start()
+
+
+async def stop_ledger_snapshots():
+    """Остановить снимки балансов"""
+    await ledger_service.stop()
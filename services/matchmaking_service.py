@@ -0,0 +1,548 @@
+"""
+Сервис подбора соперников для быстрой игры
+"""
+import asyncio
+import json
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Deque, List, Iterator, Tuple, Callable, Awaitable
+
+from sortedcontainers import SortedList
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import MATCH_STAKE_TOLERANCE, MATCH_TIMEOUT, MATCHMAKING_BACKEND
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class MatchTicket:
+    """Заявка игрока в очереди поиска"""
+
+    __slots__ = ("user_id", "username", "stake", "future", "claimed", "created_at", "entry_id")
+
+    def __init__(self, user_id: int, username: Optional[str], stake: Decimal, entry_id: Optional[int] = None):
+        self.user_id = user_id
+        self.username = username
+        self.stake = stake
+        # Резолвится результатом матча, как только найдется соперник
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.claimed = False  # Соперник найден, дуэль создается
+        self.created_at = datetime.utcnow()
+        self.entry_id = entry_id  # ID строки match_queue (только для PostgreSQL)
+
+    @property
+    def display_name(self) -> str:
+        """Имя игрока для показа сопернику"""
+        return self.username or f"Player {self.user_id}"
+
+    def is_waiting(self) -> bool:
+        """Заявка еще ждет соперника"""
+        return not self.claimed and not self.future.done()
+
+    def __repr__(self):
+        return f"<MatchTicket(user_id={self.user_id}, stake={self.stake}, claimed={self.claimed})>"
+
+
+class ClaimedMatchLost(Exception):
+    """Заявку забрал соперник, но результат подбора так и не пришел и дуэль не найдена"""
+
+
+# Возврат ставки при снятии заявки: получает сессию транзакции снятия (None - своя транзакция)
+Refund = Callable[[Optional[AsyncSession]], Awaitable[None]]
+
+
+class MatchmakingBackend:
+    """Интерфейс очереди подбора соперников"""
+
+    def __init__(self, stake_tolerance: float = MATCH_STAKE_TOLERANCE):
+        self.stake_tolerance = Decimal(str(stake_tolerance))
+
+    def stake_range(self, stake: Decimal) -> Tuple[Decimal, Decimal]:
+        """Допустимый диапазон ставок соперника: разница не больше допуска от меньшей ставки"""
+        return stake / (1 + self.stake_tolerance), stake * (1 + self.stake_tolerance)
+
+    async def claim_opponent(self, user_id: int, stake: Decimal) -> Optional[MatchTicket]:
+        """Забрать ожидающего соперника с подходящей ставкой"""
+        raise NotImplementedError
+
+    async def enqueue(self, user_id: int, username: Optional[str], stake: Decimal) -> MatchTicket:
+        """Поставить игрока в очередь ожидания"""
+        raise NotImplementedError
+
+    async def withdraw(self, ticket: MatchTicket, refund: Optional[Refund] = None) -> bool:
+        """Снять заявку из очереди. False - соперник уже найден.
+
+        refund(session) возвращает ставку в той же транзакции, что и снятие заявки:
+        если он упал, заявка остается в очереди, а исключение уходит вызывающему коду.
+        """
+        raise NotImplementedError
+
+    async def notify_match(self, ticket: MatchTicket, result: Optional[Dict]):
+        """Передать забранной заявке результат подбора (None - играть с ботом)"""
+        raise NotImplementedError
+
+    async def drain_pairs(self) -> List[Tuple[MatchTicket, MatchTicket]]:
+        """Забрать все пары, которые можно составить из очереди (для тика матчмейкинга)"""
+        raise NotImplementedError
+
+    async def notify_matches(self, matches: List[Tuple[MatchTicket, Optional[Dict]]]):
+        """Передать результаты сразу нескольким заявкам"""
+        for ticket, result in matches:
+            await self.notify_match(ticket, result)
+
+    def pair_sorted(self, tickets: List[MatchTicket]) -> List[Tuple[MatchTicket, MatchTicket]]:
+        """Жадно составить пары из заявок, отсортированных по ставке.
+
+        Соседние заявки объединяются, если их ставки укладываются в допуск.
+        """
+        pairs = []
+        pending = None
+        for ticket in tickets:
+            if (pending is not None and pending.user_id != ticket.user_id
+                    and ticket.stake <= pending.stake * (1 + self.stake_tolerance)):
+                pairs.append((pending, ticket))
+                pending = None
+            else:
+                pending = ticket
+        return pairs
+
+    async def wait_for_opponent(self, ticket: MatchTicket, timeout: float) -> Optional[Dict]:
+        """Ждать соперника не дольше timeout. None - соперник не найден"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            if await self.withdraw(ticket):
+                return None
+            # Соперник забрал заявку в последний момент - дуэль уже создается
+            return await self._wait_claimed(ticket)
+
+    async def _wait_claimed(self, ticket: MatchTicket) -> Optional[Dict]:
+        """Дождаться результата уже забранной заявки"""
+        return await ticket.future
+
+    async def get_queue_stats(self) -> Dict:
+        """Статистика очередей для админки"""
+        raise NotImplementedError
+
+
+class InMemoryMatchmakingBackend(MatchmakingBackend):
+    """Очередь в памяти процесса (один экземпляр бота)"""
+
+    def __init__(self, stake_tolerance: float = MATCH_STAKE_TOLERANCE):
+        super().__init__(stake_tolerance)
+        self.queues: Dict[Decimal, Deque[MatchTicket]] = {}  # {stake: deque([ticket, ...])}
+        # Отсортированные ключи queues для поиска по допуску: вставка, удаление и bisect за O(log n)
+        self.stake_levels: SortedList = SortedList()
+        self.tickets: Dict[int, MatchTicket] = {}  # {user_id: ticket}
+
+    async def claim_opponent(self, user_id: int, stake: Decimal) -> Optional[MatchTicket]:
+        """Забрать ожидающего соперника с ближайшей ставкой в пределах допуска"""
+        opponent = None
+        emptied = []
+
+        for level in self._candidate_levels(stake):
+            opponent = self._claim_from_level(level, user_id)
+            if not self.queues[level]:
+                emptied.append(level)
+            if opponent:
+                break
+
+        # Удаляем пустые уровни после обхода, чтобы не сдвигать индексы во время поиска
+        for level in emptied:
+            self._drop_level(level)
+
+        if opponent:
+            opponent.claimed = True
+            self.tickets.pop(opponent.user_id, None)
+
+        return opponent
+
+    def _candidate_levels(self, stake: Decimal) -> Iterator[Decimal]:
+        """Уровни ставок в пределах допуска, от ближайшего к дальнему"""
+        if self.stake_tolerance <= 0:
+            if stake in self.queues:
+                yield stake
+            return
+
+        low, high = self.stake_range(stake)
+
+        levels = self.stake_levels
+        right = levels.bisect_left(stake)
+        left = right - 1
+
+        while True:
+            lower = levels[left] if left >= 0 and levels[left] >= low else None
+            upper = levels[right] if right < len(levels) and levels[right] <= high else None
+
+            if lower is None and upper is None:
+                return
+
+            # При равном расстоянии предпочитаем меньшую ставку
+            if upper is not None and (lower is None or upper - stake < stake - lower):
+                yield upper
+                right += 1
+            else:
+                yield lower
+                left -= 1
+
+    def _claim_from_level(self, level: Decimal, user_id: int) -> Optional[MatchTicket]:
+        """Забрать первую живую заявку из очереди уровня"""
+        queue = self.queues[level]
+        skipped = []
+        opponent = None
+
+        while queue:
+            ticket = queue.popleft()
+            if not ticket.is_waiting():
+                continue  # Заявка уже снята (таймаут), просто выбрасываем
+            if ticket.user_id == user_id:
+                skipped.append(ticket)  # Не играем сами с собой
+                continue
+            opponent = ticket
+            break
+
+        # Возвращаем пропущенные заявки в начало очереди в исходном порядке
+        queue.extendleft(reversed(skipped))
+        return opponent
+
+    def _drop_level(self, level: Decimal):
+        """Удалить пустой уровень ставки из очередей и индекса"""
+        del self.queues[level]
+        self.stake_levels.discard(level)
+
+    async def enqueue(self, user_id: int, username: Optional[str], stake: Decimal) -> MatchTicket:
+        """Поставить игрока в очередь ожидания"""
+        ticket = MatchTicket(user_id, username, stake)
+        queue = self.queues.get(stake)
+        if queue is None:
+            queue = self.queues[stake] = deque()
+            self.stake_levels.add(stake)
+        queue.append(ticket)
+        self.tickets[user_id] = ticket
+        return ticket
+
+    async def withdraw(self, ticket: MatchTicket, refund: Optional[Refund] = None) -> bool:
+        """Снять заявку из очереди. False - соперник уже найден"""
+        if not ticket.is_waiting():
+            return False
+
+        if refund is not None:
+            # Очередь в памяти: пока идет возврат, заявку не должен забрать соперник
+            ticket.claimed = True
+            try:
+                await refund(None)
+            finally:
+                ticket.claimed = False
+
+        ticket.future.cancel()
+        if self.tickets.get(ticket.user_id) is ticket:
+            del self.tickets[ticket.user_id]
+
+        # Таймауты у всех одинаковые, поэтому снятые заявки копятся в начале очереди
+        queue = self.queues.get(ticket.stake)
+        if queue is not None:
+            while queue and not queue[0].is_waiting():
+                queue.popleft()
+            if not queue:
+                self._drop_level(ticket.stake)
+
+        return True
+
+    async def drain_pairs(self) -> List[Tuple[MatchTicket, MatchTicket]]:
+        """Забрать все пары по всем уровням ставок"""
+        waiting = [
+            ticket
+            for level in self.stake_levels
+            for ticket in self.queues[level]
+            if ticket.is_waiting()
+        ]
+        pairs = self.pair_sorted(waiting)
+        if not pairs:
+            return []
+
+        for first, second in pairs:
+            for ticket in (first, second):
+                ticket.claimed = True
+                self.tickets.pop(ticket.user_id, None)
+
+        # Пересобираем очереди без забранных заявок
+        for level in list(self.stake_levels):
+            queue = self.queues[level]
+            remaining = [ticket for ticket in queue if ticket.is_waiting()]
+            if remaining:
+                if len(remaining) != len(queue):
+                    self.queues[level] = deque(remaining)
+            else:
+                self._drop_level(level)
+
+        return pairs
+
+    async def notify_match(self, ticket: MatchTicket, result: Optional[Dict]):
+        """Передать забранной заявке результат подбора (None - играть с ботом)"""
+        if not ticket.future.done():
+            ticket.future.set_result(result)
+
+    async def get_queue_stats(self) -> Dict:
+        """Статистика очередей для админки"""
+        return {
+            "backend": "memory",
+            "waiting_players": len(self.tickets),
+            "stake_buckets": len(self.queues)
+        }
+
+
+class PostgresMatchmakingBackend(MatchmakingBackend):
+    """Общая очередь в PostgreSQL для нескольких процессов бота.
+
+    Заявки лежат в таблице match_queue и забираются через SELECT ... FOR UPDATE SKIP LOCKED.
+    Процесс, создавший дуэль, будит ожидающий процесс через NOTIFY - без опроса таблицы.
+    """
+
+    # Сколько ждать результата уже забранной заявки, если NOTIFY не пришел
+    CLAIMED_WAIT_TIMEOUT = 30
+    # Как часто при этом искать созданную дуэль в БД (NOTIFY мог потеряться при обрыве соединения)
+    CLAIMED_CHECK_INTERVAL = 5
+    # Как часто проверять соединение слушателя (обрыв без закрытия сокета сам не виден)
+    LISTENER_CHECK_INTERVAL = 30
+
+    def __init__(self, stake_tolerance: float = MATCH_STAKE_TOLERANCE):
+        super().__init__(stake_tolerance)
+        self.pending: Dict[int, MatchTicket] = {}  # {entry_id: ticket} заявки этого процесса
+        self.listen_connection = None
+        self._listener_lock = asyncio.Lock()
+        self.health_task: Optional[asyncio.Task] = None
+        self.reconnects = 0
+
+    def _listener_alive(self) -> bool:
+        """Соединение слушателя открыто"""
+        return self.listen_connection is not None and not self.listen_connection.driver_connection.is_closed()
+
+    async def _ensure_listener(self):
+        """Подписаться на канал очереди (одно соединение на процесс), переподключиться после обрыва"""
+        if self._listener_alive():
+            return
+
+        async with self._listener_lock:
+            if self._listener_alive():
+                return
+
+            from database.connection import engine
+            from database.models.match_queue import MatchQueueEntry, MATCH_QUEUE_CHANNEL
+
+            if self.listen_connection is not None:
+                self._drop_listener()
+                self.reconnects += 1
+            else:
+                # Заявки упавших процессов больше никто не дождется
+                removed = await MatchQueueEntry.cleanup_stale(MATCH_TIMEOUT * 3)
+                if removed:
+                    logger.warning(f"⚠️ Removed {removed} stale match queue entries")
+
+            connection = await engine.raw_connection()
+            await connection.driver_connection.add_listener(MATCH_QUEUE_CHANNEL, self._on_notify)
+            connection.driver_connection.add_termination_listener(self._on_listener_terminated)
+            self.listen_connection = connection
+            if self.health_task is None:
+                self.health_task = asyncio.create_task(self._health_loop())
+            logger.info("✅ Listening for match queue notifications")
+
+    def _drop_listener(self):
+        """Закрыть соединение слушателя и вернуть его место в пуле"""
+        connection, self.listen_connection = self.listen_connection, None
+        if connection is None:
+            return
+        try:
+            connection.driver_connection.terminate()
+            connection.detach()
+        except Exception as e:
+            logger.warning(f"⚠️ Error dropping match queue listener: {e}")
+
+    def _on_listener_terminated(self, connection):
+        """Соединение слушателя закрыто сервером или сетью - переподключаемся сразу"""
+        logger.warning("⚠️ Match queue listener connection lost, reconnecting")
+        asyncio.get_running_loop().create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        """Переподключить слушателя (ошибку подхватит следующая проверка)"""
+        try:
+            await self._ensure_listener()
+        except Exception as e:
+            logger.error(f"❌ Error reconnecting match queue listener: {e}")
+
+    async def _health_loop(self):
+        """Периодически проверять соединение слушателя запросом"""
+        while True:
+            await asyncio.sleep(self.LISTENER_CHECK_INTERVAL)
+            try:
+                if self.listen_connection is not None:
+                    await asyncio.wait_for(self.listen_connection.driver_connection.execute("SELECT 1"),
+                                           self.LISTENER_CHECK_INTERVAL)
+            except Exception as e:
+                logger.warning(f"⚠️ Match queue listener check failed: {e}")
+                if self.listen_connection is not None:
+                    self.listen_connection.driver_connection.terminate()  # Закрытое соединение пересоздаст _ensure_listener
+                await self._reconnect_listener()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        """Обработать NOTIFY о найденном сопернике"""
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ Invalid match queue payload: {payload}")
+            return
+
+        ticket = self.pending.pop(data.get("id"), None)
+        if ticket is None or ticket.future.done():
+            return  # Заявка другого процесса
+
+        result = data.get("result")
+        if result is not None:
+            result["stake"] = Decimal(result["stake"])
+        ticket.future.set_result(result)
+
+    async def claim_opponent(self, user_id: int, stake: Decimal) -> Optional[MatchTicket]:
+        """Забрать ожидающего соперника с ближайшей ставкой в пределах допуска"""
+        from database.models.match_queue import MatchQueueEntry
+
+        low, high = self.stake_range(stake) if self.stake_tolerance > 0 else (stake, stake)
+        row = await MatchQueueEntry.claim(user_id, low, high, stake, MATCH_TIMEOUT)
+        if not row:
+            return None
+
+        # Будущее здесь не используется: ожидающий игрок живет в другом процессе (или в этом)
+        ticket = self._ticket_from_row(row)
+        ticket.claimed = True
+        return ticket
+
+    async def enqueue(self, user_id: int, username: Optional[str], stake: Decimal) -> MatchTicket:
+        """Поставить игрока в общую очередь"""
+        from database.models.match_queue import MatchQueueEntry
+
+        await self._ensure_listener()
+        entry_id = await MatchQueueEntry.enqueue(user_id, username, stake)
+        ticket = MatchTicket(user_id, username, stake, entry_id=entry_id)
+        self.pending[entry_id] = ticket
+        return ticket
+
+    async def withdraw(self, ticket: MatchTicket, refund: Optional[Refund] = None) -> bool:
+        """Удалить заявку, если ее еще никто не забрал (вместе с возвратом ставки - одной транзакцией)"""
+        from database.connection import async_session
+        from database.models.match_queue import MatchQueueEntry
+
+        if refund is None:
+            removed = await MatchQueueEntry.withdraw(ticket.entry_id)
+        else:
+            async with async_session() as session:
+                try:
+                    removed = await MatchQueueEntry.withdraw(ticket.entry_id, session=session)
+                    if removed:
+                        await refund(session)
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    raise
+
+        if not removed:
+            ticket.claimed = True
+            return False
+
+        self.pending.pop(ticket.entry_id, None)
+        ticket.future.cancel()
+        return True
+
+    async def drain_pairs(self) -> List[Tuple[MatchTicket, MatchTicket]]:
+        """Забрать пары из общей очереди (строки под блокировкой других процессов пропускаются)"""
+        from database.models.match_queue import MatchQueueEntry
+
+        def make_pairs(tickets: List[MatchTicket]) -> List[Tuple[MatchTicket, MatchTicket]]:
+            for ticket in tickets:
+                ticket.claimed = True
+            return self.pair_sorted(tickets)
+
+        return await MatchQueueEntry.claim_pairs(self._ticket_from_row, make_pairs, MATCH_TIMEOUT)
+
+    @staticmethod
+    def _ticket_from_row(row: Dict) -> MatchTicket:
+        """Заявка из строки match_queue"""
+        return MatchTicket(row["user_id"], row["username"], row["stake"], entry_id=row["id"])
+
+    async def notify_match(self, ticket: MatchTicket, result: Optional[Dict]):
+        """Разбудить ожидающий процесс через NOTIFY"""
+        from database.models.match_queue import MatchQueueEntry
+
+        await MatchQueueEntry.notify_match(ticket.entry_id, result)
+
+    async def notify_matches(self, matches: List[Tuple[MatchTicket, Optional[Dict]]]):
+        """Разослать все NOTIFY одной транзакцией"""
+        from database.models.match_queue import MatchQueueEntry
+
+        await MatchQueueEntry.notify_matches([(ticket.entry_id, result) for ticket, result in matches])
+
+    async def _wait_claimed(self, ticket: MatchTicket) -> Optional[Dict]:
+        """Дождаться результата по уже забранной заявке.
+
+        Между ожиданиями NOTIFY созданная дуэль ищется в БД. Игру с ботом по забранной заявке
+        не начинаем: дуэль с соперником могла уже быть создана со ставкой этого игрока.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.CLAIMED_WAIT_TIMEOUT
+        try:
+            while True:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(ticket.future), self.CLAIMED_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+                result = await self._find_claimed_duel(ticket)
+                if result is not None:
+                    logger.warning(f"⚠️ Match notification for entry {ticket.entry_id} lost, found duel in DB")
+                    return result
+
+                await self._reconnect_listener()
+                if loop.time() >= deadline:
+                    logger.error(f"❌ No match result for claimed entry {ticket.entry_id}")
+                    raise ClaimedMatchLost(ticket.entry_id)
+        finally:
+            self.pending.pop(ticket.entry_id, None)
+
+    @staticmethod
+    async def _find_claimed_duel(ticket: MatchTicket) -> Optional[Dict]:
+        """Результат подбора по дуэли, созданной для игрока после постановки заявки"""
+        from database.models.duel import Duel
+        from services.username_resolver import username_resolver
+
+        duel = await Duel.find_matched_duel(ticket.user_id, ticket.created_at)
+        if duel is None:
+            return None
+        return {
+            "type": "real_duel",
+            "duel_id": duel.id,
+            "opponent": await username_resolver.display_name(duel.get_opponent_id(ticket.user_id)),
+            "stake": duel.stake
+        }
+
+    async def get_queue_stats(self) -> Dict:
+        """Статистика очереди для админки"""
+        from database.models.match_queue import MatchQueueEntry
+
+        return {
+            "backend": "postgres",
+            "waiting_players": await MatchQueueEntry.count_waiting(),
+            "local_waiting": len(self.pending),
+            "listener_reconnects": self.reconnects
+        }
+
+
+def create_matchmaking_backend(name: str = MATCHMAKING_BACKEND) -> MatchmakingBackend:
+    """Создать бэкенд очереди по имени из настроек"""
+    if name == "postgres":
+        return PostgresMatchmakingBackend()
+    if name != "memory":
+        logger.warning(f"⚠️ Unknown matchmaking backend '{name}', using memory")
+    return InMemoryMatchmakingBackend()
+
+
+# Глобальный экземпляр сервиса
+matchmaking_service = create_matchmaking_backend()
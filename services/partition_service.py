@@ -0,0 +1,192 @@
+"""
+Обслуживание помесячных партиций transactions и duels: новые партиции, итоги месяцев, архивация
+"""
+import asyncio
+import gzip
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import text
+
+from database.connection import engine, async_session
+from database.models.partition_rollup import PartitionRollup, ROLLUP_QUERIES, month_start, add_months
+from config.settings import (
+    PARTITION_MAINTENANCE_INTERVAL, PARTITION_MONTHS_AHEAD, PARTITION_RETENTION_MONTHS, ARCHIVE_MODE, ARCHIVE_DIR
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Таблицы, разбитые по месяцам created_at (миграция 0003)
+PARTITIONED_TABLES = tuple(ROLLUP_QUERIES)
+
+# Схема для отсоединенных партиций в режиме ARCHIVE_MODE=table
+ARCHIVE_SCHEMA = "archive"
+
+
+def partition_name(table_name: str, month: datetime) -> str:
+    """Имя партиции месяца: transactions_p2026_10"""
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+class PartitionService:
+    def __init__(self, interval: int = PARTITION_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.archived: List[str] = []
+
+    async def start(self):
+        """Запустить периодическое обслуживание"""
+        if self.interval <= 0 or self.task is not None:
+            return
+
+        self.task = asyncio.create_task(self._maintenance_loop())
+        logger.info(f"🚀 Partition maintenance started, interval: {self.interval}s")
+
+    async def stop(self):
+        """Остановить обслуживание"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            logger.info("🛑 Partition maintenance stopped")
+
+    async def _maintenance_loop(self):
+        """Основной цикл обслуживания"""
+        while True:
+            try:
+                await self.run_maintenance()
+            except Exception as e:
+                logger.error(f"❌ Error in partition maintenance: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_maintenance(self):
+        """Создать будущие партиции, посчитать итоги закрытых месяцев, архивировать старые"""
+        now = datetime.utcnow()
+        partitioned = await self.is_partitioned()
+
+        for table_name in PARTITIONED_TABLES:
+            if partitioned:
+                await self.ensure_partitions(table_name, now)
+
+            # Итоги - до архивации: статистика за все время берется из них
+            for month in await PartitionRollup.pending_months(table_name, now):
+                await PartitionRollup.rollup_month(table_name, month)
+                logger.info(f"✅ Rolled up {table_name} for {month:%Y-%m}")
+
+            if partitioned and PARTITION_RETENTION_MONTHS > 0:
+                await self.archive_old_partitions(table_name, now)
+
+        self.last_run_at = now
+
+    async def is_partitioned(self) -> bool:
+        """Разбиты ли таблицы на партиции (только PostgreSQL после миграции 0003)"""
+        if engine.dialect.name != "postgresql":
+            return False
+        async with async_session() as session:
+            return bool(await session.scalar(text("""
+                SELECT COUNT(*) FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = 'transactions'
+            """)))
+
+    async def ensure_partitions(self, table_name: str, now: datetime) -> int:
+        """Создать партиции на PARTITION_MONTHS_AHEAD месяцев вперед"""
+        created = 0
+        async with async_session() as session:
+            month = month_start(now)
+            for _ in range(PARTITION_MONTHS_AHEAD + 1):
+                name = partition_name(table_name, month)
+                exists = await session.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+                if not exists:
+                    await session.execute(text(
+                        f"CREATE TABLE {name} PARTITION OF {table_name} "
+                        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+                    ))
+                    created += 1
+                    logger.info(f"✅ Created partition {name}")
+                month = add_months(month, 1)
+            await session.commit()
+        return created
+
+    async def list_partitions(self, table_name: str) -> List[Tuple[str, datetime]]:
+        """Месячные партиции таблицы: [(имя, начало месяца)] от старых к новым"""
+        async with async_session() as session:
+            result = await session.execute(text("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = :table_name
+            """), {"table_name": table_name})
+
+            partitions = []
+            prefix = f"{table_name}_p"
+            for (name,) in result.fetchall():
+                if name.startswith(prefix):  # Пропускаем партицию по умолчанию
+                    partitions.append((name, datetime.strptime(name[len(prefix):], "%Y_%m")))
+            return sorted(partitions, key=lambda partition: partition[1])
+
+    async def archive_old_partitions(self, table_name: str, now: datetime) -> List[str]:
+        """Отсоединить партиции старше PARTITION_RETENTION_MONTHS месяцев, у которых уже есть итоги"""
+        cutoff = add_months(month_start(now), -PARTITION_RETENTION_MONTHS)
+        live_from = await PartitionRollup.get_live_from(table_name)
+
+        archived = []
+        for name, month in await self.list_partitions(table_name):
+            if month >= cutoff or live_from is None or month >= live_from:
+                continue
+            await self.archive_partition(table_name, name)
+            archived.append(name)
+        return archived
+
+    async def archive_partition(self, table_name: str, name: str):
+        """Отсоединить партицию и перенести в схему archive или в сжатый CSV"""
+        async with engine.connect() as connection:
+            await connection.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+
+            if ARCHIVE_MODE == "file":
+                path = Path(ARCHIVE_DIR) / f"{name}.csv.gz"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                driver_connection = (await connection.get_raw_connection()).driver_connection
+                with gzip.open(path, "wb") as archive:
+                    async def write_chunk(chunk: bytes):
+                        await asyncio.to_thread(archive.write, chunk)  # Сжатие не блокирует цикл событий
+
+                    await driver_connection.copy_from_table(name, output=write_chunk, format="csv", header=True)
+                await connection.execute(text(f"DROP TABLE {name}"))
+                logger.info(f"✅ Archived partition {name} to {path}")
+            else:
+                await connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                await connection.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                logger.info(f"✅ Moved partition {name} to schema {ARCHIVE_SCHEMA}")
+
+            await connection.commit()
+        self.archived.append(name)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Состояние партиций для админки"""
+        partitioned = await self.is_partitioned()
+        return {
+            "partitioned": partitioned,
+            "partitions": {
+                table_name: len(await self.list_partitions(table_name)) if partitioned else 0
+                for table_name in PARTITIONED_TABLES
+            },
+            "last_run_at": self.last_run_at,
+            "archived": list(self.archived)
+        }
+
+
+# Глобальный экземпляр сервиса
+partition_service = PartitionService()
+
+
+async def start_partition_maintenance():
+    """Запустить обслуживание партиций в фоне"""
+    await partition_service.start()
+
+
+async def stop_partition_maintenance():
+    """Остановить обслуживание партиций"""
+    await partition_service.stop()
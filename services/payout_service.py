@@ -0,0 +1,198 @@
+"""
+Сервис асинхронных выплат выигрышей из payout_outbox
+"""
+import asyncio
+from typing import List, Dict, Any, Optional
+
+from database.models.payout_outbox import PayoutOutbox
+from services.solana_service import solana_service, UnconfirmedSignature
+from config.settings import (
+    PAYOUT_WORKERS, PAYOUT_MAX_ATTEMPTS, PAYOUT_RETRY_DELAY, PAYOUT_PROCESSING_TIMEOUT, PAYOUT_BATCH_SIZE
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class PayoutService:
+    def __init__(self, workers: int = PAYOUT_WORKERS):
+        self.workers_count = max(1, workers)
+        self.workers: List[asyncio.Task] = []
+        self.wakeup = asyncio.Event()  # Будит воркеров при новой выплате
+        self.idle_interval = 5  # секунд, опрос очереди без сигналов (повторы, другие процессы)
+        self.reconcile_task: Optional[asyncio.Task] = None
+        self.reconcile_interval = 15  # секунд между проверками подписей выплат с неизвестной судьбой
+        self.sent_count = 0
+        self.failed_count = 0
+        self.reconciled_count = 0
+
+    async def start(self):
+        """Запустить пул воркеров"""
+        if self.workers:
+            logger.warning("⚠️ Payout workers already running")
+            return
+
+        # Выплаты, забранные упавшим процессом, возвращаем в очередь (с подписью - на проверку).
+        # Таймаут должен быть больше времени отправки, иначе возможна повторная выплата
+        recovered = await PayoutOutbox.recover_stale(PAYOUT_PROCESSING_TIMEOUT)
+        if recovered:
+            logger.warning(f"⚠️ Recovered {recovered} stale payouts")
+
+        self.workers = [
+            asyncio.create_task(self._worker_loop(number))
+            for number in range(self.workers_count)
+        ]
+        self.reconcile_task = asyncio.create_task(self._reconcile_loop())
+        logger.info(f"🚀 Started {self.workers_count} payout workers")
+
+    async def stop(self):
+        """Остановить воркеров"""
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+        if self.reconcile_task:
+            self.reconcile_task.cancel()
+            self.reconcile_task = None
+        logger.info("🛑 Payout workers stopped")
+
+    def notify(self):
+        """Сообщить воркерам о новой выплате"""
+        self.wakeup.set()
+
+    async def _worker_loop(self, number: int):
+        """Основной цикл воркера"""
+        while True:
+            try:
+                payouts = await PayoutOutbox.claim_batch(limit=PAYOUT_BATCH_SIZE)
+                if not payouts:
+                    await self._wait_for_work()
+                    continue
+
+                await self._process_batch(payouts)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in payout worker {number}: {e}")
+                await asyncio.sleep(self.idle_interval)
+
+    async def _wait_for_work(self):
+        """Ждать сигнала о новой выплате или следующего опроса"""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), self.idle_interval)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def _process_batch(self, payouts: List[Dict[str, Any]]):
+        """Отправить пачку выплат минимумом транзакций"""
+        error = "Ошибка отправки токенов"
+        try:
+            tx_hashes = await solana_service.send_token_batch(
+                [(payout["wallet_address"], payout["amount"]) for payout in payouts],
+                str(solana_service.mori_mint),
+                on_signed=lambda indexes, signature, valid_until_height: PayoutOutbox.record_signature(
+                    [payouts[index]["id"] for index in indexes], signature, valid_until_height
+                )
+            )
+        except Exception as e:
+            tx_hashes = [None] * len(payouts)
+            error = str(e)
+
+        for payout, tx_hash in zip(payouts, tx_hashes):
+            await self._finish_payout(payout, tx_hash, error)
+
+    async def _finish_payout(self, payout: Dict[str, Any], tx_hash: Optional[str], error: str):
+        """Записать результат выплаты: отправлена, проверка подписи, повтор или зачисление на баланс"""
+        if isinstance(tx_hash, UnconfirmedSignature):
+            # Транзакция могла попасть в блок: ни повтора, ни возврата на баланс до проверки подписи
+            await PayoutOutbox.mark_reconcile(payout["id"], "Статус транзакции неизвестен")
+            logger.warning(f"⚠️ Payout {payout['id']} status unknown, waiting for reconciliation of {tx_hash}")
+            return
+
+        if tx_hash:
+            if not await PayoutOutbox.mark_sent(payout["id"], payout["transaction_id"], tx_hash):
+                # Подпись записана до отправки - выплату подтвердит проверка подписи
+                await PayoutOutbox.mark_reconcile(payout["id"], "Не удалось отметить отправку")
+                return
+            self.sent_count += 1
+            logger.info(f"✅ Sent winnings {payout['amount']} MORI to user {payout['telegram_id']}")
+            return
+
+        if payout["attempts"] < PAYOUT_MAX_ATTEMPTS:
+            # Экспоненциальная задержка между попытками
+            delay = PAYOUT_RETRY_DELAY * 2 ** (payout["attempts"] - 1)
+            await PayoutOutbox.schedule_retry(payout["id"], delay, error)
+            logger.warning(f"⚠️ Payout {payout['id']} failed (attempt {payout['attempts']}), retry in {delay}s")
+            return
+
+        # Попытки исчерпаны - зачисляем выигрыш на баланс
+        if await PayoutOutbox.mark_failed(payout, error):
+            self.failed_count += 1
+            logger.warning(f"⚠️ Failed to send winnings, added to balance for user {payout['telegram_id']}")
+
+    async def _reconcile_loop(self):
+        """Периодически проверять подписи выплат с неизвестной судьбой"""
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error reconciling payouts: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def reconcile(self) -> int:
+        """Разобрать выплаты в reconcile по статусу их подписи. Возвращает число разобранных"""
+        payouts = await PayoutOutbox.get_reconcile_batch(limit=PAYOUT_BATCH_SIZE)
+        outcomes: Dict[str, Optional[bool]] = {}
+        resolved = 0
+        for payout in payouts:
+            signature = payout["signature"]
+            if signature not in outcomes:
+                outcomes[signature] = await solana_service.get_signature_outcome(
+                    signature, payout["valid_until_height"]
+                )
+            landed = outcomes[signature]
+            if landed is None:
+                continue  # Еще может попасть в блок - проверим позже
+
+            if landed:
+                if await PayoutOutbox.mark_sent(payout["id"], payout["transaction_id"], signature):
+                    self.sent_count += 1
+                    resolved += 1
+                    logger.info(f"✅ Payout {payout['id']} confirmed by signature {signature}")
+                continue
+
+            # Транзакция не попала в блок и уже не попадет - обычный повтор или возврат на баланс
+            if await PayoutOutbox.release_reconcile(payout["id"]):
+                await self._finish_payout(payout, None, "Транзакция не попала в блок")
+                resolved += 1
+
+        if resolved:
+            self.reconciled_count += resolved
+        return resolved
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Статистика выплат для админки"""
+        return {
+            "workers": len(self.workers),
+            "queue": await PayoutOutbox.get_stats(),
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "reconciled": self.reconciled_count
+        }
+
+
+# Глобальный экземпляр сервиса
+payout_service = PayoutService()
+
+
+async def start_payout_workers():
+    """Запустить воркеров выплат в фоне"""
+    await payout_service.start()
+
+
+async def stop_payout_workers():
+    """Остановить воркеров выплат"""
+    await payout_service.stop()
@@ -0,0 +1,183 @@
+"""
+Реестр открытых комнат в памяти: лобби без запросов к БД и истечение комнат по таймеру
+"""
+import asyncio
+import heapq
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from database.models.room import Room
+from config.settings import ROOM_EXPIRY_RETRY_DELAY, ROOM_SYNC_INTERVAL
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class RoomRegistry:
+    """Открытые комнаты процесса: {код: комната} и куча сроков истечения (expires_at, код).
+
+    Заполняется из БД при старте и обновляется хендлерами при создании, входе и закрытии.
+    Фоновая задача спит до ближайшего expires_at и истекает все наступившие комнаты
+    одним вызовом Room.expire_rooms (возвраты ставок - пачкой).
+
+    Реестр - только кэш процесса, источник истины - БД. Хендлеры другого процесса бота
+    его не обновляют, поэтому раз в sync_interval комнаты истекают запросом по всей БД
+    (Room.expire_rooms без кодов), а реестр перечитывается. Истечение - условный UPDATE,
+    поэтому несколько процессов могут истекать одни и те же комнаты: ставка вернется один раз.
+    """
+
+    def __init__(self, retry_delay: float = ROOM_EXPIRY_RETRY_DELAY,
+                 sync_interval: float = ROOM_SYNC_INTERVAL):
+        self.retry_delay = retry_delay
+        self.sync_interval = sync_interval
+        self.next_sync = 0.0  # loop.time() следующей сверки с БД
+        self.rooms: Dict[str, Room] = {}
+        self.deadlines: List[Tuple[datetime, str]] = []  # Записи закрытых комнат удаляются лениво
+        self.changed = asyncio.Event()  # Появился более ранний срок - пересчитать сон
+        self.task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.batches = 0
+        self.syncs = 0
+
+    async def start(self):
+        """Загрузить открытые комнаты и запустить таймер истечения"""
+        if self.task is not None:
+            return
+
+        await self.sync()
+        self.task = asyncio.create_task(self._expiry_loop())
+        logger.info(f"🚀 Room registry started, open rooms: {len(self.rooms)}")
+
+    async def stop(self):
+        """Остановить таймер"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            logger.info("🛑 Room registry stopped")
+
+    async def load(self):
+        """Перечитать ожидающие комнаты из БД"""
+        rooms = await Room.get_waiting_rooms()
+        self.rooms = {room.room_code: room for room in rooms}
+        self.deadlines = [(room.expires_at, room.room_code) for room in rooms]
+        heapq.heapify(self.deadlines)
+        self.changed.set()
+
+    async def sync(self):
+        """Истечь просроченные комнаты всех процессов в БД и перечитать реестр"""
+        expired = await Room.expire_rooms()
+        if expired:
+            self.expired += len(expired)
+            self.batches += 1
+        await self.load()
+        self.syncs += 1
+        self.next_sync = asyncio.get_running_loop().time() + self.sync_interval
+
+    def add(self, room: Room):
+        """Зарегистрировать созданную комнату"""
+        self.rooms[room.room_code] = room
+        heapq.heappush(self.deadlines, (room.expires_at, room.room_code))
+        self.changed.set()
+
+    def discard(self, room_code: str):
+        """Убрать комнату, к которой присоединились или которую закрыли"""
+        self.rooms.pop(room_code, None)
+
+    def get_active_rooms(self, limit: int = 20) -> List[Room]:
+        """Непросроченные ожидающие комнаты, новые первыми (как Room.get_active_rooms)"""
+        now = datetime.utcnow()
+        rooms = [room for room in self.rooms.values() if room.expires_at > now]
+        rooms.sort(key=lambda room: room.created_at, reverse=True)
+        return rooms[:limit]
+
+    async def _expiry_loop(self):
+        """Спать до ближайшего срока или сверки с БД и выполнить наступившее"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                sync_delay = self.next_sync - loop.time()
+                if sync_delay <= 0:
+                    await self.sync()
+                    continue
+
+                delay = self._next_delay()
+                if delay is not None and delay <= 0:
+                    await self.expire_due()
+                    continue
+
+                self.changed.clear()
+                try:
+                    # Добавилась комната - пересчитываем ближайший срок
+                    timeout = sync_delay if delay is None else min(delay, sync_delay)
+                    await asyncio.wait_for(self.changed.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in room expiry loop: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    def _next_delay(self) -> Optional[float]:
+        """Секунд до ближайшего срока (None - комнат нет, ждем добавления)"""
+        while self.deadlines:
+            expires_at, room_code = self.deadlines[0]
+            room = self.rooms.get(room_code)
+            if room is None or room.expires_at != expires_at:
+                heapq.heappop(self.deadlines)  # Комната уже закрыта
+                continue
+            return max((expires_at - datetime.utcnow()).total_seconds(), 0)
+        return None
+
+    async def expire_due(self) -> int:
+        """Истечь все комнаты с наступившим сроком одной пачкой"""
+        now = datetime.utcnow()
+        due = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, room_code = heapq.heappop(self.deadlines)
+            if room_code in self.rooms:
+                due.append(room_code)
+        if not due:
+            return 0
+
+        try:
+            expired = await Room.expire_rooms(due)
+        except Exception:
+            # Вернем сроки в кучу - попробуем снова через retry_delay
+            for room_code in due:
+                room = self.rooms.get(room_code)
+                if room is not None:  # Пока ждали БД, комнату могли закрыть или перечитать реестр
+                    heapq.heappush(self.deadlines, (room.expires_at, room_code))
+            raise
+
+        # Комнаты, которые не истекли, уже заняты или закрыты в БД - из реестра убираем все
+        for room_code in due:
+            self.rooms.pop(room_code, None)
+        self.expired += len(expired)
+        self.batches += 1
+        return len(expired)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние реестра для админки"""
+        return {
+            "running": self.task is not None,
+            "open_rooms": len(self.rooms),
+            "timers": len(self.deadlines),
+            "expired": self.expired,
+            "batches": self.batches,
+            "syncs": self.syncs
+        }
+
+
+# Глобальный экземпляр сервиса
+room_registry = RoomRegistry()
+
+
+async def start_room_registry():
+    """Загрузить комнаты и запустить таймер истечения"""
+    await room_registry.start()
+
+
+async def stop_room_registry():
+    """Остановить таймер истечения комнат"""
+    await room_registry.stop()
@@ -3,7 +3,7 @@
 """
 import asyncio
 from decimal import Decimal
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 
 from solders.pubkey import Pubkey
 from solders.keypair import Keypair
@@ -11,6 +11,7 @@ from solders.transaction import Transaction
 from solders.system_program import TransferParams, transfer
 from solana.rpc.async_api import AsyncClient
 from solana.rpc.commitment import Confirmed
+from solana.rpc.core import RPCException, RPCNoResultException
 from solana.rpc.types import TxOpts
 
 # SPL Token imports
@@ -26,6 +27,74 @@ from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Максимальный размер сериализованной транзакции Solana (байт)
+PACKET_DATA_SIZE = 1232
+
+# Проверка статуса транзакции, ответ на отправку которой потерян (таймаут, обрыв соединения)
+SIGNATURE_POLL_INTERVAL = 2  # секунд
+SIGNATURE_WAIT_TIMEOUT = 120  # секунд, дольше живет blockhash транзакции
+
+# SPL Token Program
+TOKEN_PROGRAM_ID = Pubkey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
+
+
+def _shortvec_size(value: int) -> int:
+    """Размер длины в формате compact-u16 (short_vec)"""
+    return 1 if value < 0x80 else 2 if value < 0x4000 else 3
+
+
+class _TransactionSize:
+    """Размер legacy-транзакции с одной подписью плательщика, считается по мере добавления инструкций"""
+
+    def __init__(self, payer: Pubkey):
+        self.payer = payer
+        self.accounts = {payer}
+        self.instructions = 0
+        self.instructions_size = 0
+
+    @staticmethod
+    def _instruction_size(ix) -> int:
+        """Программа (индекс) + индексы аккаунтов + данные"""
+        return (1 + _shortvec_size(len(ix.accounts)) + len(ix.accounts)
+                + _shortvec_size(len(ix.data)) + len(ix.data))
+
+    @staticmethod
+    def _instruction_accounts(ix) -> set:
+        return {meta.pubkey for meta in ix.accounts} | {ix.program_id}
+
+    @staticmethod
+    def _size(accounts: int, instructions: int, instructions_size: int) -> int:
+        """Подписи + заголовок сообщения + ключи + blockhash + инструкции"""
+        return (_shortvec_size(1) + 64 + 3 + _shortvec_size(accounts) + 32 * accounts + 32
+                + _shortvec_size(instructions) + instructions_size)
+
+    def size_with(self, instructions: list) -> int:
+        """Размер транзакции, если добавить инструкции (сама транзакция не меняется)"""
+        new_accounts = set()
+        for ix in instructions:
+            new_accounts |= self._instruction_accounts(ix)
+        return self._size(
+            len(self.accounts) + len(new_accounts - self.accounts),
+            self.instructions + len(instructions),
+            self.instructions_size + sum(self._instruction_size(ix) for ix in instructions)
+        )
+
+    def add(self, instructions: list):
+        """Добавить инструкции"""
+        for ix in instructions:
+            self.accounts |= self._instruction_accounts(ix)
+            self.instructions_size += self._instruction_size(ix)
+        self.instructions += len(instructions)
+
+
+class UnconfirmedSignature(str):
+    """Подпись транзакции, ушедшей в сеть без подтверждения: судьба выплаты неизвестна, повторять нельзя"""
+
+
+# Сохранить подпись (индексы получателей, подпись, last_valid_block_height) до отправки;
+# False - транзакцию не отправлять
+OnSigned = Callable[[List[int], str, int], Awaitable[bool]]
+
 
 def validate_solana_address(address: str) -> bool:
     """Валидация Solana адреса"""
@@ -45,6 +114,7 @@ class SolanaService:
         self.bot_pubkey = None
         self.mori_mint = None
         self.token_decimals = 6  # Большинство SPL токенов используют 6 decimals
+        self.decimals_cache: Dict[str, int] = {}  # {mint: decimals}, decimals у mint не меняются
 
         # Инициализируем кошелек бота
         self._init_bot_wallet()
@@ -154,6 +224,14 @@ class SolanaService:
             logger.warning(f"⚠️ Could not get decimals for {token_mint}, using default 6: {e}")
             return 6
 
+    async def get_cached_token_decimals(self, token_mint: str) -> int:
+        """Decimals токена с кешем (без RPC вызова на каждую отправку)"""
+        decimals = self.decimals_cache.get(token_mint)
+        if decimals is None:
+            decimals = await self.get_token_decimals(token_mint)
+            self.decimals_cache[token_mint] = decimals
+        return decimals
+
     async def send_sol(self, to_address: str, amount: Decimal) -> Optional[str]:
         """Отправить SOL"""
         try:
@@ -211,7 +289,7 @@ class SolanaService:
             to_pubkey = Pubkey.from_string(to_address)
 
             # Получаем decimals токена
-            decimals = await self.get_token_decimals(str(mint_pubkey))
+            decimals = await self.get_cached_token_decimals(str(mint_pubkey))
 
             # Конвертируем amount с учетом decimals
             token_amount = int(amount * Decimal(10 ** decimals))
@@ -237,7 +315,7 @@ class SolanaService:
             # Создаем инструкцию transfer
             transfer_ix = transfer_checked(
                 TransferCheckedParams(
-                    program_id=Pubkey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"),  # SPL Token Program
+                    program_id=TOKEN_PROGRAM_ID,
                     source=from_ata,
                     mint=mint_pubkey,
                     dest=to_ata,
@@ -276,6 +354,222 @@ class SolanaService:
             logger.error(f"❌ Error sending tokens to {to_address}: {e}")
             return None
 
+    async def send_token_batch(self, payouts: List[Tuple[str, Decimal]],
+                               token_mint: str = None, on_signed: Optional[OnSigned] = None) -> List[Optional[str]]:
+        """Отправить SPL токены нескольким получателям.
+
+        Переводы (и создание недостающих ATA) упаковываются в минимум транзакций,
+        укладывающихся в PACKET_DATA_SIZE. Невалидные адреса отсеиваются до отправки.
+        Транзакция, отклоненная нодой (preflight), делится пополам и отправляется заново;
+        если ответ на отправку потерян, повтора нет, пока не ясно, что транзакция не попала в блок.
+        on_signed получает подпись каждой транзакции до отправки, чтобы ее судьбу можно было проверить
+        после падения процесса.
+        Возвращает хеш транзакции для каждого получателя: None - не отправлено,
+        UnconfirmedSignature - отправлено, но попадание в блок не подтверждено.
+        """
+        results: List[Optional[str]] = [None] * len(payouts)
+        if not payouts:
+            return results
+
+        try:
+            if not self.bot_keypair:
+                logger.error("❌ Bot keypair not initialized")
+                return results
+
+            mint_pubkey = Pubkey.from_string(token_mint or str(self.mori_mint))
+            decimals = await self.get_cached_token_decimals(str(mint_pubkey))
+            from_ata = get_associated_token_address(self.bot_pubkey, mint_pubkey)
+
+            # Невалидный адрес не должен ронять транзакцию с остальными получателями
+            valid = []
+            for index, (address, amount) in enumerate(payouts):
+                if not validate_solana_address(address) or amount <= 0:
+                    logger.warning(f"⚠️ Skipping payout {index}: invalid address {address} or amount {amount}")
+                    continue
+                owner = Pubkey.from_string(address)
+                valid.append((index, amount, owner, get_associated_token_address(owner, mint_pubkey)))
+
+            existing = await self._get_existing_accounts([ata for _, _, _, ata in valid])
+
+            # Инструкции для каждого получателя; ATA создается один раз на батч
+            recipients = []
+            creating = set()
+            for index, amount, owner, ata in valid:
+                instructions = []
+                if ata not in existing and ata not in creating:
+                    instructions.append(create_associated_token_account(
+                        payer=self.bot_pubkey,
+                        owner=owner,
+                        mint=mint_pubkey
+                    ))
+                    creating.add(ata)
+
+                instructions.append(transfer_checked(
+                    TransferCheckedParams(
+                        program_id=TOKEN_PROGRAM_ID,
+                        source=from_ata,
+                        mint=mint_pubkey,
+                        dest=ata,
+                        owner=self.bot_pubkey,
+                        amount=int(amount * Decimal(10 ** decimals)),
+                        decimals=decimals
+                    )
+                ))
+                recipients.append((index, instructions))
+
+            # Один blockhash на весь батч
+            latest = (await self.client.get_latest_blockhash()).value
+
+            for chunk in self._pack_recipients(recipients):
+                await self._send_chunk(chunk, latest, results, on_signed)
+
+            sent = sum(1 for tx_hash in results if tx_hash and not isinstance(tx_hash, UnconfirmedSignature))
+            logger.info(f"✅ Batch payout: {sent}/{len(payouts)} recipients sent")
+            return results
+
+        except Exception as e:
+            logger.error(f"❌ Error sending token batch: {e}")
+            return results
+
+    async def _get_existing_accounts(self, accounts: List[Pubkey]) -> set:
+        """Какие из аккаунтов уже существуют (до 100 за один RPC вызов)"""
+        existing = set()
+        unique = list(dict.fromkeys(accounts))
+        for start in range(0, len(unique), 100):
+            chunk = unique[start:start + 100]
+            response = await self.client.get_multiple_accounts(chunk)
+            for account, info in zip(chunk, response.value):
+                if info is not None:
+                    existing.add(account)
+        return existing
+
+    def _build_signed_transaction(self, instructions: list, recent_blockhash) -> Transaction:
+        """Собрать и подписать транзакцию"""
+        return Transaction.new_signed_with_payer(
+            instructions,
+            self.bot_pubkey,
+            [self.bot_keypair],
+            recent_blockhash
+        )
+
+    def _pack_recipients(self, recipients: list) -> List[list]:
+        """Разложить получателей по транзакциям не больше PACKET_DATA_SIZE (размер считается инкрементально)"""
+        chunks = []
+        current = []
+        size = _TransactionSize(self.bot_pubkey)
+        for recipient in recipients:
+            _, instructions = recipient
+            if current and size.size_with(instructions) > PACKET_DATA_SIZE:
+                chunks.append(current)
+                current = []
+                size = _TransactionSize(self.bot_pubkey)
+            current.append(recipient)
+            size.add(instructions)
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _send_chunk(self, chunk: list, latest, results: List[Optional[str]],
+                          on_signed: Optional[OnSigned] = None):
+        """Отправить транзакцию с частью получателей; отклоненную нодой - поделить пополам"""
+        instructions = [ix for _, recipient_ixs in chunk for ix in recipient_ixs]
+        transaction = self._build_signed_transaction(instructions, latest.blockhash)
+        signature = transaction.signatures[0]
+
+        if len(bytes(transaction)) > PACKET_DATA_SIZE and len(chunk) > 1:
+            await self._split_chunk(chunk, latest, results, on_signed)
+            return
+
+        if on_signed is not None:
+            try:
+                recorded = await on_signed([index for index, _ in chunk], str(signature),
+                                           latest.last_valid_block_height)
+            except Exception as e:
+                logger.error(f"❌ Error recording signature {signature}: {e}")
+                recorded = False
+            if not recorded:
+                # Без сохраненной подписи потерянный ответ не проверить - не отправляем
+                logger.warning(f"⚠️ Signature {signature} not recorded, {len(chunk)} recipients left for retry")
+                return
+
+        try:
+            result = await self.client.send_transaction(
+                transaction,
+                opts=TxOpts(skip_preflight=False)  # Preflight отсеивает транзакции, которые не пройдут
+            )
+            tx_hash = str(result.value) if result.value else None
+        except (RPCException, RPCNoResultException) as e:
+            # Нода отклонила транзакцию (симуляция, размер, аккаунты) - в сеть она не ушла, делить безопасно
+            logger.warning(f"⚠️ Batch transaction with {len(chunk)} recipients rejected: {e}")
+            tx_hash = None
+        except Exception as e:
+            # Таймаут или обрыв: транзакция могла уйти в сеть, повторная отправка - двойная выплата
+            logger.warning(f"⚠️ Batch transaction {signature} with {len(chunk)} recipients: no response ({e}), checking status")
+            landed = await self._wait_signature(signature, latest.last_valid_block_height)
+            if landed is None:
+                logger.error(f"❌ Batch transaction {signature} status unknown, recipients left for reconciliation")
+                for index, _ in chunk:
+                    results[index] = UnconfirmedSignature(signature)
+                return
+            if not landed:
+                return  # Не попала в блок и уже не попадет - outbox повторит выплаты
+            tx_hash = str(signature)
+
+        if tx_hash:
+            for index, _ in chunk:
+                results[index] = tx_hash
+            return
+
+        if len(chunk) > 1:
+            await self._split_chunk(chunk, latest, results, on_signed)
+
+    async def _split_chunk(self, chunk: list, latest, results: List[Optional[str]],
+                           on_signed: Optional[OnSigned] = None):
+        """Отправить половины чанка отдельными транзакциями"""
+        middle = len(chunk) // 2
+        await self._send_chunk(chunk[:middle], latest, results, on_signed)
+        await self._send_chunk(chunk[middle:], latest, results, on_signed)
+
+    async def _wait_signature(self, signature, last_valid_block_height: int) -> Optional[bool]:
+        """Дождаться судьбы отправленной транзакции.
+
+        True - попала в блок без ошибки, False - не попала и уже не попадет (blockhash истек)
+        или выполнилась с ошибкой, None - статус узнать не удалось.
+        """
+        deadline = asyncio.get_running_loop().time() + SIGNATURE_WAIT_TIMEOUT
+        while asyncio.get_running_loop().time() < deadline:
+            landed = await self.get_signature_outcome(signature, last_valid_block_height)
+            if landed is not None:
+                return landed
+            await asyncio.sleep(SIGNATURE_POLL_INTERVAL)
+        return None
+
+    async def get_signature_outcome(self, signature, last_valid_block_height: int) -> Optional[bool]:
+        """Однократная проверка отправленной транзакции.
+
+        True - попала в блок без ошибки, False - не попала и уже не попадет или выполнилась с ошибкой,
+        None - еще может попасть в блок или статус узнать не удалось.
+        """
+        try:
+            if isinstance(signature, str):
+                from solders.signature import Signature
+                signature = Signature.from_string(signature)
+
+            statuses = await self.client.get_signature_statuses([signature], search_transaction_history=True)
+            status = statuses.value[0]
+            if status is not None:
+                return status.err is None
+
+            block_height = (await self.client.get_block_height()).value
+            if block_height > last_valid_block_height:
+                # Блокхеш истек, но транзакция могла попасть в блок перед этим - проверяем еще раз
+                statuses = await self.client.get_signature_statuses([signature], search_transaction_history=True)
+                status = statuses.value[0]
+                return status is not None and status.err is None
+        except Exception as e:
+            logger.warning(f"⚠️ Error checking transaction {signature}: {e}")
+        return None
+
     async def check_transaction(self, tx_hash: str) -> Optional[Dict[str, Any]]:
         """Проверить статус транзакции"""
         try:
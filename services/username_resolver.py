@@ -0,0 +1,93 @@
+"""
+Имена пользователей для экранов: один запрос на все id экрана и кэш с TTL
+"""
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import BigInteger, bindparam, select, any_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import read_scope
+from database.models.user import User
+from config.settings import USERNAME_CACHE_SIZE, USERNAME_CACHE_TTL
+from utils.logger import setup_logger
+from utils.ttl_cache import TTLCache
+
+logger = setup_logger(__name__)
+
+
+class UsernameResolver:
+    """Собирает имена для списка telegram_id одним запросом WHERE telegram_id = ANY(:ids).
+
+    Найденные имена кэшируются на USERNAME_CACHE_TTL, пользователи, которых нет в БД,
+    не кэшируются - после регистрации имя появится сразу. Код, записывающий User.username,
+    сбрасывает имя через invalidate; переименования, которых бот еще не видел, живут не дольше TTL.
+    """
+
+    def __init__(self, cache_size: int = USERNAME_CACHE_SIZE, ttl: float = USERNAME_CACHE_TTL):
+        self.cache = TTLCache(cache_size, ttl)  # {telegram_id: (username,)}
+
+    async def resolve_many(self, telegram_ids: Iterable[int],
+                           session: Optional[AsyncSession] = None) -> Dict[int, Optional[str]]:
+        """Имена пользователей {telegram_id: username или None}"""
+        names: Dict[int, Optional[str]] = {}
+        missing = []
+        for telegram_id in dict.fromkeys(telegram_ids):  # Без повторов, в исходном порядке
+            cached = self.cache.get(telegram_id)
+            if cached is None:
+                missing.append(telegram_id)
+            else:
+                names[telegram_id] = cached[0]
+
+        if missing:
+            try:
+                async with read_scope(session) as session:
+                    result = await session.execute(
+                        select(User.telegram_id, User.username).where(self._id_filter(session, missing))
+                    )
+                    self.cache.count("queries")
+                    for telegram_id, username in result:
+                        names[telegram_id] = username
+                        self.cache.set(telegram_id, (username,))
+            except Exception as e:
+                logger.error(f"❌ Error resolving usernames for {len(missing)} users: {e}")
+
+        return names
+
+    async def resolve(self, telegram_id: int, session: Optional[AsyncSession] = None) -> Optional[str]:
+        """Имя одного пользователя или None"""
+        return (await self.resolve_many([telegram_id], session=session)).get(telegram_id)
+
+    async def display_names(self, telegram_ids: Iterable[int], fallback: str = "Player",
+                            session: Optional[AsyncSession] = None) -> Dict[int, str]:
+        """Подписи для экрана: username или "Player 123" для пользователей без имени"""
+        telegram_ids = list(telegram_ids)
+        names = await self.resolve_many(telegram_ids, session=session)
+        return {
+            telegram_id: names.get(telegram_id) or f"{fallback} {telegram_id}"
+            for telegram_id in telegram_ids
+        }
+
+    async def display_name(self, telegram_id: int, fallback: str = "Player",
+                           session: Optional[AsyncSession] = None) -> str:
+        """Подпись одного пользователя для экрана"""
+        return (await self.display_names([telegram_id], fallback, session=session))[telegram_id]
+
+    @staticmethod
+    def _id_filter(session: AsyncSession, telegram_ids: list):
+        """На PostgreSQL - один массив-параметр (один prepared statement на любое число id), иначе IN"""
+        if session.bind.dialect.name == "postgresql":
+            return User.telegram_id == any_(bindparam("ids", telegram_ids, type_=ARRAY(BigInteger)))
+        return User.telegram_id.in_(telegram_ids)
+
+    def invalidate(self, telegram_id: int):
+        """Сбросить имя пользователя из кэша (username изменился)"""
+        self.cache.invalidate(telegram_id)
+
+    def get_stats(self) -> Dict:
+        """Метрики кэша имен для админки"""
+        return self.cache.get_stats()
+
+
+# Глобальный экземпляр сервиса
+username_resolver = UsernameResolver()
@@ -0,0 +1,14 @@
+"""
+Общие настройки тестов: отдельная SQLite база на запуск
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Настройки читаются при импорте config.settings - задаем окружение до импорта моделей
+_db_dir = tempfile.mkdtemp(prefix="mori_duels_tests_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_db_dir) / 'test.db'}"
+os.environ.setdefault("MAIN_BOT_TOKEN", "123456:test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+"""
+Unit of work апдейта: ошибка хендлера после движения денег
+"""
+import asyncio
+from decimal import Decimal
+from itertools import count
+
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from bots.handlers import game
+from bots.middlewares.db_session import DbSessionMiddleware
+from database.connection import init_db
+from database.models.user import User
+
+_telegram_ids = count(1000)
+
+
+async def _create_user(balance: Decimal) -> int:
+    await init_db()
+    telegram_id = next(_telegram_ids)
+    await User.create_user(telegram_id, "w" * 32, username=f"user{telegram_id}")
+    await User.credit_balance(telegram_id, balance)
+    return telegram_id
+
+
+def _registered_handler(router, callback) -> HandlerObject:
+    """Хендлер с флагами, как его зарегистрировал роутер"""
+    for observer in (router.callback_query, router.message):
+        for handler in observer.handlers:
+            if handler.callback is callback:
+                return handler
+    raise LookupError(callback)
+
+
+async def _credit_then_fail(telegram_id: int, handler: HandlerObject):
+    """Прогнать через middleware хендлер, который зачисляет и падает на отправке сообщения"""
+    async def failing_handler(event, data):
+        await User.credit_balance(telegram_id, Decimal(10), reason="search_cancel")
+        raise RuntimeError("Telegram API error")
+
+    try:
+        await DbSessionMiddleware()(failing_handler, object(), {"handler": handler})
+    except RuntimeError:
+        pass
+    return (await User.get_by_telegram_id(telegram_id, fresh=True)).balance
+
+
+def test_money_handler_keeps_credit_when_telegram_fails():
+    async def scenario():
+        telegram_id = await _create_user(Decimal(100))
+        handler = _registered_handler(game.router, game.cancel_search)
+        return await _credit_then_fail(telegram_id, handler)
+
+    assert asyncio.run(scenario()) == Decimal(110)
+
+
+def test_unit_of_work_handler_rolls_back_on_error():
+    async def scenario():
+        telegram_id = await _create_user(Decimal(100))
+        handler = HandlerObject(callback=lambda event: None)
+        return await _credit_then_fail(telegram_id, handler)
+
+    assert asyncio.run(scenario()) == Decimal(100)
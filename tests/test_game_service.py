@@ -0,0 +1,80 @@
+"""
+Поиск игры: отмена и возврат ставки
+"""
+import asyncio
+from decimal import Decimal
+from itertools import count
+
+import pytest
+
+from database.connection import init_db
+from database.models.user import User
+from services.game_service import GameService, SearchRefundFailed
+from services import game_service as game_service_module
+from services.matchmaking_service import InMemoryMatchmakingBackend
+
+_telegram_ids = count(2000)
+
+
+async def _create_user(balance: Decimal) -> int:
+    await init_db()
+    telegram_id = next(_telegram_ids)
+    await User.create_user(telegram_id, "w" * 32, username=f"user{telegram_id}")
+    await User.credit_balance(telegram_id, balance)
+    return telegram_id
+
+
+async def _balance(telegram_id: int) -> Decimal:
+    return (await User.get_by_telegram_id(telegram_id, fresh=True)).balance
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """Сервис игры с отдельной очередью в памяти"""
+    monkeypatch.setattr(game_service_module, "matchmaking_service", InMemoryMatchmakingBackend())
+    return GameService()
+
+
+async def _start_search(service: GameService, telegram_id: int, stake: Decimal) -> asyncio.Task:
+    search = asyncio.create_task(service.quick_match(telegram_id, stake))
+    while telegram_id not in service.search_tickets:
+        await asyncio.sleep(0.01)
+    return search
+
+
+def test_cancel_keeps_ticket_when_refund_fails(service, monkeypatch):
+    async def scenario():
+        telegram_id = await _create_user(Decimal(100))
+        search = await _start_search(service, telegram_id, Decimal(10))
+
+        async def failing_credit(*args, **kwargs):
+            return None
+
+        with monkeypatch.context() as patch:
+            patch.setattr(User, "credit_balance", failing_credit)
+            with pytest.raises(SearchRefundFailed):
+                await service.cancel_search(telegram_id)
+
+        # Заявка осталась в очереди, повторная отмена возвращает ставку
+        assert service.search_tickets[telegram_id].is_waiting()
+        assert await service.cancel_search(telegram_id) is True
+        assert await search == {"cancelled": True}
+        return await _balance(telegram_id)
+
+    assert asyncio.run(scenario()) == Decimal(100)
+
+
+def test_search_refunds_stake_when_enqueue_fails(service, monkeypatch):
+    async def failing_enqueue(*args, **kwargs):
+        raise RuntimeError("queue unavailable")
+
+    monkeypatch.setattr(game_service_module.matchmaking_service, "enqueue", failing_enqueue)
+
+    async def scenario():
+        telegram_id = await _create_user(Decimal(100))
+        result = await service.quick_match(telegram_id, Decimal(10))
+        return result, await _balance(telegram_id)
+
+    result, balance = asyncio.run(scenario())
+    assert result == {"error": "Внутренняя ошибка"}
+    assert balance == Decimal(100)
@@ -0,0 +1,125 @@
+"""
+Выплаты: транзакция с неизвестной судьбой не повторяется и не возвращается на баланс
+"""
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import count
+
+from sqlalchemy import insert, select, update
+
+from database.connection import async_session, init_db
+from database.models.payout_outbox import PayoutOutbox, PayoutStatus
+from database.models.transaction import Transaction, TransactionType
+from database.models.user import User
+from services import payout_service as payout_service_module
+from services.payout_service import PayoutService
+from services.solana_service import UnconfirmedSignature
+
+_telegram_ids = count(3000)
+
+SIGNATURE = "5" * 88
+
+
+async def _create_payout(attempts: int) -> int:
+    """Пользователь с балансом 100 и выплатой 10, забранной воркером"""
+    await init_db()
+    telegram_id = next(_telegram_ids)
+    user = await User.create_user(telegram_id, "w" * 32, username=f"user{telegram_id}")
+    await User.credit_balance(telegram_id, Decimal(100))
+    transaction = await Transaction.create_transaction(user.id, TransactionType.DUEL_WIN, Decimal(10))
+    async with async_session() as session:
+        await session.execute(
+            insert(PayoutOutbox).values(
+                transaction_id=transaction.id, telegram_id=telegram_id,
+                wallet_address="w" * 32, amount=Decimal(10), attempts=attempts - 1
+            )
+        )
+        await session.commit()
+    return telegram_id
+
+
+async def _state(telegram_id: int):
+    async with async_session() as session:
+        payout = await session.scalar(select(PayoutOutbox).where(PayoutOutbox.telegram_id == telegram_id))
+    balance = (await User.get_by_telegram_id(telegram_id, fresh=True)).balance
+    return payout.status, payout.signature, balance
+
+
+def _lost_response(monkeypatch):
+    """Подпись записывается, транзакция уходит, ответ теряется"""
+    async def send_token_batch(payouts, token_mint=None, on_signed=None):
+        assert await on_signed(list(range(len(payouts))), SIGNATURE, 1000)
+        return [UnconfirmedSignature(SIGNATURE)] * len(payouts)
+
+    monkeypatch.setattr(payout_service_module.solana_service, "send_token_batch", send_token_batch)
+
+
+def _signature_outcome(monkeypatch, landed):
+    async def get_signature_outcome(signature, last_valid_block_height):
+        return landed
+
+    monkeypatch.setattr(payout_service_module.solana_service, "get_signature_outcome", get_signature_outcome)
+
+
+def test_unknown_status_waits_for_reconciliation(monkeypatch):
+    _lost_response(monkeypatch)
+    service = PayoutService(workers=1)
+
+    async def scenario():
+        # Последняя попытка: раньше неизвестный статус зачислял выигрыш на баланс
+        telegram_id = await _create_payout(attempts=payout_service_module.PAYOUT_MAX_ATTEMPTS)
+        await service._process_batch(await PayoutOutbox.claim_batch(limit=10))
+        waiting = await _state(telegram_id)
+
+        _signature_outcome(monkeypatch, None)
+        await service.reconcile()
+        still_waiting = await _state(telegram_id)
+
+        _signature_outcome(monkeypatch, True)
+        await service.reconcile()
+        return waiting, still_waiting, await _state(telegram_id)
+
+    waiting, still_waiting, confirmed = asyncio.run(scenario())
+    assert waiting == (PayoutStatus.RECONCILE.value, SIGNATURE, Decimal(100))
+    assert still_waiting == waiting
+    assert confirmed == (PayoutStatus.SENT.value, SIGNATURE, Decimal(100))
+
+
+def test_dropped_transaction_is_retried_after_reconciliation(monkeypatch):
+    _lost_response(monkeypatch)
+    _signature_outcome(monkeypatch, False)
+    service = PayoutService(workers=1)
+
+    async def scenario():
+        telegram_id = await _create_payout(attempts=1)
+        await service._process_batch(await PayoutOutbox.claim_batch(limit=10))
+        await service.reconcile()
+        return await _state(telegram_id)
+
+    assert asyncio.run(scenario()) == (PayoutStatus.PENDING.value, None, Decimal(100))
+
+
+def test_recovery_checks_recorded_signature(monkeypatch):
+    async def failing_mark_sent(*args, **kwargs):
+        return False
+
+    _lost_response(monkeypatch)
+    monkeypatch.setattr(PayoutOutbox, "mark_sent", failing_mark_sent)
+    monkeypatch.setattr(PayoutOutbox, "mark_reconcile", failing_mark_sent)
+
+    async def scenario():
+        # Отправка прошла, но записать результат не удалось - строка осталась в processing
+        telegram_id = await _create_payout(attempts=1)
+        payouts = await PayoutOutbox.claim_batch(limit=10)
+        await PayoutOutbox.record_signature([payouts[0]["id"]], SIGNATURE, 1000)
+        await PayoutService(workers=1)._finish_payout(payouts[0], SIGNATURE, "")
+
+        async with async_session() as session:
+            await session.execute(
+                update(PayoutOutbox).where(PayoutOutbox.id == payouts[0]["id"]).values(locked_at=datetime.utcnow() - timedelta(hours=1))
+            )
+            await session.commit()
+        return await PayoutOutbox.recover_stale(60), await _state(telegram_id)
+
+    assert asyncio.run(scenario()) == (1, (PayoutStatus.RECONCILE.value, SIGNATURE, Decimal(100)))
@@ -0,0 +1,22 @@
+"""
+Реестр горячих ORM-запросов проверки планов
+"""
+import re
+from pathlib import Path
+
+from scripts.check_query_plans import ROOT, hot_queries, compile_statement
+
+
+def test_hot_queries_compile_for_postgresql():
+    for location, statement in hot_queries().items():
+        sql = compile_statement(statement)
+        # Позиционные параметры без именованных - EXPLAIN GENERIC_PLAN их принимает
+        assert "$1" in sql, location
+        assert not re.search(r"(?<!:):[A-Za-z_]", sql), location
+
+
+def test_hot_queries_point_to_existing_functions():
+    for location in hot_queries():
+        path, function = location.split(":")
+        function = function.split("(")[0]
+        assert f"def {function}(" in Path(ROOT, path).read_text(encoding="utf-8"), location
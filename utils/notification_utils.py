@@ -111,15 +111,15 @@ async def safe_notify_user_about_deposit(bot: Bot, user, amount, tx_hash):
 async def safe_notify_opponent(bot: Bot, opponent_id: int, result: dict, current_user_id: int):
     """Безопасное уведомление оппонента о результате"""
     try:
-        from database.models.user import User
+        from services.username_resolver import username_resolver
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
         opponent_won = (result["winner_id"] == opponent_id)
         coin_emoji = "🟡" if result["coin_result"] == "heads" else "⚪"
         coin_text = "ОРЕЛ" if result["coin_result"] == "heads" else "РЕШКА"
 
-        current_user = await User.get_by_telegram_id(current_user_id)
-        current_user_name = f"@{current_user.username}" if current_user and current_user.username else f"Player {current_user_id}"
+        current_username = await username_resolver.resolve(current_user_id)
+        current_user_name = f"@{current_username}" if current_username else f"Player {current_user_id}"
 
         if opponent_won:
             message_text = f"""🎉 ПОБЕДА! 🎉
@@ -128,7 +128,7 @@ async def safe_notify_opponent(bot: Bot, opponent_id: int, result: dict, current
 {coin_emoji} Выпал: {coin_text}
 🏆 Вы выиграли: {result['winner_amount']:,.2f} MORI
 
-💰 Средства отправлены на ваш кошелек!"""
+💰 Выплата поставлена в очередь и скоро придет на ваш кошелек"""
         else:
             message_text = f"""💔 Поражение
 
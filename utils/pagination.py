@@ -0,0 +1,93 @@
+"""
+Keyset-пагинация истории: курсор (время, id) вместо OFFSET
+"""
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import Select, tuple_
+
+EPOCH = datetime(1970, 1, 1)
+
+# Курсор: время и id последней показанной строки
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(at: datetime, row_id: int) -> str:
+    """Упаковать курсор в короткую строку для callback_data (лимит 64 байта)"""
+    micros = (at - EPOCH) // timedelta(microseconds=1)
+    return f"{_to_base36(micros)}.{_to_base36(row_id)}"
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Распаковать курсор из callback_data"""
+    micros, row_id = cursor.split(".")
+    return EPOCH + timedelta(microseconds=int(micros, 36)), int(row_id, 36)
+
+
+def _to_base36(number: int) -> str:
+    """Число в base36 (int(value, 36) - обратное преобразование)"""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if not number:
+            return result
+
+
+class Page:
+    """Страница истории (от новых к старым) и признаки соседних страниц"""
+
+    def __init__(self, items: List[Any], has_older: bool, has_newer: bool, key: Callable[[Any], Cursor]):
+        self.items = items
+        self.has_older = has_older
+        self.has_newer = has_newer
+        self.key = key
+
+    @property
+    def older_cursor(self) -> Optional[str]:
+        """Курсор следующей (более старой) страницы"""
+        return encode_cursor(*self.key(self.items[-1])) if self.items and self.has_older else None
+
+    @property
+    def newer_cursor(self) -> Optional[str]:
+        """Курсор предыдущей (более новой) страницы"""
+        return encode_cursor(*self.key(self.items[0])) if self.items and self.has_newer else None
+
+
+def seek(stmt: Select, at_column, id_column, cursor: Optional[Cursor], newer: bool, limit: int) -> Select:
+    """Добавить к запросу условие курсора, порядок и LIMIT.
+
+    Запрос читает limit + 1 строку: лишняя показывает, есть ли следующая страница.
+    Порядок совпадает с индексом (..., время, id), поэтому глубина страницы не влияет на стоимость.
+    """
+    if cursor is not None:
+        key = tuple_(at_column, id_column)
+        stmt = stmt.where(key > tuple_(*cursor) if newer else key < tuple_(*cursor))
+
+    if newer:
+        stmt = stmt.order_by(at_column.asc(), id_column.asc())
+    else:
+        stmt = stmt.order_by(at_column.desc(), id_column.desc())
+    return stmt.limit(limit + 1)
+
+
+def make_page(rows: List[Any], limit: int, cursor: Optional[Cursor], newer: bool,
+              key: Callable[[Any], Cursor]) -> Page:
+    """Собрать страницу из результата seek()"""
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    if newer:
+        # Более новые строки читались по возрастанию
+        items.reverse()
+        return Page(items, has_older=True, has_newer=has_more, key=key)
+    return Page(items, has_older=has_more, has_newer=cursor is not None, key=key)
+
+
+def parse_page_data(data: str) -> Tuple[Optional[Cursor], bool]:
+    """Курсор и направление из callback_data вида '<префикс>:<n|p>:<курсор>'"""
+    parts = data.split(":")
+    if len(parts) < 3 or parts[-2] not in ("n", "p"):
+        return None, False
+    return decode_cursor(parts[-1]), parts[-2] == "p"
+
@@ -0,0 +1,62 @@
+"""
+Коды комнат: номер из последовательности -> ключевая перестановка (сеть Фейстеля) -> base36
+"""
+import hashlib
+import hmac
+import string
+
+ALPHABET = string.digits + string.ascii_uppercase
+CODE_LENGTH = 6
+
+# 36^6 = (36^3)^2: номер делится на две равные половины без остатка,
+# поэтому перестановка работает ровно на пространстве кодов и cycle-walking не нужен
+HALF_SPACE = len(ALPHABET) ** (CODE_LENGTH // 2)
+CODE_SPACE = HALF_SPACE * HALF_SPACE
+ROUNDS = 6
+
+
+def _round_value(secret: bytes, round_number: int, half: int) -> int:
+    """Раундовая функция: HMAC-SHA256 от номера раунда и половины"""
+    digest = hmac.new(secret, f"{round_number}:{half}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big") % HALF_SPACE
+
+
+def permute(number: int, secret: bytes) -> int:
+    """Биекция [0, CODE_SPACE) -> [0, CODE_SPACE): разные номера дают разные значения"""
+    if not 0 <= number < CODE_SPACE:
+        raise ValueError(f"Room code number out of range: {number}")
+
+    left, right = divmod(number, HALF_SPACE)
+    for round_number in range(ROUNDS):
+        left, right = right, (left + _round_value(secret, round_number, right)) % HALF_SPACE
+    return left * HALF_SPACE + right
+
+
+def unpermute(value: int, secret: bytes) -> int:
+    """Обратная перестановка: номер по значению"""
+    left, right = divmod(value, HALF_SPACE)
+    for round_number in reversed(range(ROUNDS)):
+        left, right = (right - _round_value(secret, round_number, left)) % HALF_SPACE, left
+    return left * HALF_SPACE + right
+
+
+def encode(value: int) -> str:
+    """Число -> 6 символов base36 (0-9A-Z) с ведущими нулями"""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code: str) -> int:
+    """6 символов base36 -> число"""
+    value = 0
+    for char in code.upper():
+        value = value * len(ALPHABET) + ALPHABET.index(char)
+    return value
+
+
+def room_code(number: int, secret: bytes) -> str:
+    """Код комнаты по ее номеру из последовательности"""
+    return encode(permute(number, secret))
@@ -0,0 +1,71 @@
+"""
+Ограниченный по размеру кэш со временем жизни записей (LRU + TTL)
+"""
+import time
+from collections import OrderedDict, Counter
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Кэш процесса: при переполнении вытесняется давно не читанная запись, устаревшие не отдаются"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # {ключ: (истекает в, значение)}
+        self.counters = Counter()  # hits, misses, expired, evicted, invalidated и счетчики владельца кэша
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение или None, если записи нет или она устарела"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Положить значение (кэш с maxsize <= 0 или ttl <= 0 выключен)"""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def invalidate(self, key: Hashable):
+        """Удалить запись после изменения данных"""
+        if self.entries.pop(key, None) is not None:
+            self.counters["invalidated"] += 1
+
+    def clear(self):
+        """Очистить кэш"""
+        self.entries.clear()
+
+    def count(self, name: str):
+        """Увеличить дополнительный счетчик (например, попадания в кэш апдейта)"""
+        self.counters[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики кэша для админки"""
+        lookups = self.counters["hits"] + self.counters["misses"]
+        stats = {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hit_rate": self.counters["hits"] / lookups * 100 if lookups else 0.0
+        }
+        for name in ("hits", "misses", "expired", "evicted", "invalidated"):
+            stats[name] = self.counters[name]
+        stats.update(self.counters)
+        return stats
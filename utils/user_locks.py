@@ -0,0 +1,98 @@
+"""
+Последовательное выполнение операций с балансом одного пользователя
+"""
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+from config.settings import USER_LOCK_TIMEOUT
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class UserLockTimeout(Exception):
+    """Не удалось дождаться очереди операций пользователя"""
+
+
+class UserLockRegistry:
+    """Реестр блокировок по пользователям.
+
+    Операции одного пользователя идут по очереди, разные пользователи - параллельно.
+    Блокировки хранятся по слабым ссылкам и исчезают, когда их никто не держит и не ждет.
+    """
+
+    def __init__(self, timeout: float = USER_LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        # Метрики ожидания
+        self.acquired_count = 0
+        self.contended_count = 0  # Сколько раз пришлось ждать
+        self.timeout_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits_by_operation: Dict[str, float] = {}
+
+    def _get_lock(self, user_id: int) -> asyncio.Lock:
+        """Блокировка пользователя (создается при первом обращении)"""
+        lock = self.locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[user_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def lock(self, user_id: int, operation: str = "balance", timeout: float = None):
+        """Выполнить блок кода, пока другие операции пользователя ждут"""
+        lock = self._get_lock(user_id)  # Сильная ссылка живет до выхода из блока
+        contended = lock.locked()
+        started = time.monotonic()
+
+        if not contended:
+            # Свободная блокировка берется сразу, без переключения задач
+            await lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                self.timeout_count += 1
+                logger.warning(f"⚠️ User {user_id} lock timeout for {operation}")
+                raise UserLockTimeout(f"User {user_id} is busy")
+
+        waited = time.monotonic() - started
+        self._record_wait(operation, waited, contended)
+
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _record_wait(self, operation: str, waited: float, contended: bool):
+        """Обновить метрики ожидания"""
+        self.acquired_count += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.waits_by_operation[operation] = self.waits_by_operation.get(operation, 0.0) + waited
+        if contended:
+            self.contended_count += 1
+            if waited > 1:
+                logger.warning(f"⚠️ Waited {waited:.2f}s for user lock ({operation})")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики блокировок для админки"""
+        return {
+            "active_locks": len(self.locks),
+            "acquired": self.acquired_count,
+            "contended": self.contended_count,
+            "timeouts": self.timeout_count,
+            "avg_wait_ms": self.total_wait / self.acquired_count * 1000 if self.acquired_count else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "waits_by_operation": dict(self.waits_by_operation)
+        }
+
+
+# Глобальный реестр блокировок
+user_locks = UserLockRegistry()